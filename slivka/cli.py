@@ -143,8 +143,12 @@ def start_scheduler(daemon, pid_file):
     os.environ.setdefault('SLIVKA_HOME', settings.directory.home)
     sys.path.append(settings.directory.home)
     import slivka.conf.logging
+    import slivka.db
     import slivka.scheduler
-    from slivka.scheduler.factory import runners_from_config
+    from slivka.scheduler.factory import (
+        garbage_collector_from_config, runners_from_config
+    )
+    from slivka.scheduler.scheduler import IntervalThread
     from slivka.scheduler.service_monitor import ServiceTest, ServiceTestExecutorThread
     from slivka.db.repositories import ServiceStatusMongoDBRepository
 
@@ -193,8 +197,22 @@ def start_scheduler(daemon, pid_file):
                     for test_conf in service_config.tests
                     if runner.name in test_conf.applicable_runners
                 )
+            collector = garbage_collector_from_config(
+                slivka.db.database, settings
+            )
+            collector_thread = (
+                IntervalThread(settings.retention.interval, collector.collect,
+                               name="GarbageCollector")
+                if collector is not None else None
+            )
             service_monitor.start()
+            if collector_thread is not None:
+                collector_thread.start()
             scheduler.run_forever()
+            if collector_thread is not None:
+                collector.stop()
+                collector_thread.cancel()
+                collector_thread.join()
             service_monitor.shutdown()
 
 
@@ -204,13 +222,23 @@ def start_scheduler(daemon, pid_file):
 @click.option('--daemon/--no-daemon', '-d')
 @click.option('--pid-file', '-p', default=None,
               type=click.Path(writable=True, resolve_path=True))
-def start_local_queue(address, workers, daemon, pid_file):
+@click.option('--journal', '-j', default=None,
+              type=click.Path(dir_okay=False, writable=True, resolve_path=True))
+@click.option('--worker-address', '-W', default=None)
+@click.option('--cores', '-c', default=None, type=float)
+@click.option('--memory', '-m', default=None)
+@click.option('--max-finished', default=1000000)
+@click.option('--finished-ttl', default=None, type=float)
+def start_local_queue(address, workers, daemon, pid_file, journal,
+                      worker_address, cores, memory, max_finished,
+                      finished_ttl):
     from slivka.conf import settings
     os.environ.setdefault('SLIVKA_HOME', settings.directory.home)
     sys.path.append(settings.directory.home)
     import asyncio
     import slivka.conf.logging
     from slivka.local_queue import LocalQueue
+    from slivka.scheduler.runners.shell import _parse_memory
 
     pidfile_ctx = TimeoutPIDLockFile(pid_file) if pid_file else nullcontext()
     daemon_args = dict(
@@ -224,8 +252,14 @@ def start_local_queue(address, workers, daemon, pid_file):
     with daemon_ctx:
         slivka.conf.logging.configure_logging()
         loop = asyncio.get_event_loop()
+        journal = journal or settings.local_queue.journal
+        if journal is not None:
+            journal = os.path.join(settings.directory.home, journal)
         queue = LocalQueue(
-            address=address or settings.local_queue.host, workers=workers
+            address=address or settings.local_queue.host, workers=workers,
+            journal=journal, worker_address=worker_address, cores=cores,
+            memory=_parse_memory(memory), max_finished=max_finished,
+            finished_ttl=finished_ttl
         )
         loop.add_signal_handler(signal.SIGTERM, queue.stop)
         loop.add_signal_handler(signal.SIGINT, queue.stop)
@@ -235,6 +269,42 @@ def start_local_queue(address, workers, daemon, pid_file):
         loop.close()
 
 
+@start.command('local-queue-worker')
+@click.option('--address', '-a', required=True)
+@click.option('--slots', '-s', default=2)
+@click.option('--name', '-n', default=None)
+@click.option('--daemon/--no-daemon', '-d')
+@click.option('--pid-file', '-p', default=None,
+              type=click.Path(writable=True, resolve_path=True))
+def start_local_queue_worker(address, slots, name, daemon, pid_file):
+    from slivka.conf import settings
+    os.environ.setdefault('SLIVKA_HOME', settings.directory.home)
+    sys.path.append(settings.directory.home)
+    import asyncio
+    import slivka.conf.logging
+    from slivka.local_queue import QueueWorker
+
+    pidfile_ctx = TimeoutPIDLockFile(pid_file) if pid_file else nullcontext()
+    daemon_args = dict(
+        pidfile=pidfile_ctx,
+        stdout=None,
+        stderr=None,
+    )
+    daemon_ctx = (DaemonContext(**daemon_args) if daemon
+                  else DummyDaemonContext(**daemon_args))
+
+    with daemon_ctx:
+        slivka.conf.logging.configure_logging()
+        loop = asyncio.get_event_loop()
+        worker = QueueWorker(address, slots=slots, name=name)
+        loop.add_signal_handler(signal.SIGTERM, worker.stop)
+        loop.add_signal_handler(signal.SIGINT, worker.stop)
+        with closing(worker):
+            worker.run(loop)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
 @start.command('shell',
                help='Set-up slivka and start interactive python console.')
 def start_shell():
@@ -245,6 +315,27 @@ def start_shell():
     code.interact()
 
 
+@main.command('collect-garbage')
+@click.option('--delay', type=float, default=None,
+              help="Pause in seconds between the deleted batches.")
+def collect_garbage(delay):
+    """Archive finished jobs and delete expired jobs and uploaded files."""
+    home = os.getenv('SLIVKA_HOME', os.getcwd())
+    os.environ['SLIVKA_HOME'] = os.path.abspath(home)
+    from slivka.conf import settings
+    import slivka.db
+    from slivka.scheduler.factory import garbage_collector_from_config
+    collector = garbage_collector_from_config(slivka.db.database, settings)
+    if collector is None:
+        click.echo("Retention and archival of jobs are not configured.")
+        return
+    if delay is not None:
+        collector.delay = delay
+    archived, jobs, uploads = collector.collect()
+    click.echo(f"Archived {archived} jobs. "
+               f"Deleted {jobs} jobs and {uploads} uploaded files.")
+
+
 @main.command('test-services')
 @click.argument('services', nargs=-1)
 def test_services(services):
@@ -0,0 +1,13 @@
+__all__ = [
+    'waitstatus_to_exitcode'
+]
+
+import os
+
+try:
+    from os import waitstatus_to_exitcode
+except ImportError:
+    def waitstatus_to_exitcode(status: int) -> int:
+        if os.WIFSIGNALED(status):
+            return -os.WTERMSIG(status)
+        return os.WEXITSTATUS(status)
@@ -155,6 +155,41 @@ def _parameters_converter(parameters: dict):
     return converted
 
 
+_duration_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value) -> typing.Optional[float]:
+    """ Converts the duration to seconds.
+
+    The duration is either a number of seconds, a number followed
+    by one of the s, m, h or d units, or the ``[D-][HH:]MM:SS``
+    clock format used by the queuing systems.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value.strip()
+    if value and value[-1].lower() in _duration_units:
+        try:
+            return float(value[:-1]) * _duration_units[value[-1].lower()]
+        except ValueError:
+            pass
+    elif ':' not in value and '-' not in value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    else:
+        days, sep, clock = value.rpartition('-')
+        parts = clock.split(':')
+        if (not sep or days.isdigit()) and len(parts) <= 3 and all(
+                re.match(r'^\d+(\.\d*)?$', part) for part in parts):
+            seconds = 0.0
+            for part in parts:
+                seconds = seconds * 60 + float(part)
+            return seconds + int(days or 0) * 86400
+    raise ValueError("Invalid duration %r" % value)
+
+
 @attrs(kw_only=True)
 class ServiceConfig:
     @attrs
@@ -182,9 +217,11 @@ class ServiceConfig:
             consts = attr.ib(type=dict, factory=dict)
             env = attr.ib(type=dict, factory=dict)
             selector_options = attr.ib(type=dict, factory=dict)
+            walltime = attr.ib(default=None, converter=parse_duration)
 
         runners = attr.ib(type=Dict[str, Runner])
         selector = attr.ib(type=str, default=None)
+        walltime = attr.ib(default=None, converter=parse_duration)
 
     @attrs
     class ServiceTest:
@@ -208,6 +245,7 @@ class ServiceConfig:
     outputs = attrib(type=List[OutputFile])
     execution = attrib(type=Execution)
     tests = attrib(type=List[ServiceTest], factory=list)
+    retention = attrib(default=None, converter=parse_duration)
 
 
 @attrs(kw_only=True)
@@ -230,6 +268,7 @@ class SlivkaSettings:
     @attrs
     class LocalQueue:
         host = attrib(default="127.0.0.1:4041")
+        journal = attrib(default=None)
 
     @attrs
     class MongoDB:
@@ -239,12 +278,22 @@ class SlivkaSettings:
         password = attrib(default=None)
         database = attrib(default="slivka")
 
+    @attrs
+    class Retention:
+        jobs = attrib(default=None, converter=parse_duration)
+        uploads = attrib(default=None, converter=parse_duration)
+        archive = attrib(default=None, converter=parse_duration)
+        interval = attrib(default=3600, converter=parse_duration)
+        batch_size = attrib(default=1000, converter=int)
+        delay = attrib(default=1, converter=parse_duration)
+
     settings_file = attrib(default=None, init=False)
     version = attrib(type=str)
     directory = attrib(type=Directory)
     server = attrib(type=Server)
     local_queue = attrib(type=LocalQueue)
     mongodb = attrib(type=MongoDB)
+    retention = attrib(type=Retention, factory=Retention)
     services = attrib(type=List[ServiceConfig])
 
 
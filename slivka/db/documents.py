@@ -1,5 +1,6 @@
 import enum
 import os
+import typing
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 from datetime import datetime
 
@@ -12,6 +13,8 @@ from slivka.utils import deprecated
 
 class MongoDocument(dict):
     __collection__ = None
+    # collection of the documents moved out of the main collection
+    __archive__ = None
 
     def _get_id(self) -> ObjectId: return self.get('_id')
     id = property(fget=_get_id)
@@ -25,8 +28,17 @@ class MongoDocument(dict):
         return database[cls.__collection__]
     collection = get_collection
 
+    @classmethod
+    def get_archive_collection(cls, database) \
+            -> typing.Optional[pymongo.collection.Collection]:
+        if cls.__archive__ is None:
+            return None
+        return database[cls.__archive__]
+    archive_collection = get_archive_collection
+
     @classmethod
     def find_one(cls, database, **kwargs):
+        """ Finds the document in the collection or in its archive. """
         _id = kwargs.pop('id', None)
         if isinstance(_id, ObjectId):
             kwargs['_id'] = _id
@@ -39,6 +51,8 @@ class MongoDocument(dict):
                 return None
             kwargs['_id'] = ObjectId(_id)
         item = database[cls.__collection__].find_one(kwargs)
+        if item is None and cls.__archive__ is not None:
+            item = database[cls.__archive__].find_one(kwargs)
         return cls(**item) if item is not None else None
 
     @classmethod
@@ -72,6 +86,7 @@ class MongoDocument(dict):
 
 class JobRequest(MongoDocument):
     __collection__ = 'requests'
+    __archive__ = 'requests_archive'
 
     class Job(dict):
         def __init__(self, *,
@@ -95,6 +110,10 @@ class JobRequest(MongoDocument):
                  status=None,
                  runner=None,
                  job=None,
+                 usage=None,
+                 estimated_completion_time=None,
+                 start_time=None,
+                 status_reason=None,
                  **kwargs):
         super().__init__(
             service=service,
@@ -104,6 +123,10 @@ class JobRequest(MongoDocument):
             status=status if status is not None else JobStatus.PENDING,
             runner=runner,
             job=self.Job(**job) if job else None,
+            usage=usage,
+            estimated_completion_time=estimated_completion_time,
+            start_time=start_time,
+            status_reason=status_reason,
             **kwargs
         )
 
@@ -129,6 +152,26 @@ class JobRequest(MongoDocument):
     def _set_job(self, val): self['job'] = val
     job = property(_get_job, _set_job)
 
+    def _get_usage(self): return self['usage']
+    def _set_usage(self, val): self['usage'] = val
+    usage = property(_get_usage, _set_usage)
+
+    def _get_estimated_completion_time(self):
+        return self['estimated_completion_time']
+
+    def _set_estimated_completion_time(self, val):
+        self['estimated_completion_time'] = val
+    estimated_completion_time = property(
+        _get_estimated_completion_time, _set_estimated_completion_time)
+
+    def _get_start_time(self): return self['start_time']
+    def _set_start_time(self, val): self['start_time'] = val
+    start_time = property(_get_start_time, _set_start_time)
+
+    def _get_status_reason(self): return self['status_reason']
+    def _set_status_reason(self, val): self['status_reason'] = val
+    status_reason = property(_get_status_reason, _set_status_reason)
+
 
 class CancelRequest(MongoDocument):
     __collection__ = 'cancelrequest'
@@ -145,6 +145,7 @@ def _create_date_matcher(expression):
 
 class UsageStatsMongoDBRepository:
     __requests_collection = "requests"
+    __requests_archive_collection = "requests_archive"
 
     def __init__(self, database=None):
         if database is None:
@@ -169,7 +170,11 @@ class UsageStatsMongoDBRepository:
             else:
                 raise ValueError(f"invalid name {name}")
 
-        pipeline = [{"$match": {"$and": matchers}}] if matchers else []
+        # the archive is created by the garbage collector if enabled,
+        # the union with a missing collection contributes no documents
+        pipeline = [{"$unionWith": self.__requests_archive_collection}]
+        if matchers:
+            pipeline.append({"$match": {"$and": matchers}})
         pipeline += [
             {"$group": {
                 "_id": {
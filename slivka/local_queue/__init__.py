@@ -1,2 +1,5 @@
-from .client import LocalQueueClient, RequestError
+from .client import (
+    AsyncLocalQueueClient, LocalQueueClient, RequestError, StatusSubscriber
+)
 from .server import LocalQueue
+from .worker import QueueWorker
@@ -1,70 +1,378 @@
+import asyncio
 import atexit
+import itertools
+import json
 import re
+import struct
 import threading
+import time
 from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
 
 import zmq
+import zmq.asyncio as aiozmq
 
 zmq_ctx = zmq.Context()
 atexit.register(zmq_ctx.destroy, 0)
 
+JobStatusResponse = namedtuple(
+    "JobStatus", 'id, state, returncode, usage', defaults=(None,)
+)
+
+
+def _normalize_address(address):
+    if not re.match(r'(\w*:)?//', address):
+        # if only host given, assume tcp://
+        address = "tcp://" + address
+    elif address.startswith('unix://'):
+        address = str.replace(address, 'unix', 'ipc', 1)
+    return address
+
+
+def _configure_socket(socket):
+    # keep the requests until connected instead of queueing them
+    # for the peers which are gone, reconnect at growing intervals
+    socket.setsockopt(zmq.IMMEDIATE, 1)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RECONNECT_IVL, 100)
+    socket.setsockopt(zmq.RECONNECT_IVL_MAX, 5000)
+
+
+def _chunks(messages, size):
+    if size is None:
+        return [messages]
+    return [messages[i:i + size] for i in range(0, len(messages), size)]
+
+
+def _check(response):
+    if not response.pop('ok'):
+        raise RequestError(response['error'])
+    return response
+
+
+def _request_timeout(timeout, messages):
+    # batches are given extra millisecond per ten requests
+    size = sum(len(m) if isinstance(m, list) else 1 for m in messages)
+    return timeout + size // 10 / 1000
+
+
+def _post_message(cmd, cwd, env, resources):
+    """ Creates the submission request.
+
+    The ``resources`` may contain the ``priority`` of the job and
+    the number of ``cores`` and the ``memory`` it uses.
+    """
+    return {'method': 'POST', 'cmd': cmd, 'cwd': cwd, 'env': env,
+            **resources}
+
 
 class LocalQueueClient(threading.local):
-    JobStatusResponse = namedtuple("JobStatus", 'id, state, returncode')
+    """ Client of the local queue server.
 
-    def __init__(self, address, secret=None):
+    Each thread uses its own DEALER socket. Every request is tagged
+    with an id so that multiple requests can be in flight at once
+    and the replies which arrive after the deadline are discarded.
+    The requests which are not answered within ``timeout`` seconds,
+    extended by a millisecond per ten batched messages, raise
+    :py:exc:`ConnectionError`. The socket reconnects to the server
+    automatically.
+    """
+    JobStatusResponse = JobStatusResponse
+
+    def __init__(self, address, secret=None, timeout=0.1):
         threading.local.__init__(self)
-        if not re.match(r'(\w*:)?//', address):
-            # if only host given, assume tcp://
-            address = "tcp://" + address
-        elif address.startswith('unix://'):
-            address = str.replace(address, 'unix', 'ipc', 1)
-        self.address = address
+        self.address = _normalize_address(address)
         self.secret = secret
-        self.socket = zmq_ctx.socket(zmq.REQ)
-        self.socket.setsockopt(zmq.RCVTIMEO, 100)
-        self.socket.setsockopt(zmq.REQ_RELAXED, 1)
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self.socket = zmq_ctx.socket(zmq.DEALER)
+        _configure_socket(self.socket)
         self.socket.connect(self.address)
 
-    def submit_job(self, cmd, cwd, env):
+    def request_many(self, messages, timeout=None) -> list:
+        """ Sends all the messages at once and waits for the replies.
+
+        A message can be a list of requests answered with a list
+        of responses.
+
+        :param messages: requests to send
+        :param timeout: deadline for all the replies in seconds
+        :return: responses in the order of the messages
+        """
+        if not messages:
+            return []
+        if timeout is None:
+            timeout = _request_timeout(self.timeout, messages)
+        deadline = time.monotonic() + timeout
+        pending: Dict[bytes, int] = {}
+        responses = [None] * len(messages)
         try:
-            self.socket.send_json(
-                {'method': 'POST', 'cmd': cmd, 'cwd': cwd, 'env': env},
-                flags=zmq.NOBLOCK
-            )
-            response = self.socket.recv_json()
+            for index, message in enumerate(messages):
+                request_id = struct.pack('!Q', next(self._ids))
+                pending[request_id] = index
+                remaining = deadline - time.monotonic()
+                if not self.socket.poll(max(remaining, 0) * 1000, zmq.POLLOUT):
+                    raise zmq.error.Again()
+                self.socket.send_multipart(
+                    [request_id, b'', json.dumps(message).encode()],
+                    flags=zmq.NOBLOCK
+                )
+            while pending:
+                remaining = deadline - time.monotonic()
+                if not self.socket.poll(max(remaining, 0) * 1000, zmq.POLLIN):
+                    raise zmq.error.Again()
+                request_id, _, payload = self.socket.recv_multipart()
+                index = pending.pop(request_id, None)
+                if index is not None:
+                    responses[index] = json.loads(payload)
         except zmq.error.Again:
             raise ConnectionError(
                 "Queue server at %s is not responding." % self.address
             ) from None
-        if response.pop('ok'):
-            return self.JobStatusResponse(**response)
-        else:
-            raise RequestError(response['error'])
+        return responses
+
+    def request(self, message, timeout=None):
+        (response,) = self.request_many([message], timeout)
+        return response
+
+    def _batch_request(self, messages, batch_size=None):
+        """ Sends the messages in lists of up to ``batch_size`` requests.
+
+        The lists are sent concurrently and the responses are joined.
+        """
+        if not messages:
+            return []
+        batches = self.request_many(_chunks(messages, batch_size))
+        return [_check(response) for batch in batches for response in batch]
+
+    def submit_job(self, cmd, cwd, env, **resources):
+        response = _check(
+            self.request(_post_message(cmd, cwd, env, resources))
+        )
+        return JobStatusResponse(**response)
 
     def get_job_status(self, id):
-        self.socket.send_json({'method': 'GET', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return self.JobStatusResponse(**response)
-        else:
-            raise RequestError(response['error'])
+        response = _check(self.request({'method': 'GET', 'id': id}))
+        return JobStatusResponse(**response)
 
     def cancel_job(self, id):
-        self.socket.send_json({'method': 'CANCEL', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return True
-        else:
-            raise RequestError(response['error'])
+        _check(self.request({'method': 'CANCEL', 'id': id}))
+        return True
 
     def release_job(self, id):
-        self.socket.send_json({'method': 'DELETE', 'id': id})
-        response = self.socket.recv_json()
-        if response.pop('ok'):
-            return True
-        else:
-            raise RequestError(response['error'])
+        _check(self.request({'method': 'DELETE', 'id': id}))
+        return True
+
+    def get_info(self):
+        """ Returns the notification address and the current sequence. """
+        return _check(self.request({'method': 'INFO'}))
+
+    def submit_jobs(self, jobs, batch_size=None, **resources):
+        """ Submits multiple jobs given as cmd, cwd, env triples. """
+        responses = self._batch_request(
+            [_post_message(cmd, cwd, env, resources)
+             for cmd, cwd, env in jobs],
+            batch_size
+        )
+        return [JobStatusResponse(**response) for response in responses]
+
+    def get_job_statuses(self, ids, batch_size=None):
+        responses = self._batch_request(
+            [{'method': 'GET', 'id': id} for id in ids], batch_size
+        )
+        return [JobStatusResponse(**response) for response in responses]
+
+    def cancel_jobs(self, ids, batch_size=None):
+        self._batch_request(
+            [{'method': 'CANCEL', 'id': id} for id in ids], batch_size
+        )
+        return True
+
+    def close(self):
+        self.socket.close()
+
+
+class AsyncLocalQueueClient:
+    """ Client of the local queue server for use with asyncio.
+
+    The requests made concurrently by multiple tasks are multiplexed
+    over a single DEALER socket and the replies are matched to the
+    requests by their ids. The client must be used from a single
+    event loop.
+    """
+    JobStatusResponse = JobStatusResponse
+
+    def __init__(self, address, secret=None, timeout=0.1):
+        self.address = _normalize_address(address)
+        self.secret = secret
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._ctx = aiozmq.Context.shadow(zmq_ctx.underlying)
+        self.socket: Optional[aiozmq.Socket] = None
+        self._pending: Dict[bytes, asyncio.Future] = {}
+        self._receiver: Optional[asyncio.Task] = None
+
+    def _connect(self):
+        if self.socket is None:
+            self.socket = self._ctx.socket(zmq.DEALER)
+            _configure_socket(self.socket)
+            self.socket.connect(self.address)
+        if self._receiver is None or self._receiver.done():
+            self._receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        while True:
+            request_id, _, payload = await self.socket.recv_multipart()
+            future = self._pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(json.loads(payload))
+
+    async def request_many(self, messages, timeout=None) -> list:
+        """ Sends all the messages at once and waits for the replies.
+
+        See :py:meth:`LocalQueueClient.request_many`.
+        """
+        if not messages:
+            return []
+        self._connect()
+        if timeout is None:
+            timeout = _request_timeout(self.timeout, messages)
+        loop = asyncio.get_event_loop()
+        request_ids = []
+        futures = []
+        try:
+            return await asyncio.wait_for(
+                self._send_all(messages, request_ids, futures, loop), timeout
+            )
+        except asyncio.TimeoutError:
+            raise ConnectionError(
+                "Queue server at %s is not responding." % self.address
+            ) from None
+        finally:
+            for request_id in request_ids:
+                self._pending.pop(request_id, None)
+
+    async def _send_all(self, messages, request_ids, futures, loop):
+        for message in messages:
+            request_id = struct.pack('!Q', next(self._ids))
+            future = loop.create_future()
+            self._pending[request_id] = future
+            request_ids.append(request_id)
+            futures.append(future)
+            await self.socket.send_multipart(
+                [request_id, b'', json.dumps(message).encode()]
+            )
+        return await asyncio.gather(*futures)
+
+    async def request(self, message, timeout=None):
+        (response,) = await self.request_many([message], timeout)
+        return response
+
+    async def _batch_request(self, messages, batch_size=None):
+        if not messages:
+            return []
+        batches = await self.request_many(_chunks(messages, batch_size))
+        return [_check(response) for batch in batches for response in batch]
+
+    async def submit_job(self, cmd, cwd, env, **resources):
+        response = _check(
+            await self.request(_post_message(cmd, cwd, env, resources))
+        )
+        return JobStatusResponse(**response)
+
+    async def get_job_status(self, id):
+        response = _check(await self.request({'method': 'GET', 'id': id}))
+        return JobStatusResponse(**response)
+
+    async def cancel_job(self, id):
+        _check(await self.request({'method': 'CANCEL', 'id': id}))
+        return True
+
+    async def release_job(self, id):
+        _check(await self.request({'method': 'DELETE', 'id': id}))
+        return True
+
+    async def get_info(self):
+        return _check(await self.request({'method': 'INFO'}))
+
+    async def submit_jobs(self, jobs, batch_size=None, **resources):
+        responses = await self._batch_request(
+            [_post_message(cmd, cwd, env, resources)
+             for cmd, cwd, env in jobs],
+            batch_size
+        )
+        return [JobStatusResponse(**response) for response in responses]
+
+    async def get_job_statuses(self, ids, batch_size=None):
+        responses = await self._batch_request(
+            [{'method': 'GET', 'id': id} for id in ids], batch_size
+        )
+        return [JobStatusResponse(**response) for response in responses]
+
+    async def cancel_jobs(self, ids, batch_size=None):
+        await self._batch_request(
+            [{'method': 'CANCEL', 'id': id} for id in ids], batch_size
+        )
+        return True
+
+    def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class StatusSubscriber:
+    """ Receiver of the job state notifications published by the queue.
+
+    The subscriber is not thread-safe.
+
+    :param address: address of the queue notification socket
+    :param epoch: epoch of the queue process
+    :param seq: sequence number of the last notification
+    """
+    StateUpdate = namedtuple("StateUpdate", 'id, state, returncode')
+
+    def __init__(self, address, epoch, seq):
+        self.epoch = epoch
+        self.seq = seq
+        self.socket = zmq_ctx.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.socket.connect(address)
+
+    def receive(self) -> Tuple[List[StateUpdate], bool]:
+        """ Reads the pending notifications without waiting.
+
+        :return: list of state updates and whether any notifications
+            were lost since the last call
+        """
+        updates = []
+        gap = False
+        while True:
+            try:
+                message = self.socket.recv_json(flags=zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            seq = message['seq']
+            if message['epoch'] != self.epoch:
+                # the queue was restarted
+                self.epoch = message['epoch']
+                gap = True
+            elif 'id' not in message:
+                # heartbeat reporting the last sequence number
+                gap = gap or seq != self.seq
+            else:
+                gap = gap or seq != self.seq + 1
+                updates.append(self.StateUpdate(
+                    message['id'], message['state'], message['returncode']
+                ))
+            self.seq = seq
+        return updates, gap
+
+    def close(self):
+        self.socket.close(linger=0)
 
 
 class RequestError(RuntimeError):
@@ -0,0 +1,166 @@
+""" Compact storage of the local queue jobs.
+
+Only the jobs which are queued or running are kept as the complete
+:py:class:`Job` objects. Once the job finishes, it is reduced to its
+id, state, return code and resource usage stored in arrays, which
+take a few tens of bytes per job, and the finished jobs are evicted
+when there are too many of them or they are too old.
+
+The environments of the jobs are interned, so the jobs submitted
+with the same environment share a single dictionary.
+"""
+import math
+import time
+import weakref
+from array import array
+from typing import Dict, NamedTuple, Optional
+
+from slivka import JobStatus
+
+
+class _Env(dict):
+    """ Dictionary which can be referenced weakly. """
+    __slots__ = ('__weakref__',)
+
+
+_interned_envs = weakref.WeakValueDictionary()
+
+
+def intern_env(env: dict) -> dict:
+    """ Returns the shared dictionary equal to the given environment.
+
+    The returned dictionary must not be modified.
+    """
+    key = frozenset(env.items())
+    shared = _interned_envs.get(key)
+    if shared is None:
+        shared = _interned_envs[key] = _Env(env)
+    return shared
+
+
+_usage_keys = ('queue_time', 'wall_time', 'cpu_time', 'max_rss')
+
+
+class JobRecord(NamedTuple):
+    """ Record of the finished job. """
+    id: int
+    state: JobStatus
+    return_code: int
+    usage: Optional[dict] = None
+
+
+class JobTable:
+    """ Table of the active and finished jobs.
+
+    :param max_finished: number of the most recent finished jobs kept
+    :param finished_ttl: time in seconds the finished jobs are kept for,
+        unlimited if None
+    """
+
+    def __init__(self, max_finished=1000000, finished_ttl=None):
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        #: queued and running jobs by id
+        self.active = {}
+        # finished jobs in the order of completion, the record
+        # at position ``p`` is stored at index ``p - self._base``
+        self._ids = array('q')
+        self._states = array('b')
+        self._return_codes = array('i')
+        self._times = array('d')
+        # resource usage values, NaN if unknown
+        self._usage = tuple(array('d') for _ in _usage_keys)
+        self._base = 0
+        self._positions = {}  # type: Dict[int, int]
+
+    def __len__(self):
+        return len(self.active) + len(self._positions)
+
+    def __contains__(self, job_id):
+        return job_id in self.active or job_id in self._positions
+
+    def __getitem__(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def get(self, job_id, default=None):
+        """ Returns the active job or the record of the finished job. """
+        job = self.active.get(job_id)
+        if job is not None:
+            return job
+        position = self._positions.get(job_id)
+        if position is None:
+            return default
+        index = position - self._base
+        usage = {
+            key: None if math.isnan(column[index]) else column[index]
+            for key, column in zip(_usage_keys, self._usage)
+        }
+        return JobRecord(
+            job_id,
+            JobStatus(self._states[index]),
+            self._return_codes[index],
+            usage if any(v is not None for v in usage.values()) else None
+        )
+
+    def get_active(self, job_id):
+        """ Returns the job if it is queued or running, otherwise None. """
+        return self.active.get(job_id)
+
+    def add(self, job):
+        """ Adds the job, storing only the record if it is finished. """
+        if job.state.is_finished():
+            self._add_finished(job.id, job.state, job.return_code, job.usage)
+        else:
+            self.active[job.id] = job
+
+    def finish(self, job):
+        """ Replaces the finished job with its record. """
+        if self.active.pop(job.id, None) is not None:
+            self._add_finished(job.id, job.state, job.return_code, job.usage)
+
+    def _add_finished(self, job_id, state, return_code, usage=None):
+        self._positions[job_id] = self._base + len(self._ids)
+        self._ids.append(job_id)
+        self._states.append(state)
+        self._return_codes.append(return_code)
+        self._times.append(time.time())
+        usage = usage or {}
+        for key, column in zip(_usage_keys, self._usage):
+            value = usage.get(key)
+            column.append(math.nan if value is None else value)
+        # evict in batches to amortise moving the arrays
+        if len(self._ids) > self.max_finished + self.max_finished // 16:
+            self.evict()
+
+    def delete(self, job_id):
+        """ Removes the job from the table. """
+        if self.active.pop(job_id, None) is None:
+            # the record stays in the arrays until evicted
+            self._positions.pop(job_id, None)
+
+    def evict(self, now=None) -> int:
+        """ Removes the oldest finished jobs over the limits.
+
+        :return: number of removed records
+        """
+        count = max(len(self._ids) - self.max_finished, 0)
+        if self.finished_ttl is not None:
+            deadline = (now or time.time()) - self.finished_ttl
+            times = self._times
+            while count < len(times) and times[count] < deadline:
+                count += 1
+        if count == 0:
+            return 0
+        for index in range(count):
+            job_id = self._ids[index]
+            # skip the records of deleted jobs
+            if self._positions.get(job_id) == self._base + index:
+                del self._positions[job_id]
+        for column in (self._ids, self._states, self._return_codes,
+                       self._times, *self._usage):
+            del column[:count]
+        self._base += count
+        return count
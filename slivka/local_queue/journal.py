@@ -0,0 +1,177 @@
+""" Persistent record of the local queue jobs.
+
+The :py:class:`JobJournal` stores the submitted jobs and their state
+transitions in an SQLite database so the queue can restore them
+after the restart. The writes are collected and committed in batches
+by a single background thread, so the event loop of the queue is not
+blocked by the disk access.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from slivka import JobStatus
+
+log = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY,
+  cmd TEXT NOT NULL,
+  cwd TEXT NOT NULL,
+  env TEXT NOT NULL,
+  priority INTEGER NOT NULL DEFAULT 0,
+  cores REAL NOT NULL DEFAULT 1,
+  memory REAL NOT NULL DEFAULT 0,
+  state INTEGER NOT NULL,
+  return_code INTEGER,
+  updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_updated ON jobs (state, updated);
+"""
+
+_final_states = tuple(
+    int(state) for state in JobStatus if state.is_finished()
+)
+
+
+class JournalEntry(NamedTuple):
+    id: int
+    cmd: str
+    cwd: str
+    env: dict
+    state: JobStatus
+    return_code: Optional[int]
+    priority: int = 0
+    cores: float = 1
+    memory: float = 0
+
+
+class JobJournal:
+    """ SQLite-backed store of the jobs and their states.
+
+    :param path: path to the database file
+    :param max_finished: number of the most recent finished jobs
+        retained by :py:meth:`compact`
+    """
+
+    def __init__(self, path, max_finished=1000000):
+        self.path = path
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='job-journal'
+        )
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_schema)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._pending_inserts = []
+        self._pending_updates = {}
+        self._pending_deletes = []
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def load(self) -> List[JournalEntry]:
+        """ Reads all the jobs stored in the journal ordered by id. """
+        cursor = self._conn.execute(
+            'SELECT id, cmd, cwd, env, state, return_code, priority, cores, '
+            'memory FROM jobs ORDER BY id'
+        )
+        return [
+            JournalEntry(id, cmd, cwd, json.loads(env), JobStatus(state), rc,
+                         priority, cores, memory)
+            for id, cmd, cwd, env, state, rc, priority, cores, memory in cursor
+        ]
+
+    def add(self, job):
+        """ Stores the new job. """
+        with self._lock:
+            self._pending_inserts.append((
+                job.id, job.cmd, job.cwd, json.dumps(job.env), job.priority,
+                job.cores, job.memory, int(job.state), None, time.time()
+            ))
+            self._schedule_flush()
+
+    def update(self, job):
+        """ Stores the current state and return code of the job. """
+        with self._lock:
+            self._pending_updates[job.id] = (
+                int(job.state), job.return_code, time.time(), job.id
+            )
+            self._schedule_flush()
+
+    def delete(self, job_id):
+        with self._lock:
+            self._pending_deletes.append((job_id,))
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._executor.submit(self.flush)
+
+    def flush(self):
+        """ Writes the pending changes in a single transaction. """
+        with self._lock:
+            inserts, self._pending_inserts = self._pending_inserts, []
+            updates, self._pending_updates = self._pending_updates, {}
+            deletes, self._pending_deletes = self._pending_deletes, []
+            self._flush_scheduled = False
+        if not (inserts or updates or deletes):
+            return
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO jobs '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    inserts
+                )
+                self._conn.executemany(
+                    'UPDATE jobs SET state = ?, return_code = ?, updated = ? '
+                    'WHERE id = ?',
+                    updates.values()
+                )
+                self._conn.executemany('DELETE FROM jobs WHERE id = ?', deletes)
+        except sqlite3.Error:
+            log.exception("Writing to the job journal failed.")
+
+    def compact(self, older_than=None):
+        """ Removes the finished jobs from the journal.
+
+        Only the ``max_finished`` most recent finished jobs are kept
+        and, if ``older_than`` is given, the jobs finished more than
+        that many seconds ago are removed.
+        """
+        placeholders = ','.join('?' * len(_final_states))
+        with self._conn:
+            deleted = self._conn.execute(
+                'DELETE FROM jobs WHERE id IN ('
+                '  SELECT id FROM jobs WHERE state IN (%s)'
+                '  ORDER BY updated DESC LIMIT -1 OFFSET ?'
+                ')' % placeholders,
+                (*_final_states, self.max_finished)
+            ).rowcount
+            if older_than is not None:
+                deleted += self._conn.execute(
+                    'DELETE FROM jobs WHERE state IN (%s) AND updated < ?'
+                    % placeholders,
+                    (*_final_states, time.time() - older_than)
+                ).rowcount
+        if deleted:
+            log.info("Removed %d finished jobs from the journal.", deleted)
+        return deleted
+
+    async def run_in_executor(self, func, *args):
+        """ Runs the function in the journal thread. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.submit(self.flush)
+        self._executor.shutdown(wait=True)
+        self._conn.close()
@@ -1,17 +1,23 @@
 import asyncio
+import heapq
 import itertools
+import json
 import logging
 import os
 import re
+import subprocess
+import threading
 import time
 from functools import partial
-from typing import Dict
+from typing import Dict, Optional
 
 import attr
 import zmq
 import zmq.asyncio as aiozmq
 from slivka import JobStatus
-from slivka.utils import LimitedSizeDict
+from slivka.compat.os import waitstatus_to_exitcode
+from .jobtable import JobTable, intern_env
+from .journal import JobJournal
 
 try:
     get_running_loop = asyncio.get_running_loop
@@ -27,8 +33,9 @@ def _job_id_factory():
 
 
 def _job_env_converter(env):
-    env.setdefault("PATH", os.getenv("PATH"))
-    return env
+    if "PATH" not in env:
+        env = {**env, "PATH": os.getenv("PATH")}
+    return intern_env(env)
 
 
 @attr.s(slots=True)
@@ -38,17 +45,208 @@ class Job:
     cwd = attr.ib(type=str)
     env = attr.ib(default={}, type=dict, converter=_job_env_converter, repr=False)
     state = attr.ib(default=JobStatus.QUEUED)
+    priority = attr.ib(default=0, type=int, kw_only=True)
+    cores = attr.ib(default=1, type=float, kw_only=True)
+    memory = attr.ib(default=0, type=float, kw_only=True)
     return_code = attr.ib(default=255, type=int, init=False)
+    queued_time = attr.ib(factory=time.monotonic, init=False, repr=False)
+    start_time = attr.ib(default=None, type=float, init=False, repr=False)
+    usage = attr.ib(default=None, type=dict, init=False, repr=False)
     worker = attr.ib(default=None, type=asyncio.Task, init=False, repr=False)
+    node = attr.ib(default=None, type=bytes, init=False, repr=False)
 
 
 _null_job = Job('', '', state=JobStatus.UNKNOWN)
 
 
+def _return_code_state(return_code):
+    return (
+        JobStatus.COMPLETED if return_code == 0 else
+        JobStatus.ERROR if return_code == 127 else
+        JobStatus.FAILED if return_code > 0 else
+        JobStatus.INTERRUPTED
+    )
+
+
+def _wait_in_thread(loop, pid) -> asyncio.Future:
+    """ Reaps the process with ``wait4`` in a thread of its own.
+
+    A dedicated thread is used rather than the default executor,
+    whose limited threads would be held by the running jobs and
+    delay the completions of the others.
+    """
+    future = loop.create_future()
+
+    def resolve(result, exception):
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def wait():
+        result, exception = None, None
+        try:
+            result = os.wait4(pid, 0)
+        except OSError as e:
+            exception = e
+        try:
+            loop.call_soon_threadsafe(resolve, result, exception)
+        except RuntimeError:
+            pass  # the loop is closed
+
+    threading.Thread(
+        target=wait, name='process-waiter-%d' % pid, daemon=True
+    ).start()
+    return future
+
+
+async def _wait_process(proc: subprocess.Popen):
+    """ Waits for the process to exit returning its return code and rusage.
+
+    The process is reaped with ``wait4`` once its pid file descriptor
+    becomes readable or, where pidfd is not available, in a separate
+    thread.
+    """
+    loop = get_running_loop()
+    try:
+        fd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        _pid, status, rusage = await _wait_in_thread(loop, proc.pid)
+    else:
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+        _pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = waitstatus_to_exitcode(status)
+    return proc.returncode, rusage
+
+
+async def _execute_job(job, logger):
+    """ Runs the job process setting its final state, return code
+    and the resources used.
+    """
+    try:
+        stdout = open(os.path.join(job.cwd, 'stdout'), 'wb')
+        stderr = open(os.path.join(job.cwd, 'stderr'), 'wb')
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            job.cmd,
+            shell=True,
+            stdout=stdout,
+            stderr=stderr,
+            cwd=job.cwd,
+            env=job.env
+        )
+    except OSError:
+        logger.exception(
+            "System error occurred when starting the job %r", job)
+        job.state = JobStatus.ERROR
+        raise
+    # the process is waited for after the cancellation as well
+    waiter = asyncio.ensure_future(_wait_process(proc))
+    try:
+        return_code, rusage = await asyncio.shield(waiter)
+        job.return_code = return_code
+        job.state = _return_code_state(return_code)
+        logger.info('%r completed with status %d', job, return_code)
+    except asyncio.CancelledError:
+        logger.info('terminating a running process')
+        proc.terminate()
+        job.return_code, rusage = await waiter
+        job.state = JobStatus.INTERRUPTED
+    finally:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+        stdout.close()
+        stderr.close()
+    job.usage = {
+        'wall_time': time.monotonic() - started,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss
+    }
+
+
+class _RemoteNode:
+    """ Worker process connected to the queue from another host. """
+    __slots__ = ('identity', 'name', 'slots', 'jobs', 'last_seen')
+
+    def __init__(self, identity, name, slots, jobs=()):
+        self.identity: bytes = identity
+        self.name: str = name
+        self.slots: float = slots
+        # cores used by each job, jobs of unknown size use one
+        self.jobs: Dict[int, float] = dict.fromkeys(jobs, 1)
+        self.last_seen = time.monotonic()
+
+    @property
+    def free_slots(self):
+        return self.slots - sum(self.jobs.values())
+
+
 class LocalQueue:
+    """ Simple queue running the jobs on the local machine.
+
+    Finished jobs are reduced to their states and return codes and
+    only ``max_finished`` most recent ones are kept, for no longer
+    than ``finished_ttl`` seconds if given.
+
+    If the ``journal`` path is given, the jobs and their states are
+    stored in the journal database and restored when the queue
+    is started again. Queued jobs are enqueued again and the jobs which
+    were running when the queue stopped are marked as interrupted.
+    The journal is compacted every ``compact_interval`` seconds.
+
+    The state transitions of the jobs are published on the PUB socket
+    bound to the ``notify_address``, which defaults to a random port
+    of the same host for tcp, or to the socket path with the *.pub*
+    suffix for ipc. Each notification carries a sequence number,
+    consecutive within the ``epoch`` of the queue process, so the
+    subscribers can detect lost messages. The current sequence
+    number is published every ``heartbeat_interval`` seconds.
+
+    The jobs are started in the order of their priorities and then
+    the submission order. Each job uses the number of ``cores`` and
+    the amount of ``memory`` given on submission, out of the ``cores``
+    (by default, equal to the number of ``workers``) and ``memory``
+    available to the queue, and no more than ``workers`` jobs run at
+    once. When the first waiting job does not fit in the free
+    resources, the smaller jobs behind it, among the first
+    ``backfill_window`` ones, are started instead unless it has been
+    waiting for more than ``starvation_limit`` seconds. Then
+    the resources are held until the waiting job can start.
+    Jobs exceeding the resources of the queue are rejected.
+
+    If the ``worker_address`` is given, the queue also accepts remote
+    worker processes (see :py:class:`slivka.local_queue.QueueWorker`)
+    connecting to the ROUTER socket bound to that address. The workers
+    advertise their slots in heartbeats, each slot running one core
+    of a job, and the jobs which do not fit in the local resources
+    are sent to the worker with the most free slots. The jobs larger
+    than any of the connected workers are rejected, while the jobs
+    submitted before any worker connects wait for the one large
+    enough, without holding the resources of the others. The jobs of
+    the workers which were not heard of for ``worker_timeout`` seconds
+    are interrupted.
+    """
     zmq_ctx = aiozmq.Context()
+    compact_interval = 3600
+    heartbeat_interval = 5
+    worker_timeout = 15
+    backfill_window = 64
+    starvation_limit = 600
+    evict_interval = 60
 
-    def __init__(self, address, workers=1, secret=None):
+    def __init__(self, address, workers=1, secret=None, journal=None,
+                 notify_address=None, worker_address=None, cores=None,
+                 memory=None, max_finished=1000000, finished_ttl=None):
         self.logger = logging.getLogger(__name__)
         if not re.match(r'(\w*:)?//', address):
             # if only host given, assume tcp://
@@ -60,108 +258,332 @@ class LocalQueue:
         self.secret = secret
         if not secret:
             self.logger.warning('No secret used.')
-        self.queue = asyncio.Queue()
+        self.cores = workers if cores is None else cores
+        self.memory = memory
+        # heap of the (-priority, sequence number, job) entries
+        self.queue = []
+        self._queue_seq = itertools.count()
+        self._used_cores = 0
+        self._used_memory = 0
+        self._wakeup = asyncio.Event()
         self.workers = set()
-        self.jobs = LimitedSizeDict(1000000)  # type: Dict[int, Job]
+        self.jobs = JobTable(max_finished, finished_ttl)
+        self.journal = (
+            JobJournal(journal, max_finished=max_finished)
+            if journal else None
+        )
+        if notify_address is None:
+            if address.startswith('ipc://'):
+                notify_address = address + '.pub'
+            else:
+                notify_address = address.rsplit(':', 1)[0] + ':*'
+        self.notify_address = notify_address
+        self.epoch = os.urandom(4).hex()
+        self._seq = 0
+        self._publisher = None
+        self.worker_address = worker_address
+        self.nodes = {}  # type: Dict[bytes, _RemoteNode]
+        self._router = None
         self._main_coro = None
 
+    def _record(self, job):
+        if job.state.is_finished():
+            if job.usage is not None and job.start_time is not None:
+                job.usage['queue_time'] = job.start_time - job.queued_time
+            self.jobs.finish(job)
+        if self.journal is not None:
+            self.journal.update(job)
+        if self._publisher is not None:
+            self._seq += 1
+            self._publish({
+                'epoch': self.epoch,
+                'seq': self._seq,
+                'id': job.id,
+                'state': job.state,
+                'returncode': job.return_code
+            })
+
+    def _publish(self, message):
+        try:
+            self._publisher.send_json(message, flags=zmq.NOBLOCK)
+        except zmq.Again:
+            pass  # subscribers detect the gap in sequence numbers
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self._publish({'epoch': self.epoch, 'seq': self._seq})
+
+    async def _restore(self):
+        """ Loads the jobs from the journal. """
+        entries = await self.journal.run_in_executor(self.journal.load)
+        queued = 0
+        for entry in entries:
+            job = Job(entry.cmd, entry.cwd, entry.env, state=entry.state,
+                      priority=entry.priority, cores=entry.cores,
+                      memory=entry.memory)
+            job.id = entry.id
+            if entry.return_code is not None:
+                job.return_code = entry.return_code
+            if job.state == JobStatus.RUNNING:
+                # the process did not outlive the queue
+                job.state = JobStatus.INTERRUPTED
+                self._record(job)
+            elif job.state == JobStatus.QUEUED:
+                self._enqueue(job)
+                queued += 1
+            self.jobs.add(job)
+        self.logger.info(
+            'restored %d jobs from the journal, %d queued',
+            len(entries), queued
+        )
+
+    async def _compactor(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            await self.journal.run_in_executor(
+                self.journal.compact, self.jobs.finished_ttl
+            )
+
+    async def _evictor(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            evicted = self.jobs.evict()
+            if evicted:
+                self.logger.info('evicted %d finished jobs', evicted)
+
     async def _worker(self, job):
         self.logger.info('executing %r', job)
         job.state = JobStatus.RUNNING
+        self._record(job)
         try:
-            stdout = open(os.path.join(job.cwd, 'stdout'), 'wb')
-            stderr = open(os.path.join(job.cwd, 'stderr'), 'wb')
-            proc = await asyncio.create_subprocess_shell(
-                job.cmd,
-                stdout=stdout,
-                stderr=stderr,
-                cwd=job.cwd,
-                env=job.env
-            )
-        except OSError:
-            self.logger.exception(
-                "System error occurred when starting the job %r", job)
-            job.state = JobStatus.ERROR
-            raise
-        except asyncio.CancelledError:
-            job.state = JobStatus.INTERRUPTED
-            return
-        try:
-            return_code = await proc.wait()
-            job.return_code = return_code
-            job.state = (
-                JobStatus.COMPLETED if return_code == 0 else
-                JobStatus.ERROR if return_code == 127 else
-                JobStatus.FAILED if return_code > 0 else
-                JobStatus.INTERRUPTED
-            )
-            self.logger.info('%r completed with status %d', job, return_code)
-        except asyncio.CancelledError:
-            self.logger.info('terminating a running process')
-            proc.terminate()
-            job.return_code = await proc.wait()
-            job.state = JobStatus.INTERRUPTED
+            await _execute_job(job, self.logger)
         finally:
+            self._record(job)
+
+    def _enqueue(self, job):
+        heapq.heappush(self.queue, (-job.priority, next(self._queue_seq), job))
+        self._wakeup.set()
+
+    def _fits_local(self, job):
+        return (
+            len(self.workers) < self.num_workers and
+            self._used_cores + job.cores <= self.cores and
+            (self.memory is None or
+             self._used_memory + job.memory <= self.memory)
+        )
+
+    def _fits_capacity(self, job):
+        """ Returns whether the job fits in the local resources or
+        in any of the connected nodes once they are all free.
+        """
+        fits_local = (
+            self.num_workers > 0 and
+            job.cores <= self.cores and
+            (self.memory is None or job.memory <= self.memory)
+        )
+        return fits_local or any(
+            node.slots >= job.cores for node in self.nodes.values()
+        )
+
+    def _pick_node(self, job) -> Optional[_RemoteNode]:
+        node = max(self.nodes.values(), key=lambda n: n.free_slots,
+                   default=None)
+        if node is None or node.free_slots < job.cores:
+            return None
+        return node
+
+    def _schedule(self, loop):
+        """ Starts the waiting jobs which fit in the free resources.
+
+        The jobs are taken from the top of the queue. The ones that
+        do not fit are skipped, so the smaller jobs behind them can
+        start, unless the skipped job waits for too long.
+        """
+        skipped = []
+        now = time.monotonic()
+        while self.queue and len(skipped) < self.backfill_window:
+            entry = heapq.heappop(self.queue)
+            job = entry[2]
+            if job.state != JobStatus.QUEUED:
+                continue
+            if self._fits_local(job):
+                self._start_local(job, loop)
+                continue
+            node = self._pick_node(job)
+            if node is not None:
+                self._start_remote(job, node)
+                continue
+            skipped.append(entry)
+            # holding the resources is pointless if the job cannot
+            # start even when all of them are released
+            if (now - job.queued_time > self.starvation_limit and
+                    self._fits_capacity(job)):
+                # hold the resources being released for this job
+                break
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+
+    def _start_local(self, job, loop):
+        job.start_time = time.monotonic()
+        self._used_cores += job.cores
+        self._used_memory += job.memory
+        worker = loop.create_task(self._worker(job))  # type: asyncio.Task
+        self.workers.add(worker)
+        job.worker = worker
+        worker.add_done_callback(partial(self._worker_cleanup, job))
+
+    def _worker_cleanup(self, job: Job, fut: asyncio.Future):
+        self._used_cores -= job.cores
+        self._used_memory -= job.memory
+        job.worker = None
+        self.workers.remove(fut)
+        self._wakeup.set()
+        if not fut.cancelled() and fut.exception() is not None:
+            self.logger.error(
+                "An exception occurred when running a job %r",
+                fut.exception()
+            )
+
+    def _start_remote(self, job, node):
+        self.logger.info('sending %r to worker %s', job, node.name)
+        job.state = JobStatus.RUNNING
+        job.start_time = time.monotonic()
+        job.node = node.identity
+        node.jobs[job.id] = job.cores
+        self._send_node(node.identity, {
+            'type': 'RUN', 'id': job.id, 'cmd': job.cmd,
+            'cwd': job.cwd, 'env': job.env
+        })
+        self._record(job)
+
+    async def _scheduler(self, loop):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            self._schedule(loop)
+
+    def _send_node(self, identity, message):
+        self._router.send_multipart([identity, json.dumps(message).encode()])
+
+    async def serve_workers(self):
+        self._router = self.zmq_ctx.socket(zmq.ROUTER)
+        self._router.bind(self.worker_address)
+        self.worker_address = self._router.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.logger.info('ROUTER socket bound to %s', self.worker_address)
+        while True:
+            frames = await self._router.recv_multipart()
+            if len(frames) != 2:
+                # not a worker, e.g. a client connected to the wrong port
+                self.logger.warning(
+                    "Dropped malformed worker message of %d frames",
+                    len(frames)
+                )
+                continue
+            identity, payload = frames
             try:
-                proc.kill()
-            except OSError:
-                pass
-            stdout.close()
-            stderr.close()
-
-    async def _consumer(self, loop):
-        lock = asyncio.BoundedSemaphore(self.num_workers)
-
-        def worker_cleanup(job: Job, fut: asyncio.Future):
-            lock.release()
-            job.worker = None
-            self.workers.remove(fut)
-            if fut.exception() is not None:
-                self.logger.error(
-                    "An exception occurred when running a job %r",
-                    fut.exception()
+                self._handle_node_message(identity, json.loads(payload))
+            except Exception:
+                self.logger.exception("Error during worker message processing")
+
+    def _handle_node_message(self, identity, message):
+        node = self.nodes.get(identity)
+        if message['type'] == 'HEARTBEAT':
+            if node is None:
+                node = _RemoteNode(
+                    identity, message['name'], message['slots'],
+                    message.get('running', ())
+                )
+                self.nodes[identity] = node
+                self.logger.info(
+                    'worker %s connected with %d slots', node.name, node.slots
                 )
+            node.slots = message['slots']
+            node.last_seen = time.monotonic()
+        elif message['type'] == 'STATE':
+            if node is not None:
+                node.jobs.pop(message['id'], None)
+                node.last_seen = time.monotonic()
+            job = self.jobs.get_active(message['id'])
+            if job is not None and job.node == identity:
+                job.node = None
+                job.state = JobStatus(message['state'])
+                job.return_code = message['returncode']
+                job.usage = message.get('usage')
+                self.logger.info(
+                    '%r completed with status %d', job, job.return_code
+                )
+                self._record(job)
+        elif message['type'] == 'BYE' and node is not None:
+            self.logger.info('worker %s disconnected', node.name)
+            self._remove_node(node)
+        self._wakeup.set()
+
+    def _remove_node(self, node: _RemoteNode):
+        del self.nodes[node.identity]
+        for job_id in node.jobs:
+            job = self.jobs.get_active(job_id)
+            if job is not None and job.node == node.identity:
+                job.node = None
+                job.state = JobStatus.INTERRUPTED
+                self._record(job)
 
+    async def _node_monitor(self):
         while True:
-            await lock.acquire()
-            job = await self.queue.get()
-            if job.state != JobStatus.QUEUED:
-                lock.release()
-                continue
-            assert job.id in self.jobs
-            worker = loop.create_task(self._worker(job))  # type: asyncio.Task
-            self.workers.add(worker)
-            job.worker = worker
-            worker.add_done_callback(partial(worker_cleanup, job))
+            await asyncio.sleep(self.heartbeat_interval)
+            deadline = time.monotonic() - self.worker_timeout
+            for node in list(self.nodes.values()):
+                if node.last_seen < deadline:
+                    self.logger.warning(
+                        'worker %s not responding, interrupting %d jobs',
+                        node.name, len(node.jobs)
+                    )
+                    self._remove_node(node)
 
     async def serve_forever(self):
         self.logger.info('starting server')
-        socket = self.zmq_ctx.socket(zmq.REP)
+        # ROUTER serves both the REQ clients and the DEALER clients
+        # pipelining multiple requests
+        socket = self.zmq_ctx.socket(zmq.ROUTER)
         socket.bind(self.address)
-        self.logger.info('REP socket bound to %s', self.address)
+        self.logger.info('ROUTER socket bound to %s', self.address)
         while True:
-            message = await socket.recv_json()
+            *envelope, payload = await socket.recv_multipart()
             try:
-                if message['method'] == 'GET':
-                    response = self.do_GET(message)
-                elif message['method'] == 'POST':
-                    response = self.do_POST(message)
-                elif message['method'] == 'CANCEL':
-                    response = self.do_CANCEL(message)
-                elif message['method'] == 'DELETE':
-                    response = self.do_DELETE(message)
+                message = json.loads(payload)
+            except ValueError:
+                response = {'ok': False, 'error': 'invalid-message'}
+            else:
+                if isinstance(message, list):
+                    # batch of requests answered with a list of responses
+                    response = list(map(self.dispatch, message))
                 else:
-                    response = {
-                        'ok': False,
-                        'error': 'invalid-method'
-                    }
-            except Exception:
-                self.logger.exception("Error during message processing")
-                response = {
+                    response = self.dispatch(message)
+            socket.send_multipart(envelope + [json.dumps(response).encode()])
+
+    def dispatch(self, message):
+        try:
+            if message['method'] == 'GET':
+                return self.do_GET(message)
+            elif message['method'] == 'POST':
+                return self.do_POST(message)
+            elif message['method'] == 'CANCEL':
+                return self.do_CANCEL(message)
+            elif message['method'] == 'DELETE':
+                return self.do_DELETE(message)
+            elif message['method'] == 'INFO':
+                return self.do_INFO(message)
+            else:
+                return {
                     'ok': False,
-                    'error': 'invalid-message'
+                    'error': 'invalid-method'
                 }
-            socket.send_json(response)
+        except Exception:
+            self.logger.exception("Error during message processing")
+            return {
+                'ok': False,
+                'error': 'invalid-message'
+            }
 
     def do_GET(self, msg):
         job = self.jobs.get(msg['id'], _null_job)
@@ -169,17 +591,31 @@ class LocalQueue:
             'ok': True,
             'id': job.id,
             'state': job.state,
-            'returncode': job.return_code
+            'returncode': job.return_code,
+            'usage': job.usage
         }
 
     def do_POST(self, msg):
         job = Job(
             cmd=msg['cmd'],
             cwd=msg['cwd'],
-            env=msg.get('env', {})
+            env=msg.get('env', {}),
+            priority=msg.get('priority', 0),
+            cores=msg.get('cores', 1),
+            memory=msg.get('memory', 0)
         )
-        self.jobs[job.id] = job
-        get_running_loop().call_soon(self.queue.put_nowait, job)
+        # the job may wait for a large enough worker to connect,
+        # unless none of the connected workers can run it
+        if (self.worker_address is None or self.nodes) and \
+                not self._fits_capacity(job):
+            return {
+                'ok': False,
+                'error': 'insufficient-resources'
+            }
+        self.jobs.add(job)
+        if self.journal is not None:
+            self.journal.add(job)
+        get_running_loop().call_soon(self._enqueue, job)
         self.logger.info('queued %r for execution', job)
         return {
             'ok': True,
@@ -189,30 +625,48 @@ class LocalQueue:
         }
 
     def do_CANCEL(self, msg):
-        job = self.jobs.get(msg['id'], _null_job)
+        job = self.jobs.get_active(msg['id']) or _null_job
         if job.state == JobStatus.QUEUED:
             job.state = JobStatus.INTERRUPTED
+            self._record(job)
+            # the cancelled job may have been holding the resources
+            self._wakeup.set()
         if job.worker is not None:
             job.worker.cancel()
+        if job.node is not None:
+            self._send_node(job.node, {'type': 'CANCEL', 'id': job.id})
         return {
             'ok': True
         }
 
     def do_DELETE(self, msg):
-        try:
-            job = self.jobs[msg['id']]
-            job.state = JobStatus.DELETED
-            del self.jobs[job.id]
-        except KeyError:
-            pass
+        job_id = msg['id']
+        if job_id in self.jobs:
+            job = self.jobs.get_active(job_id)
+            if job is not None:
+                job.state = JobStatus.DELETED
+            self.jobs.delete(job_id)
+            if self.journal is not None:
+                self.journal.delete(job_id)
         return {
             'ok': True
         }
 
+    def do_INFO(self, msg):
+        return {
+            'ok': True,
+            'notify': self.notify_address,
+            'epoch': self.epoch,
+            'seq': self._seq
+        }
+
     def stop(self):
         self.logger.info("Stopping.")
         for worker in self.workers:
             worker.cancel()
+        for node in self.nodes.values():
+            for job_id in node.jobs:
+                self._send_node(node.identity, {'type': 'CANCEL', 'id': job_id})
         self._main_coro.cancel()
 
     def close(self, loop=None):
@@ -221,6 +675,16 @@ class LocalQueue:
         loop.run_until_complete(self.wait_closed())
         self.workers.clear()
         self._main_coro = None
+        if self._publisher is not None:
+            self._publisher.close(linger=0)
+            self._publisher = None
+        if self._router is not None:
+            # deliver the cancel requests to the remote workers
+            self._router.close(linger=1000)
+            self._router = None
+        self.nodes.clear()
+        if self.journal is not None:
+            self.journal.close()
         self.logger.info('Closed.')
 
     async def wait_closed(self):
@@ -233,9 +697,25 @@ class LocalQueue:
         if self._main_coro is not None:
             raise RuntimeError("Scheduler is already running.")
         loop = loop or asyncio.get_event_loop()
+        # plain socket as publishing never waits for the subscribers
+        self._publisher = zmq.Socket(self.zmq_ctx, zmq.PUB)
+        self._publisher.bind(self.notify_address)
+        self.notify_address = self._publisher.getsockopt_string(
+            zmq.LAST_ENDPOINT
+        )
+        self.logger.info('PUB socket bound to %s', self.notify_address)
+        tasks = [loop.create_task(self._heartbeat())]
+        if self.jobs.finished_ttl is not None:
+            tasks.append(loop.create_task(self._evictor()))
+        if self.journal is not None:
+            loop.run_until_complete(self._restore())
+            tasks.append(loop.create_task(self._compactor()))
+        if self.worker_address is not None:
+            tasks.append(loop.create_task(self.serve_workers()))
+            tasks.append(loop.create_task(self._node_monitor()))
+        tasks.append(loop.create_task(self._scheduler(loop)))
         server = loop.create_task(self.serve_forever())
-        consumer = loop.create_task(self._consumer(loop))
-        self._main_coro = asyncio.gather(server, consumer)
+        self._main_coro = asyncio.gather(server, *tasks)
         try:
             loop.run_until_complete(self._main_coro)
         except KeyboardInterrupt:
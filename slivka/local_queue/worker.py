@@ -0,0 +1,143 @@
+""" Remote worker of the local queue.
+
+The :py:class:`QueueWorker` connects to the ROUTER socket of
+the :py:class:`slivka.local_queue.LocalQueue` started with
+the ``worker_address`` and runs the jobs sent by the queue, reporting
+their final states back. The worker must share the file system
+with the queue, as the jobs are run in their original directories.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+from functools import partial
+from typing import Dict
+
+import zmq
+import zmq.asyncio as aiozmq
+
+from slivka import JobStatus
+from .server import Job, _execute_job
+
+
+class QueueWorker:
+    """ Worker running up to ``slots`` jobs of the remote queue at once.
+
+    The worker announces itself and its free slots to the queue
+    with the heartbeats sent every ``heartbeat_interval`` seconds.
+    The queue which has not received a heartbeat for a while
+    considers the worker lost and interrupts its jobs.
+
+    :param address: address of the worker socket of the queue
+    :param slots: number of jobs run simultaneously
+    :param name: name of the worker shown in the queue logs,
+        the host name and the pid by default
+    """
+    zmq_ctx = aiozmq.Context()
+    heartbeat_interval = 5
+
+    def __init__(self, address, slots=1, name=None):
+        self.logger = logging.getLogger(__name__)
+        self.address = address
+        self.slots = slots
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.jobs = {}  # type: Dict[int, asyncio.Task]
+        self._socket = None
+        self._main_coro = None
+
+    def _send(self, message):
+        self._socket.send_multipart([json.dumps(message).encode()])
+
+    def _send_heartbeat(self):
+        self._send({
+            'type': 'HEARTBEAT',
+            'name': self.name,
+            'slots': self.slots,
+            'running': list(self.jobs)
+        })
+
+    async def _heartbeat(self):
+        while True:
+            self._send_heartbeat()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _run_job(self, job: Job):
+        self.logger.info('executing %r', job)
+        try:
+            await _execute_job(job, self.logger)
+        except OSError:
+            pass  # logged and reported as an error
+        finally:
+            self._send({
+                'type': 'STATE',
+                'id': job.id,
+                'state': job.state,
+                'returncode': job.return_code,
+                'usage': job.usage
+            })
+
+    async def serve_forever(self, loop):
+        self._socket = self.zmq_ctx.socket(zmq.DEALER)
+        self._socket.connect(self.address)
+        self.logger.info('DEALER socket connected to %s', self.address)
+        heartbeat = loop.create_task(self._heartbeat())
+        try:
+            while True:
+                frames = await self._socket.recv_multipart()
+                try:
+                    (payload,) = frames
+                    self._handle_message(json.loads(payload), loop)
+                except (ValueError, KeyError, TypeError):
+                    self.logger.exception("Dropped malformed message")
+        finally:
+            heartbeat.cancel()
+
+    def _handle_message(self, message, loop):
+        if message['type'] == 'RUN':
+            job = Job(message['cmd'], message['cwd'], message['env'],
+                      state=JobStatus.RUNNING)
+            job.id = message['id']
+            task = loop.create_task(self._run_job(job))
+            self.jobs[job.id] = task
+            task.add_done_callback(partial(self._job_done, job.id))
+        elif message['type'] == 'CANCEL':
+            task = self.jobs.get(message['id'])
+            if task is not None:
+                task.cancel()
+
+    def _job_done(self, job_id, _fut):
+        del self.jobs[job_id]
+
+    def stop(self):
+        self.logger.info("Stopping.")
+        for task in self.jobs.values():
+            task.cancel()
+        self._main_coro.cancel()
+
+    def close(self, loop=None):
+        self.logger.info("Closing.")
+        loop = loop or asyncio.get_event_loop()
+        loop.run_until_complete(asyncio.gather(
+            self._main_coro, *self.jobs.values(), return_exceptions=True
+        ))
+        self._main_coro = None
+        if self._socket is not None:
+            self._send({'type': 'BYE'})
+            # deliver the final states to the queue
+            self._socket.close(linger=1000)
+            self._socket = None
+        self.logger.info('Closed.')
+
+    def run(self, loop=None):
+        if self._main_coro is not None:
+            raise RuntimeError("Worker is already running.")
+        loop = loop or asyncio.get_event_loop()
+        self._main_coro = loop.create_task(self.serve_forever(loop))
+        try:
+            loop.run_until_complete(self._main_coro)
+        except KeyboardInterrupt:
+            self.stop()
+        except asyncio.CancelledError:
+            pass
+        self.logger.info('Stopped.')
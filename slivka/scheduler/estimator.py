@@ -0,0 +1,269 @@
+""" Prediction of the job run times and queue waits.
+
+:py:class:`RuntimeEstimator` learns how long the jobs of each service
+run from the resources used by the completed jobs. The numeric input
+values and the sizes of the input files are used as the features of
+a linear model of the logarithm of the wall time, fitted by
+the ridge regression which forgets the old jobs gradually, so
+the model follows the changes of the services and the hardware.
+
+The time a new job waits in the queue of a runner is estimated from
+the number of its queued jobs and the rate its jobs finished at
+recently, following Little's law.
+"""
+import bisect
+import collections
+import functools
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from slivka import JobStatus
+from slivka.db.documents import JobRequest
+
+log = logging.getLogger('slivka.scheduler')
+
+
+def extract_features(inputs: dict) -> Dict[str, float]:
+    """ Converts the input values to the numeric features.
+
+    Numbers are scaled logarithmically and files are represented by
+    the logarithm of their size. Lists contribute the total of their
+    elements. The remaining values are ignored.
+    """
+    features = {}
+    for key, value in inputs.items():
+        values = value if isinstance(value, list) else [value]
+        total = None
+        for item in values:
+            number = _feature_value(item)
+            if number is not None:
+                total = (total or 0.0) + number
+        if total is not None:
+            features[key] = total
+    return features
+
+
+def _feature_value(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            if not os.path.isabs(value):
+                return None
+            try:
+                return _file_size_feature(value)
+            except OSError:
+                return None
+    else:
+        return None
+    if not math.isfinite(number):
+        return None
+    return math.copysign(math.log1p(abs(number)), number)
+
+
+@functools.lru_cache(maxsize=4096)
+def _file_size_feature(path: str) -> float:
+    # input files are never modified once written, so their sizes are
+    # read only once instead of each time the features are extracted
+    return math.log1p(os.path.getsize(path))
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> Optional[List[float]]:
+    """ Solves the linear system with the gaussian elimination. """
+    n = len(vector)
+    rows = [row[:] + [b] for row, b in zip(matrix, vector)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            if factor:
+                for c in range(col, n + 1):
+                    rows[r][c] -= factor * rows[col][c]
+    solution = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        total = rows[r][n] - sum(
+            rows[r][c] * solution[c] for c in range(r + 1, n)
+        )
+        solution[r] = total / rows[r][r]
+    return solution
+
+
+class _ServiceModel:
+    """ Ridge regression of the log wall time updated incrementally. """
+    __slots__ = ('names', 'xtx', 'xty', 'samples', '_weights')
+
+    def __init__(self):
+        # the first feature is the constant term
+        self.names: List[str] = []
+        self.xtx = [[0.0]]
+        self.xty = [0.0]
+        self.samples = 0
+        self._weights = None
+
+    def _vector(self, features, grow):
+        if grow:
+            for name in features:
+                if name not in self.names:
+                    self.names.append(name)
+                    for row in self.xtx:
+                        row.append(0.0)
+                    self.xtx.append([0.0] * (len(self.xty) + 1))
+                    self.xty.append(0.0)
+        return [1.0] + [features.get(name, 0.0) for name in self.names]
+
+    def add(self, features, wall_time, decay):
+        x = self._vector(features, grow=True)
+        y = math.log1p(wall_time)
+        for i, xi in enumerate(x):
+            row = self.xtx[i]
+            for j, xj in enumerate(x):
+                row[j] = row[j] * decay + xi * xj
+            self.xty[i] = self.xty[i] * decay + xi * y
+        self.samples += 1
+        self._weights = None
+
+    def predict(self, features, ridge) -> Optional[float]:
+        if self._weights is None:
+            matrix = [row[:] for row in self.xtx]
+            for i in range(1, len(matrix)):
+                matrix[i][i] += ridge
+            self._weights = _solve(matrix, self.xty)
+            if self._weights is None:
+                return None
+        x = self._vector(features, grow=False)
+        y = sum(w * xi for w, xi in zip(self._weights, x))
+        return math.expm1(min(y, 50.0))
+
+
+class _RunnerLoad:
+    __slots__ = ('queued', 'finish_times', 'queue_time')
+
+    def __init__(self):
+        self.queued = 0
+        # completion times of the recent jobs in ascending order
+        self.finish_times: List[datetime] = []
+        # moving average of the observed queue times
+        self.queue_time: Optional[float] = None
+
+
+class RuntimeEstimator:
+    """ Estimates the run times of the jobs and the waits in the queues.
+
+    :param min_samples: number of the completed jobs of the service
+        needed before the run times are predicted
+    :param decay: weight by which the older jobs are multiplied each
+        time a job completes
+    :param ridge: regularisation strength of the feature weights
+    :param window: number of the recent completions used to measure
+        the throughput of the runners
+    :param max_age: time in seconds after which the completions
+        no longer count towards the throughput
+    """
+
+    def __init__(self, min_samples=5, decay=0.995, ridge=0.1, window=50,
+                 max_age=3600):
+        self.min_samples = min_samples
+        self.decay = decay
+        self.ridge = ridge
+        self.window = window
+        self.max_age = max_age
+        self._models: Dict[str, _ServiceModel] = collections.defaultdict(
+            _ServiceModel)
+        self._loads: Dict[tuple, _RunnerLoad] = {}
+
+    def _load(self, runner_id) -> _RunnerLoad:
+        load = self._loads.get(runner_id)
+        if load is None:
+            load = self._loads[runner_id] = _RunnerLoad()
+        return load
+
+    def observe(self, request: JobRequest, runner_id=None):
+        """ Learns from the finished job request.
+
+        Only the completed jobs with the known wall time are used
+        to train the run time model. The throughput of the runner is
+        measured at the completion times of its jobs.
+        """
+        usage = request.get('usage') or {}
+        if runner_id is not None:
+            load = self._load(runner_id)
+            finished = request.get('completion_time') or datetime.now()
+            bisect.insort(load.finish_times, finished)
+            del load.finish_times[:-self.window]
+            queue_time = usage.get('queue_time')
+            if queue_time is not None:
+                load.queue_time = (
+                    queue_time if load.queue_time is None else
+                    0.8 * load.queue_time + 0.2 * queue_time
+                )
+        wall_time = usage.get('wall_time')
+        if request.status != JobStatus.COMPLETED or wall_time is None:
+            return
+        self._models[request.service].add(
+            extract_features(request.inputs), wall_time, self.decay
+        )
+
+    def set_queued(self, runner_id, count):
+        """ Updates the number of jobs waiting in the runner queue. """
+        self._load(runner_id).queued = count
+
+    def estimate_runtime(self, service, inputs) -> Optional[float]:
+        """ Returns the predicted run time in seconds or None if unknown. """
+        model = self._models.get(service)
+        if model is None or model.samples < self.min_samples:
+            return None
+        runtime = model.predict(extract_features(inputs), self.ridge)
+        return max(runtime, 0.0) if runtime is not None else None
+
+    def estimate_wait(self, runner_id) -> Optional[float]:
+        """ Returns the expected queue wait in seconds or None if unknown. """
+        load = self._loads.get(runner_id)
+        if load is None:
+            return None
+        times = load.finish_times
+        # stale completions do not reflect the current throughput
+        cutoff = datetime.now() - timedelta(seconds=self.max_age)
+        del times[:bisect.bisect_left(times, cutoff)]
+        if len(times) >= 2 and times[-1] > times[0]:
+            rate = (len(times) - 1) / (times[-1] - times[0]).total_seconds()
+            return load.queued / rate
+        return load.queue_time
+
+    def estimate_completion(self, service, inputs, runner_id) \
+            -> Optional[datetime]:
+        """ Returns the expected completion time of the new job. """
+        runtime = self.estimate_runtime(service, inputs)
+        if runtime is None:
+            return None
+        wait = self.estimate_wait(runner_id) or 0.0
+        return datetime.fromtimestamp(time.time() + wait + runtime)
+
+    def load_history(self, database, limit=1000):
+        """ Trains the models on the most recently completed jobs. """
+        requests = []
+        # archived jobs are older, used if there are not enough recent ones
+        for collection in (JobRequest.collection(database),
+                           JobRequest.archive_collection(database)):
+            if len(requests) >= limit:
+                break
+            cursor = (collection
+                      .find({'status': JobStatus.COMPLETED,
+                             'usage.wall_time': {'$ne': None}})
+                      .sort('completion_time', -1)
+                      .limit(limit - len(requests)))
+            requests.extend(JobRequest(**kwargs) for kwargs in cursor)
+        # oldest first so the recent jobs have the highest weights
+        for request in reversed(requests):
+            self.observe(request)
+        log.info("Runtime estimator trained on %d jobs.", len(requests))
@@ -1,8 +1,9 @@
 from importlib import import_module
-from typing import Type, Tuple, Callable, List
+from typing import Type, Tuple, Callable, List, Optional
 
 import slivka.scheduler.runners
-from slivka.conf import ServiceConfig
+from slivka.conf import ServiceConfig, SlivkaSettings
+from slivka.scheduler.garbage_collector import GarbageCollector
 from slivka.scheduler.runners import RunnerID, Runner
 from slivka.scheduler.scheduler import SelectorMeta, BaseSelector
 
@@ -18,6 +19,12 @@ def runners_from_config(config: ServiceConfig) -> Tuple[Callable, List[Runner]]:
         selector = BaseSelector.default
     runners = []
     for runner_conf in config.execution.runners.values():
+        kwargs = dict(runner_conf.parameters)
+        walltime = runner_conf.walltime
+        if walltime is None:
+            walltime = config.execution.walltime
+        if walltime is not None:
+            kwargs['walltime'] = walltime
         if '.' in runner_conf.type:
             mod, attr = runner_conf.type.rsplit('.', 1)
             cls: Type[Runner] = getattr(import_module(mod), attr)
@@ -31,10 +38,35 @@ def runners_from_config(config: ServiceConfig) -> Tuple[Callable, List[Runner]]:
             consts=runner_conf.consts,
             outputs=config.outputs,
             env={**config.env, **runner_conf.env},
-            **runner_conf.parameters
+            **kwargs
         )
         runners.append(runner)
     return selector, runners
 
 
+def garbage_collector_from_config(database, settings: SlivkaSettings) \
+        -> Optional[GarbageCollector]:
+    """ Creates the garbage collector or returns None if no retention
+    or archival is set.
+    """
+    retention = settings.retention
+    service_retention = {
+        service.id: service.retention for service in settings.services
+        if service.retention is not None
+    }
+    if (retention.jobs is None and retention.uploads is None and
+            retention.archive is None and not service_retention):
+        return None
+    return GarbageCollector(
+        database,
+        settings.directory.jobs,
+        retention=retention.jobs,
+        service_retention=service_retention,
+        uploads_retention=retention.uploads,
+        archive_after=retention.archive,
+        batch_size=retention.batch_size,
+        delay=retention.delay
+    )
+
+
 # TODO: runner tests
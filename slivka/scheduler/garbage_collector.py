@@ -0,0 +1,299 @@
+""" Archival and removal of the expired jobs and uploaded files.
+
+The finished jobs are moved from the requests collection to its
+archive after the ``archive_after`` grace period, so the collection
+queried by the scheduler contains mostly the active jobs.
+The jobs are kept for the retention period of their service counted
+from the job completion. After that, the job directories are deleted
+together with the requests.
+The uploaded files are deleted once they are older than the uploads
+retention period and none of the remaining requests uses them
+as an input.
+
+The collector removes at most ``batch_size`` items at once and pauses
+for ``delay`` seconds between the batches to limit the load it puts
+on the database and the file system.
+"""
+import logging
+import os
+import shutil
+import threading
+from base64 import urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+import pymongo.errors
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from slivka import JobStatus
+from slivka.db.documents import JobRequest, UploadedFile
+from slivka.utils.path import request_id_to_job_path
+
+CollectionResult = namedtuple('CollectionResult', 'archived, jobs, uploads')
+
+_finished_statuses = [status for status in JobStatus if status.is_finished()]
+
+
+class GarbageCollector:
+    """ Archives the finished jobs and deletes the expired ones.
+
+    :param database: mongo database
+    :param jobs_directory: path to the jobs directory
+    :param retention: default time in seconds the finished jobs are
+        kept for, jobs are kept indefinitely if None
+    :param service_retention: retention of the jobs of the services
+        overriding the default
+    :param uploads_retention: time in seconds the unused uploaded
+        files are kept for, files are kept indefinitely if None
+    :param archive_after: time in seconds after which the finished
+        jobs are moved to the archive, jobs are not archived if None
+    :param batch_size: maximum number of items removed at once
+    :param delay: pause in seconds between the batches
+    """
+
+    def __init__(self,
+                 database,
+                 jobs_directory: str,
+                 retention: Optional[float] = None,
+                 service_retention: Dict[str, float] = None,
+                 uploads_retention: Optional[float] = None,
+                 archive_after: Optional[float] = None,
+                 batch_size=1000,
+                 delay=1.0):
+        self.log = logging.getLogger(__name__)
+        self.database = database
+        self.jobs_directory = os.path.realpath(jobs_directory)
+        self.retention = retention
+        self.service_retention = dict(service_retention or {})
+        self.uploads_retention = uploads_retention
+        self.archive_after = archive_after
+        self.batch_size = batch_size
+        self.delay = delay
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """ Interrupts the collection in progress. """
+        self._stopped.set()
+
+    def collect(self, now: datetime = None) -> CollectionResult:
+        """ Archives the finished jobs, deletes the expired jobs
+        and then the unused uploads.
+
+        Database errors are logged and end the collection early,
+        the remaining items are processed in the next collection.
+
+        :param now: time the expiry is counted to, defaults to now
+        :return: numbers of the archived and deleted jobs and
+            deleted uploads
+        """
+        now = now or datetime.now()
+        archived = jobs = uploads = 0
+        try:
+            archived = self.archive_jobs(now)
+            jobs = self.collect_jobs(now)
+            uploads = self.collect_uploads(now)
+        except pymongo.errors.PyMongoError:
+            self.log.exception("Garbage collection failed.")
+        if archived:
+            self.log.info("Archived %d finished jobs.", archived)
+        if jobs or uploads:
+            self.log.info("Deleted %d expired jobs and %d uploaded files.",
+                          jobs, uploads)
+        return CollectionResult(archived, jobs, uploads)
+
+    def archive_jobs(self, now: datetime) -> int:
+        """ Moves the finished jobs past the grace period to the archive.
+
+        The requests are written to the archive before they are
+        deleted from the requests collection, so an interrupted
+        archival is completed by the next one.
+        """
+        if self.archive_after is None:
+            return 0
+        collection = JobRequest.collection(self.database)
+        archive = JobRequest.archive_collection(self.database)
+        query = _finished_before(now - timedelta(seconds=self.archive_after))
+        count = 0
+        while not self._stopped.is_set():
+            batch = list(collection.find(query).limit(self.batch_size))
+            if not batch:
+                break
+            archive.bulk_write(
+                [ReplaceOne({'_id': item['_id']}, item, upsert=True)
+                 for item in batch],
+                ordered=False
+            )
+            collection.delete_many(
+                {'_id': {'$in': [item['_id'] for item in batch]}}
+            )
+            count += len(batch)
+            if len(batch) < self.batch_size:
+                break
+            self._stopped.wait(self.delay)
+        return count
+
+    def collect_jobs(self, now: datetime) -> int:
+        """ Deletes the directories and the requests of expired jobs. """
+        count = 0
+        for collection, query in self._expired_jobs_queries(now):
+            while not self._stopped.is_set():
+                batch = list(
+                    collection.find(query, projection=['job'])
+                    .sort('_id', pymongo.ASCENDING)
+                    .limit(self.batch_size)
+                )
+                if not batch:
+                    break
+                removed = [
+                    item for item in batch if self._remove_job_directory(item)
+                ]
+                if removed:
+                    collection.delete_many(
+                        {'_id': {'$in': [item['_id'] for item in removed]}}
+                    )
+                    count += len(removed)
+                if len(batch) < self.batch_size:
+                    break
+                # requests of the directories which could not be removed
+                # are retried in the next collection
+                query = dict(query, _id={'$gt': batch[-1]['_id']})
+                self._stopped.wait(self.delay)
+        return count
+
+    def _expired_jobs_queries(self, now) -> Iterator[tuple]:
+        """ Yields the collections and the queries matching
+        the expired jobs of each service.
+        """
+        queries = [
+            dict(_finished_before(now - timedelta(seconds=retention)),
+                 service=service)
+            for service, retention in self.service_retention.items()
+            if retention is not None
+        ]
+        if self.retention is not None:
+            queries.append(dict(
+                _finished_before(now - timedelta(seconds=self.retention)),
+                service={'$nin': list(self.service_retention)}
+            ))
+        for collection in (JobRequest.collection(self.database),
+                           JobRequest.archive_collection(self.database)):
+            for query in queries:
+                yield collection, query
+
+    def _remove_job_directory(self, item) -> bool:
+        """ Deletes the directory of the job and its empty parents.
+
+        Directories outside the jobs directory are never deleted.
+
+        :return: whether the job directory no longer exists
+        """
+        job = item.get('job')
+        if job is not None:
+            path = job['work_dir']
+        else:
+            b64id = urlsafe_b64encode(item['_id'].binary).decode()
+            path = request_id_to_job_path(self.jobs_directory, b64id)
+        path = os.path.realpath(path)
+        if not path.startswith(self.jobs_directory + os.sep):
+            self.log.error("Job directory %s is outside of %s, not deleted.",
+                           path, self.jobs_directory)
+            return False
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self.log.exception("Deleting job directory %s failed.", path)
+            return False
+        # job directories are nested in two levels of directories
+        # which are removed once they are empty
+        parent = os.path.dirname(path)
+        while parent.startswith(self.jobs_directory + os.sep):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def collect_uploads(self, now: datetime) -> int:
+        """ Deletes the expired uploaded files not used by any request. """
+        if self.uploads_retention is None:
+            return 0
+        cutoff = now - timedelta(seconds=self.uploads_retention)
+        # object ids store the creation time in UTC
+        query = {'_id': {'$lt': ObjectId.from_datetime(cutoff.astimezone())}}
+        collection = UploadedFile.collection(self.database)
+        count = 0
+        while not self._stopped.is_set():
+            batch = list(
+                collection.find(query, projection=['path'])
+                .sort('_id', pymongo.ASCENDING)
+                .limit(self.batch_size)
+            )
+            if not batch:
+                break
+            used = self._used_paths(
+                [item['path'] for item in batch],
+                batch[0]['_id'].generation_time.astimezone().replace(tzinfo=None)
+            )
+            expired = [
+                item for item in batch
+                if item['path'] not in used and self._remove_file(item['path'])
+            ]
+            if expired:
+                collection.delete_many(
+                    {'_id': {'$in': [item['_id'] for item in expired]}}
+                )
+                count += len(expired)
+            if len(batch) < self.batch_size:
+                break
+            # files still in use or not deleted are skipped in the next batch
+            query['_id']['$gt'] = batch[-1]['_id']
+            self._stopped.wait(self.delay)
+        return count
+
+    def _remove_file(self, path) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            self.log.exception("Deleting file %s failed.", path)
+            return False
+        return True
+
+    def _used_paths(self, paths, since: datetime) -> set:
+        """ Returns the paths used as inputs of the requests.
+
+        Only the requests created after the oldest of the files
+        can use them, which narrows down the search.
+        """
+        pipeline = [
+            {'$match': {'timestamp': {'$gte': since}}},
+            {'$project': {'inputs': {'$objectToArray': '$inputs'}}},
+            {'$unwind': '$inputs'},
+            {'$unwind': '$inputs.v'},
+            {'$match': {'inputs.v': {'$in': paths}}},
+            {'$group': {'_id': '$inputs.v'}}
+        ]
+        return {
+            item['_id']
+            for collection in (JobRequest.collection(self.database),
+                               JobRequest.archive_collection(self.database))
+            for item in collection.aggregate(pipeline)
+        }
+
+
+def _finished_before(time: datetime) -> dict:
+    """ Returns the query matching the jobs finished before the time. """
+    return {
+        'status': {'$in': _finished_statuses},
+        '$or': [
+            {'completion_time': {'$lt': time}},
+            # jobs rejected before running are never completed
+            {'completion_time': None, 'timestamp': {'$lt': time}}
+        ]
+    }
@@ -1,11 +1,14 @@
 from .grid_engine import GridEngineRunner
-from .runner import Runner, Command, Job, RunnerID
+from .runner import Runner, Command, Job, ResourceUsage, RunnerID
 from .shell import ShellRunner
 from .slivka_queue import SlivkaQueueRunner
 from .slurm import SlurmRunner
+from .slurm_rest import SlurmRestRunner
 from .lsf import LSFRunner
+from .warm_pool import WarmPoolRunner
 
 __all__ = (
     'Runner', 'GridEngineRunner', 'ShellRunner', 'SlivkaQueueRunner',
-    'SlurmRunner', 'RunnerID', 'Command', 'Job', 'LSFRunner'
+    'SlurmRunner', 'SlurmRestRunner', 'RunnerID', 'Command', 'Job',
+    'ResourceUsage', 'LSFRunner', 'WarmPoolRunner'
 )
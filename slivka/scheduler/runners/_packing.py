@@ -0,0 +1,210 @@
+""" Packing of many short jobs into a single cluster allocation.
+
+Submitting every short job separately makes the queuing system
+spend more time scheduling the jobs than running them. The cluster
+runners with packing enabled collect the accepted jobs until there
+are ``size`` of them or the oldest one has waited ``window``
+seconds and submit them together as one job running a pack script.
+The script runs the commands in their own working directories,
+at most ``parallel`` of them at once, and writes the *finished*
+sentinel file of every command, so the members of the pack are
+monitored in the same way as the individually submitted jobs.
+The members of a running allocation are reported as queued until
+the script creates their *started* files, so their run time, limited
+by the walltime, is counted from the moment they actually start.
+
+The ids of the members consist of the id of the allocation and
+the index of the member separated by ``+``. The members are
+cancelled by creating the *cancelled* file in their working
+directories, which the pack script checks before starting
+a command and periodically while the command runs. Once all the
+unfinished members of a pack are cancelled, the allocation is
+cancelled as well.
+
+:py:class:`PackingMixin` provides the common part of the packing
+to the cluster runners.
+"""
+import logging
+import os
+from typing import Collection, Dict, List, Sequence, Set
+
+from slivka import JobStatus
+from slivka.compat import resources
+from ._bash_lex import bash_quote
+from .runner import Command, Job
+
+log = logging.getLogger('slivka.scheduler')
+
+CANCEL_MARKER = 'cancelled'
+STARTED_MARKER = 'started'
+
+_pack_bash_tpl = resources.read_text(__package__, "pack-runner.bash.tpl")
+
+
+def member_id(allocation, index):
+    """ Returns the id of the pack member; ids may be str or bytes. """
+    if isinstance(allocation, bytes):
+        return b'%s+%d' % (allocation, index)
+    return '%s+%d' % (allocation, index)
+
+
+def allocation_id(job_id):
+    """ Returns the id of the allocation running the job. """
+    separator = b'+' if isinstance(job_id, bytes) else '+'
+    return job_id.partition(separator)[0]
+
+
+def is_pack_member(job_id) -> bool:
+    separator = b'+' if isinstance(job_id, bytes) else '+'
+    return separator in job_id
+
+
+def pack_script(commands: Sequence[Command], parallel=1) -> str:
+    """ Creates the bash script running the commands of the pack. """
+    tasks = (
+        'start %s %s\n' % (
+            bash_quote(command.cwd),
+            str.join(' ', map(bash_quote, command.args))
+        )
+        for command in commands
+    )
+    return _pack_bash_tpl.format(
+        parallel=int(parallel), tasks=str.join('', tasks)
+    )
+
+
+def cancel_members(jobs: Sequence[Job]):
+    """ Marks the pack members to be stopped by the pack script. """
+    for job in jobs:
+        try:
+            with open(os.path.join(job.cwd, CANCEL_MARKER), 'w'):
+                pass
+        except OSError:
+            log.exception("Cancelling packed job %s failed.", job.id)
+
+
+class PackingPolicy:
+    """ Packing parameters of the cluster runner.
+
+    :param size: maximum number of jobs in a pack, packing is
+        disabled if None
+    :param window: time in seconds the accepted jobs wait for
+        the pack to fill up
+    :param parallel: number of the packed jobs run simultaneously
+    """
+
+    def __init__(self, size=None, window=30, parallel=1):
+        self.size = int(size) if size is not None else None
+        self.window = float(window)
+        self.parallel = int(parallel)
+        if self.size is not None and self.size < 1:
+            raise ValueError("pack size must be a positive integer")
+        if self.parallel < 1:
+            raise ValueError("pack parallelism must be a positive integer")
+
+    @property
+    def enabled(self) -> bool:
+        return self.size is not None
+
+    def is_ready(self, count, wait_time) -> bool:
+        """ Tells if the waiting jobs should be submitted now. """
+        if not self.enabled:
+            return True
+        return count >= self.size or wait_time >= self.window
+
+    def rounds(self, count) -> int:
+        """ Returns how many jobs of the pack run one after another. """
+        return -(-count // self.parallel)
+
+    def split(self, commands: Sequence[Command]) -> List[List[Command]]:
+        """ Divides the commands into the packs. """
+        commands = list(commands)
+        return [
+            commands[i:i + self.size]
+            for i in range(0, len(commands), self.size)
+        ]
+
+
+class PackingMixin:
+    """ Packing support shared by the cluster runners.
+
+    The runner calls :py:meth:`_init_packing` on initialisation,
+    creates the jobs of the submitted packs with :py:meth:`_pack_jobs`
+    and reports the jobs it no longer tracks to
+    :py:meth:`_release_members`. The unfinished members of the packs
+    submitted by this runner instance are remembered, so the allocation
+    is cancelled together with the last of its members. The allocations of
+    the packs submitted before the scheduler restarted are left to
+    finish on their own.
+    """
+    submit_chunk_size: int
+
+    def _init_packing(self, size=None, window=30, parallel=1):
+        self.packing = PackingPolicy(size, window, parallel)
+        if self.packing.enabled:
+            self.submit_chunk_size = max(
+                self.submit_chunk_size, self.packing.size)
+        self._pack_members: Dict[object, Set] = {}
+        self._started_members: Set = set()
+
+    def is_batch_ready(self, count, wait_time) -> bool:
+        return self.packing.is_ready(count, wait_time)
+
+    def _member_states(self, jobs: Sequence[Job], states: dict):
+        """ Adds the states of the pack members to the ``states``
+        of their allocations.
+        """
+        for job in jobs:
+            if not is_pack_member(job.id):
+                continue
+            state = states.get(allocation_id(job.id))
+            if state is None:
+                continue
+            if (state == JobStatus.RUNNING and
+                    job.id not in self._started_members):
+                if os.path.exists(os.path.join(job.cwd, STARTED_MARKER)):
+                    self._started_members.add(job.id)
+                else:
+                    # waiting for its turn in the allocation
+                    state = JobStatus.QUEUED
+            states[job.id] = state
+
+    def _pack_jobs(self, allocation, commands: Sequence[Command]) \
+            -> List[Job]:
+        """ Creates the member jobs of the submitted pack. """
+        jobs = [
+            Job(member_id(allocation, index), command.cwd)
+            for index, command in enumerate(commands, 1)
+        ]
+        self._pack_members[allocation] = {job.id for job in jobs}
+        return jobs
+
+    def _release_members(self, jobs: Collection[Job]):
+        """ Forgets the members which are no longer tracked. """
+        for job in jobs:
+            if not is_pack_member(job.id):
+                continue
+            self._started_members.discard(job.id)
+            allocation = allocation_id(job.id)
+            members = self._pack_members.get(allocation)
+            if members is not None:
+                members.discard(job.id)
+                if not members:
+                    del self._pack_members[allocation]
+
+    def _cancel_packed(self, jobs: Collection[Job]) -> list:
+        """ Cancels the packed jobs and returns the ids of the jobs
+        and the allocations to be cancelled by the queuing system.
+        """
+        members = [job for job in jobs if is_pack_member(job.id)]
+        cancel_members(members)
+        job_ids = [job.id for job in jobs if not is_pack_member(job.id)]
+        for allocation in {allocation_id(job.id) for job in members}:
+            remaining = self._pack_members.get(allocation)
+            if remaining is None:
+                continue
+            remaining.difference_update(job.id for job in members)
+            if not remaining:
+                del self._pack_members[allocation]
+                job_ids.append(allocation)
+        return job_ids
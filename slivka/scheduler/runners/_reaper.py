@@ -0,0 +1,128 @@
+""" Notification of the child process termination.
+
+:py:class:`ProcessReaper` runs a single background thread waiting
+for the child processes to exit using their pid file descriptors,
+so the runners do not need to poll every process on each status
+check. The processes are reaped with ``wait4`` so the callbacks
+receive the resources used by the process and its waited-for
+descendants along with the return code. Where pidfd is not available
+(Linux older than 5.3 or other systems), each process is waited for
+by a separate thread instead.
+"""
+import logging
+import os
+import select
+import subprocess
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from slivka.compat.os import waitstatus_to_exitcode
+
+log = logging.getLogger('slivka.scheduler')
+
+ExitCallback = Callable[[subprocess.Popen, int, Optional[object]], None]
+
+
+def _pidfd_supported():
+    if not hasattr(os, 'pidfd_open') or not hasattr(select, 'epoll'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+def _wait(proc: subprocess.Popen):
+    """ Waits for the process returning its return code and rusage. """
+    try:
+        _pid, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # reaped by the Popen object itself
+        return proc.wait(), None
+    proc.returncode = waitstatus_to_exitcode(status)
+    return proc.returncode, rusage
+
+
+def _notify(proc, callback):
+    try:
+        callback(proc, *_wait(proc))
+    except Exception:
+        log.exception("Process exit callback failed.")
+
+
+class ProcessReaper:
+    """ Calls the callbacks with the return codes of exited processes.
+
+    The callbacks are given the process, its return code and
+    the :py:class:`resource.struct_rusage` of the process, which is
+    None if the process was reaped elsewhere.
+
+    Callbacks are called from the reaper threads and must not block.
+    """
+
+    def __init__(self, use_pidfd=True):
+        self._lock = threading.Lock()
+        self._epoll = None
+        self._procs: Dict[int, Tuple[subprocess.Popen, ExitCallback]] = {}
+        if use_pidfd and _pidfd_supported():
+            self._epoll = select.epoll()
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            self._epoll.register(self._wakeup_r, select.EPOLLIN)
+            threading.Thread(
+                target=self._run, name='process-reaper', daemon=True
+            ).start()
+
+    @property
+    def event_driven(self):
+        return self._epoll is not None
+
+    def watch(self, proc: subprocess.Popen, callback: ExitCallback):
+        """ Registers the callback called when the process exits. """
+        if self._epoll is not None:
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except ProcessLookupError:
+                # already exited and reaped
+                _notify(proc, callback)
+                return
+            with self._lock:
+                self._procs[fd] = (proc, callback)
+            self._epoll.register(fd, select.EPOLLIN)
+        else:
+            threading.Thread(
+                target=_notify, args=(proc, callback),
+                name='process-waiter-%d' % proc.pid, daemon=True
+            ).start()
+
+    def _run(self):
+        while True:
+            try:
+                events = self._epoll.poll()
+            except InterruptedError:
+                continue
+            for fd, _mask in events:
+                if fd == self._wakeup_r:
+                    return
+                with self._lock:
+                    proc, callback = self._procs.pop(fd)
+                self._epoll.unregister(fd)
+                os.close(fd)
+                _notify(proc, callback)
+
+    def close(self):
+        if self._epoll is not None:
+            os.write(self._wakeup_w, b'\0')
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def get_reaper() -> ProcessReaper:
+    """ Returns the process reaper shared by the runners. """
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = ProcessReaper()
+        return _reaper
@@ -0,0 +1,268 @@
+""" Detection of the job completion sentinel files.
+
+The runners delegating jobs to the cluster queuing systems wrap
+the commands in scripts which write the return code of the command
+to the *finished* file in the job directory. This module provides
+:py:class:`CompletionWatcher` which discovers those files using
+inotify on local file systems and falls back to reading the files
+directly on the network file systems, where inotify does not
+receive events from other hosts, or if inotify is not available.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import re
+import struct
+import threading
+from typing import Dict, Iterable, Optional
+
+log = logging.getLogger('slivka.scheduler')
+
+SENTINEL_FILE = 'finished'
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+_event_header = struct.Struct('iIII')
+_octal_escape_regex = re.compile(rb'\\([0-7]{3})')
+
+_network_fs_types = frozenset((
+    'nfs', 'nfs4', 'lustre', 'gpfs', 'cifs', 'smb3', 'smbfs', 'afs',
+    'ceph', 'beegfs', 'panfs', 'glusterfs', 'fuse.glusterfs',
+    'fuse.sshfs', 'fuse.cephfs', 'fuse.beegfs', '9p', 'ncpfs', 'ocfs2',
+    'gfs2', 'orangefs', 'pvfs2', 'davfs',
+))
+
+
+def read_return_code(cwd) -> Optional[int]:
+    """ Reads the return code from the sentinel file in the directory.
+
+    :param cwd: job working directory
+    :return: return code or None if not written yet
+    """
+    try:
+        with open(os.path.join(cwd, SENTINEL_FILE)) as fp:
+            return int(fp.read())
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    except ValueError:
+        # the file is created before the return code is written
+        return None
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        _ = libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _unescape_mount_point(value: bytes) -> str:
+    """ Decodes the octal escapes of the white space and backslashes
+    in the mount point, leaving the other bytes intact.
+    """
+    return os.fsdecode(_octal_escape_regex.sub(
+        lambda match: bytes([int(match.group(1), 8)]), value
+    ))
+
+
+def _mount_table():
+    """ Returns a list of mount point and file system type pairs. """
+    try:
+        with open('/proc/self/mounts', 'rb') as fp:
+            lines = fp.readlines()
+    except OSError:
+        return []
+    mounts = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        mount_point = _unescape_mount_point(fields[1])
+        mounts.append((mount_point, fields[2].decode(errors='replace')))
+    mounts.sort(key=lambda it: len(it[0]), reverse=True)
+    return mounts
+
+
+class CompletionWatcher:
+    """ Tracks the sentinel files in the job directories.
+
+    The directories on local file systems are watched with inotify
+    and the return codes are read once, when the sentinel file
+    is closed after writing. The remaining directories are checked
+    by reading the file directly when requested.
+
+    The watcher is thread-safe and is meant to be shared by all
+    the runners through :py:func:`get_watcher`.
+    """
+
+    def __init__(self, use_inotify=True):
+        self._lock = threading.Lock()
+        self._libc = _load_libc() if use_inotify else None
+        self._fd = -1
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                log.warning("inotify not available: %s",
+                            os.strerror(ctypes.get_errno()))
+            else:
+                self._fd = fd
+        self._mounts = _mount_table() if self._fd >= 0 else []
+        self._local_fs: Dict[str, bool] = {}
+        self._wd_paths: Dict[int, str] = {}
+        self._path_wds: Dict[str, int] = {}
+        self._finished: Dict[str, int] = {}
+        self._overflow = False
+        self._watch_limit_reached = False
+
+    @property
+    def event_driven(self):
+        return self._fd >= 0
+
+    def _is_local(self, path):
+        directory = os.path.dirname(path)
+        try:
+            return self._local_fs[directory]
+        except KeyError:
+            pass
+        fs_type = next(
+            (fs for mount, fs in self._mounts
+             if directory == mount or
+             directory.startswith(mount.rstrip('/') + '/')),
+            None
+        )
+        is_local = fs_type is not None and fs_type not in _network_fs_types
+        self._local_fs[directory] = is_local
+        return is_local
+
+    def _add_watch(self, path) -> bool:
+        if self._fd < 0 or not self._is_local(path):
+            return False
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path),
+            _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_ONLYDIR
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self._watch_limit_reached:
+                # the directories are retried quietly as watches are freed
+                self._watch_limit_reached = True
+                log.warning("inotify watch limit reached, falling back "
+                            "to reading sentinel files.")
+            return False
+        self._wd_paths[wd] = path
+        self._path_wds[path] = wd
+        # the file could have been written before the watch was added
+        return_code = read_return_code(path)
+        if return_code is not None:
+            self._finished[path] = return_code
+        return True
+
+    def _read_events(self):
+        while True:
+            try:
+                buffer = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return
+            except InterruptedError:
+                continue
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _cookie, length = \
+                    _event_header.unpack_from(buffer, offset)
+                offset += _event_header.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    self._overflow = True
+                    continue
+                path = self._wd_paths.get(wd)
+                if path is None:
+                    continue
+                if mask & _IN_IGNORED:
+                    # directory removed or watch deleted
+                    del self._wd_paths[wd]
+                    self._path_wds.pop(path, None)
+                elif name == SENTINEL_FILE.encode():
+                    return_code = read_return_code(path)
+                    if return_code is not None:
+                        self._finished[path] = return_code
+
+    def poll(self, paths: Iterable[str], probe: Iterable[str] = None) \
+            -> Dict[str, int]:
+        """ Returns the return codes of the finished jobs.
+
+        The directories not watched yet are added to the watch list
+        and checked once. Directories which cannot be watched are
+        checked by reading the sentinel file, but only if
+        they are also present in ``probe``.
+
+        :param paths: job directories to check
+        :param probe: directories which should be read directly if
+            cannot be watched; defaults to all ``paths``
+        :return: mapping of job directories to the return codes
+        """
+        paths = list(paths)
+        probe = set(paths if probe is None else probe)
+        result = {}
+        with self._lock:
+            if self._fd >= 0:
+                self._read_events()
+            overflow, self._overflow = self._overflow, False
+            for path in paths:
+                return_code = self._finished.get(path)
+                if return_code is None:
+                    if path in self._path_wds:
+                        if not overflow:
+                            continue
+                    elif self._add_watch(path):
+                        return_code = self._finished.get(path)
+                        if return_code is None:
+                            continue
+                    elif path not in probe:
+                        continue
+                    return_code = read_return_code(path)
+                if return_code is not None:
+                    result[path] = return_code
+        return result
+
+    def discard(self, path):
+        """ Stops watching the directory and forgets its return code. """
+        with self._lock:
+            self._finished.pop(path, None)
+            wd = self._path_wds.pop(path, None)
+            if wd is not None:
+                del self._wd_paths[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def close(self):
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+            self._wd_paths.clear()
+            self._path_wds.clear()
+            self._finished.clear()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher() -> CompletionWatcher:
+    """ Returns the completion watcher shared by the runners. """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = CompletionWatcher()
+        return _watcher
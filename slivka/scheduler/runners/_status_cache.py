@@ -0,0 +1,112 @@
+""" Helpers for querying job states from the queuing systems.
+
+:py:class:`JobStatusCache` keeps the states of the jobs tracked by
+a runner for a limited time and fetches the missing ones in chunks,
+so the query commands only list the jobs of interest and their
+argument lists stay within the system limits.
+:py:func:`stream_command` parses the output of those commands line
+by line as it is produced instead of buffering the entire output.
+"""
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, Iterator, Optional, \
+    Pattern, Sequence, Tuple
+
+from slivka import JobStatus
+from .runner import _chunks
+
+
+def stream_command(args: Sequence, pattern: Pattern,
+                   ignore: Optional[Pattern] = None,
+                   encoding='ascii') -> Iterator[Tuple]:
+    """ Runs the command and yields groups of the matching output lines.
+
+    Standard error is merged with the standard output. Lines which
+    do not match the ``pattern`` are skipped. If the command exits
+    with non-zero status and any of the skipped lines does not
+    match the ``ignore`` pattern, :py:exc:`subprocess.CalledProcessError`
+    is raised after all matching lines were yielded.
+
+    :param args: command arguments
+    :param pattern: regular expression matched against each line
+    :param ignore: pattern of the error messages which are expected
+        e.g. notifications about unknown job ids
+    :param encoding: encoding of the output, ``None`` for bytes
+    """
+    unexpected = []
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding=encoding
+    ) as proc:
+        for line in proc.stdout:
+            match = pattern.match(line)
+            if match is not None:
+                yield match.groups()
+            elif line.strip() and (ignore is None or not ignore.search(line)):
+                if len(unexpected) < 10:
+                    unexpected.append(line)
+    if proc.returncode != 0 and (unexpected or ignore is None):
+        output = (b'' if encoding is None else '').join(unexpected)
+        raise subprocess.CalledProcessError(proc.returncode, args, output)
+
+
+class JobStatusCache:
+    """ Time-limited cache of the job states.
+
+    The states are fetched with the ``fetch`` function called with
+    a list of at most ``chunk_size`` job ids and returning an iterable
+    of job id and state pairs. The jobs not returned by the function
+    are cached as unknown. Entries not requested for longer than
+    the ``ttl`` are dropped.
+
+    :param fetch: function fetching states of the listed jobs
+    :param ttl: number of seconds the states are valid for
+    :param chunk_size: max number of job ids passed to ``fetch``
+    """
+
+    def __init__(self,
+                 fetch: Callable[[list], Iterable[Tuple[Hashable, JobStatus]]],
+                 ttl: float = 5,
+                 chunk_size: int = 500):
+        self._fetch = fetch
+        self.ttl = float(ttl)
+        self.chunk_size = int(chunk_size)
+        self._entries: Dict[Hashable, Tuple[float, Optional[JobStatus]]] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, job_ids: Iterable[Hashable]) -> Dict[Hashable, JobStatus]:
+        """ Returns the states of the jobs known to the queuing system. """
+        job_ids = list(job_ids)
+        with self._lock:
+            now = time.monotonic()
+            expired = now - self.ttl
+            entries = self._entries
+            stale = [
+                jid for jid in dict.fromkeys(job_ids)
+                if entries.get(jid, (expired,))[0] <= expired
+            ]
+            for chunk in _chunks(stale, self.chunk_size):
+                fetched = dict(self._fetch(chunk))
+                for jid in chunk:
+                    entries[jid] = (now, fetched.get(jid))
+            if len(entries) > len(job_ids):
+                self._entries = entries = {
+                    jid: entry for jid, entry in entries.items()
+                    if entry[0] > expired
+                }
+            return {
+                jid: entries[jid][1] for jid in job_ids
+                if entries[jid][1] is not None
+            }
+
+    def invalidate(self, job_ids: Iterable[Hashable] = None):
+        with self._lock:
+            if job_ids is None:
+                self._entries.clear()
+            else:
+                for jid in job_ids:
+                    self._entries.pop(jid, None)
+
@@ -1,31 +1,42 @@
-import atexit
 import logging
+import math
 import os
 import re
 import shlex
 import subprocess
+import sys
 import tempfile
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Sequence, Collection
-
-from cachetools import cached, TTLCache
+from typing import Sequence, Collection, Dict, Iterator, Optional, Tuple
+from xml.etree import ElementTree
 
 from slivka import JobStatus
 from slivka.compat import resources
-from .runner import Runner, Job, Command
+from slivka.conf.loaders import parse_duration
+from ._packing import (PackingMixin, allocation_id, is_pack_member,
+                       pack_script)
+from ._sentinel import get_watcher
+from ._status_cache import JobStatusCache
+from .runner import Runner, Job, Command, ResourceUsage
 
 log = logging.getLogger('slivka.scheduler')
 
 _job_submitted_regex = re.compile(
     rb'Your job (\d+) \(.+\) has been submitted'
 )
-_job_status_regex = re.compile(
-    rb'^\s*(\d+)\s+\d+\.\d*\s+[\w-]+\s+[\w-]+\s+(\w+)',
-    re.MULTILINE
-)
+_array_submitted_regex = re.compile(rb'^(\d+)\.')
+_terse_submitted_regex = re.compile(rb'^(\d+)')
 _runner_sh_tpl = resources.read_text(__package__, "runner.sh.tpl")
+_runner_array_sh_tpl = resources.read_text(__package__, "runner-array.sh.tpl")
+_array_task_tpl = """\
+{index})
+  cd {cwd} || exit 1
+  touch started
+  {cmd} >stdout 2>stderr
+  echo $? > finished
+  ;;
+"""
 
 
 class _StatusLetterDict(dict):
@@ -36,42 +47,183 @@ class _StatusLetterDict(dict):
 
 
 _status_letters = _StatusLetterDict({
-    b'r': JobStatus.RUNNING,
-    b't': JobStatus.RUNNING,
-    b's': JobStatus.RUNNING,
-    b'qw': JobStatus.QUEUED,
-    b'T': JobStatus.QUEUED,
-    b'd': JobStatus.DELETED,
-    b'dr': JobStatus.DELETED,
-    b'E': JobStatus.ERROR,
-    b'Eqw': JobStatus.ERROR
+    'r': JobStatus.RUNNING,
+    't': JobStatus.RUNNING,
+    's': JobStatus.RUNNING,
+    'qw': JobStatus.QUEUED,
+    'T': JobStatus.QUEUED,
+    'd': JobStatus.DELETED,
+    'dr': JobStatus.DELETED,
+    'E': JobStatus.ERROR,
+    'Eqw': JobStatus.ERROR
 })
 
-_executor = ThreadPoolExecutor()
-atexit.register(_executor.shutdown)
 
+def _task_ranges(spec: str) -> Iterator[Tuple[int, int, int]]:
+    """ Yields first, last and step of each range in the task list.
+
+    The task lists of array jobs are reported as comma-separated
+    ranges e.g. ``1-10:1`` or ``3,5-9:2``.
+    """
+    for item in spec.split(','):
+        item, _, step = item.partition(':')
+        first, _, last = item.partition('-')
+        yield int(first), int(last or first), int(step or 1)
+
+
+def _job_stat(job_ids: Sequence[bytes]):
+    """ Yields job id and state pairs of the listed jobs.
+
+    ``qstat`` cannot filter the jobs by their ids, so all the jobs
+    are listed in the xml format and filtered while the output
+    is parsed. Pending tasks of array jobs are reported as ranges
+    which are matched against the requested task ids.
+    """
+    plain_ids = set()
+    task_ids = defaultdict(list)
+    for jid in job_ids:
+        number, _, task = jid.partition(b'.')
+        if task:
+            task_ids[number].append((int(task), jid))
+        else:
+            plain_ids.add(number)
+    args = ['qstat', '-xml']
+    with subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as proc:
+        try:
+            for _event, elem in ElementTree.iterparse(proc.stdout):
+                if elem.tag != 'job_list':
+                    continue
+                number = elem.findtext('JB_job_number', '').encode()
+                state = _status_letters[elem.findtext('state', '')]
+                tasks = elem.findtext('tasks')
+                elem.clear()
+                if tasks is None:
+                    if number in plain_ids:
+                        yield number, state
+                    continue
+                ranges = list(_task_ranges(tasks))
+                for task, jid in task_ids.get(number, ()):
+                    if any(first <= task <= last and (task - first) % step == 0
+                           for first, last, step in ranges):
+                        yield jid, state
+        except ElementTree.ParseError:
+            if proc.wait() == 0:
+                raise
+        stderr = proc.stderr.read()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args, stderr=stderr)
+
+
+# formats of the qacct dates differ between the grid engine flavours
+_qacct_time_formats = (
+    '%a %b %d %H:%M:%S %Y', '%m/%d/%Y %H:%M:%S.%f', '%m/%d/%Y %H:%M:%S'
+)
 
-@cached(TTLCache(maxsize=1, ttl=5))
-def _job_stat():
-    stdout = subprocess.check_output('qstat')
-    return {
-        jid: _status_letters[letter]
-        for jid, letter in _job_status_regex.findall(stdout)
-    }
+
+def _qacct_time(value) -> Optional[datetime]:
+    for fmt in _qacct_time_formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _qacct_number(value) -> Optional[float]:
+    try:
+        return float(value.rstrip('s'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _qacct_records(args: Sequence) -> Iterator[Dict[str, str]]:
+    """ Yields the accounting records listed by ``qacct``. """
+    proc = subprocess.run(
+        ['qacct', *args],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    # jobs missing from the accounting are reported with an error
+    record = {}
+    for line in proc.stdout.decode(errors='replace').splitlines():
+        if line.startswith('====='):
+            if record:
+                yield record
+            record = {}
+            continue
+        key, _, value = line.partition(' ')
+        record[key] = value.strip()
+    if record:
+        yield record
+
+
+def _job_usage(job_ids: Sequence[bytes], since: datetime) \
+        -> Dict[bytes, ResourceUsage]:
+    """ Fetches the resources used by the jobs from ``qacct``.
+
+    ``qacct`` scans the whole accounting file on every call, so it is
+    called once for all the jobs. A single job, including all the
+    tasks of an array job, is queried by its number. Otherwise, all
+    the jobs started after ``since`` are listed and the records of
+    the other jobs are skipped.
+    """
+    numbers = {jid.partition(b'.')[0] for jid in job_ids}
+    if not numbers:
+        return {}
+    if len(numbers) == 1:
+        args = ['-j', *numbers]
+    else:
+        args = ['-j', '-b', since.strftime('%Y%m%d%H%M')]
+    usage = {}
+    for record in _qacct_records(args):
+        number = record.get('jobnumber', '').encode()
+        if number not in numbers:
+            continue
+        task = record.get('taskid', 'undefined')
+        jid = number if task == 'undefined' else b'%s.%s' % (
+            number, task.encode())
+        submitted = _qacct_time(record.get('qsub_time', ''))
+        started = _qacct_time(record.get('start_time', ''))
+        max_rss = _qacct_number(record.get('ru_maxrss'))
+        usage[jid] = ResourceUsage(
+            queue_time=(
+                (started - submitted).total_seconds()
+                if submitted and started else None
+            ),
+            wall_time=_qacct_number(record.get('ru_wallclock')),
+            cpu_time=_qacct_number(record.get('cpu')),
+            max_rss=int(max_rss) if max_rss is not None else None
+        )
+    return usage
 
 
-class GridEngineRunner(Runner):
+class GridEngineRunner(PackingMixin, Runner):
     """ Implementation of the :py:class:`Runner` for Univa Grid Engine.
 
     This runner submits jobs to the Univa Grid Engine using ``qsub``
     command. Useful for more advanced systems dealing with high
     load that needs to distribute computationally heavy jobs
     and have high control over the resources used by each job.
+    The resources used by the finished jobs are read with ``qacct``,
+    looking back ``accounting_window`` seconds when several jobs are
+    read at once.
+    If ``pack_size`` is set, the short jobs are packed into shared
+    allocations of up to ``pack_size`` jobs.
     """
     finished_job_timestamp = defaultdict(datetime.now)
 
-    def __init__(self, *args, qargs=(), **kwargs):
+    def __init__(self, *args, qargs=(), status_ttl=5, pack_size=None,
+                 pack_window=30, pack_parallel=1, accounting_window=86400,
+                 **kwargs):
         super().__init__(*args, **kwargs)
+        self.accounting_window = parse_duration(accounting_window)
+        self._init_packing(pack_size, pack_window, pack_parallel)
+        self._watcher = get_watcher()
+        # all the jobs are listed by a single qstat call regardless of ids
+        self._status_cache = JobStatusCache(
+            _job_stat, ttl=status_ttl, chunk_size=sys.maxsize
+        )
         if isinstance(qargs, str):
             qargs = shlex.split(qargs)
         self.qsub_args = qargs
@@ -93,7 +245,7 @@ class GridEngineRunner(Runner):
             f.write(_runner_sh_tpl.format(cmd=cmd))
         # TODO: add -terse argument for job id only
         qsub_cmd = ['qsub', '-V', '-cwd', '-o', 'stdout', '-e', 'stderr',
-                    *self.qsub_args, path]
+                    *self._walltime_args(), *self.qsub_args, path]
         proc = subprocess.run(
             qsub_cmd,
             stdout=subprocess.PIPE,
@@ -103,55 +255,164 @@ class GridEngineRunner(Runner):
             universal_newlines=False
         )
         proc.check_returncode()
-        _job_stat.cache_clear()
         match = _job_submitted_regex.match(proc.stdout)
         return Job(match.group(1), command.cwd)
 
     def batch_submit(self, commands: Sequence[Command]) -> Sequence[Job]:
         """
-        Batch submit is performed by repeated calls to
-        :py:meth:`submit`. The thread pool executor ensures that
-        the limit of subprocesses is not be exceeded.
+        Submits the commands as a single array job. The generated
+        script dispatches the commands by the task id, changing
+        to the working directory and redirecting the output streams
+        of each command itself. The ids of the jobs consist of the
+        array job id and the task id separated by a dot.
+
+        If packing is enabled, the commands are submitted in packs
+        run by a single job each instead.
 
         :param commands: iterable of args list and cwd path pairs
         :return: list of identifiers
         """
-        return list(_executor.map(self.submit, commands))
+        commands = list(commands)
+        if self.packing.enabled:
+            jobs = []
+            for pack in self.packing.split(commands):
+                jobs.extend(self._submit_pack(pack))
+            return jobs
+        if len(commands) <= 1:
+            return list(map(self.submit, commands))
+        fd, path = tempfile.mkstemp(
+            prefix='array', suffix='.sh', dir=commands[0].cwd
+        )
+        with open(fd, 'w') as f:
+            f.write(_array_script(commands))
+        # the queue shell ignores the shebang in posix_compliant mode
+        qsub_cmd = ['qsub', '-V', '-terse', '-S', '/bin/sh',
+                    '-t', '1-%d' % len(commands),
+                    '-o', os.devnull, '-e', os.devnull,
+                    *self._walltime_args(), *self.qsub_args, path]
+        try:
+            proc = subprocess.run(
+                qsub_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                cwd=commands[0].cwd,
+                env=self.env,
+                universal_newlines=False
+            )
+        finally:
+            # qsub spools a copy of the script
+            os.unlink(path)
+        proc.check_returncode()
+        array_id = _array_submitted_regex.match(proc.stdout).group(1)
+        return [
+            Job(b'%s.%d' % (array_id, index), command.cwd)
+            for index, command in enumerate(commands, 1)
+        ]
+
+    def _walltime_args(self, rounds=1):
+        """ Returns the hard run time limit covering ``rounds`` jobs. """
+        if self.walltime is None:
+            return []
+        return ['-l', 'h_rt=%d' % math.ceil(self.walltime * rounds)]
+
+    def _submit_pack(self, commands: Sequence[Command]) -> Sequence[Job]:
+        """ Submits the commands as a single packed job. """
+        fd, path = tempfile.mkstemp(
+            prefix='pack', suffix='.sh', dir=commands[0].cwd
+        )
+        with open(fd, 'w') as f:
+            f.write(pack_script(commands, self.packing.parallel))
+        qsub_cmd = ['qsub', '-V', '-terse', '-S', '/bin/bash',
+                    '-o', os.devnull, '-e', os.devnull,
+                    *self._walltime_args(self.packing.rounds(len(commands))),
+                    *self.qsub_args, path]
+        try:
+            proc = subprocess.run(
+                qsub_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                cwd=commands[0].cwd,
+                env=self.env,
+                universal_newlines=False
+            )
+        finally:
+            os.unlink(path)
+        proc.check_returncode()
+        job_id = _terse_submitted_regex.match(proc.stdout).group(1)
+        return self._pack_jobs(job_id, commands)
 
     def check_status(self, job: Job) -> JobStatus:
         # there is no single job status check
         return self.batch_check_status([job])[0]
 
     def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
-        states = _job_stat()
+        # packed jobs share the state of their allocation
+        states = self._status_cache.get_many(
+            allocation_id(job.id) for job in jobs)
+        self._member_states(jobs, states)
+        finished = self._watcher.poll(
+            (job.cwd for job in jobs),
+            probe=(job.cwd for job in jobs if job.id not in states)
+        )
         result = []
         for job in jobs:
+            return_code = finished.get(job.cwd)
             state = states.get(job.id)
-            if state is not None:
-                result.append(state)
+            if return_code is not None:
+                status = (
+                    JobStatus.COMPLETED if return_code == 0 else
+                    JobStatus.ERROR if return_code == 127 else
+                    JobStatus.FAILED
+                )
+            elif state is not None:
+                status = state
             else:
-                fn = os.path.join(job.cwd, 'finished')
-                try:
-                    with open(fn) as fp:
-                        return_code = int(fp.read())
-                    self.finished_job_timestamp.pop(job.id, None)
-                    result.append(
-                        JobStatus.COMPLETED if return_code == 0 else
-                        JobStatus.ERROR if return_code == 127 else
-                        JobStatus.FAILED
-                    )
-                except FileNotFoundError:
-                    # one minute window for file system synchronization
-                    ts = self.finished_job_timestamp[job.id]
-                    if datetime.now() - ts < timedelta(minutes=1):
-                        result.append(JobStatus.RUNNING)
-                    else:
-                        del self.finished_job_timestamp[job.id]
-                        result.append(JobStatus.INTERRUPTED)
+                # one minute window for file system synchronization
+                ts = self.finished_job_timestamp[job.id]
+                if datetime.now() - ts < timedelta(minutes=1):
+                    status = JobStatus.RUNNING
+                else:
+                    status = JobStatus.INTERRUPTED
+            if status.is_finished():
+                self.release_jobs([job])
+            result.append(status)
         return result
 
+    def release_jobs(self, jobs: Collection[Job]):
+        for job in jobs:
+            self._watcher.discard(job.cwd)
+            self.finished_job_timestamp.pop(job.id, None)
+        self._release_members(jobs)
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        return self.batch_get_usage([job])[0]
+
+    def batch_get_usage(self, jobs: Sequence[Job]) \
+            -> Sequence[Optional[ResourceUsage]]:
+        # qacct reports only the allocations of the packed jobs
+        usage = _job_usage(
+            [job.id for job in jobs if not is_pack_member(job.id)],
+            since=datetime.now() - timedelta(seconds=self.accounting_window)
+        )
+        return [usage.get(job.id) for job in jobs]
+
     def cancel(self, job: Job):
-        subprocess.run([b'qdel', job.id])
+        self.batch_cancel([job])
 
     def batch_cancel(self, jobs: Collection[Job]):
-        subprocess.run([b'qdel', *(job.id for job in jobs)])
+        job_ids = self._cancel_packed(jobs)
+        if job_ids:
+            subprocess.run([b'qdel', *job_ids])
+
+
+def _array_script(commands: Sequence[Command]) -> str:
+    """ Creates the script running the command of the current task. """
+    tasks = (
+        _array_task_tpl.format(
+            index=index,
+            cwd=shlex.quote(command.cwd),
+            cmd=str.join(' ', map(shlex.quote, command.args))
+        )
+        for index, command in enumerate(commands, 1)
+    )
+    return _runner_array_sh_tpl.format(tasks=str.join('', tasks))
@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+case "$LSB_JOBINDEX" in
+{tasks}esac
@@ -1,23 +1,31 @@
 import logging
+import math
 import os
 import re
 import shlex
 import subprocess
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Sequence
-
-from cachetools import cached, TTLCache
+from typing import Collection, Dict, Optional, Sequence
 
 from slivka import JobStatus
 from slivka.compat import resources
 from ._bash_lex import bash_quote
-from .grid_engine import _StatusLetterDict
-from .runner import Runner, Job, Command
+from ._packing import (PackingMixin, allocation_id, is_pack_member,
+                       pack_script)
+from ._sentinel import get_watcher
+from ._status_cache import JobStatusCache, stream_command
+from .grid_engine import _StatusLetterDict, _array_task_tpl
+from .runner import Runner, Job, Command, ResourceUsage
+from .shell import _parse_memory
 
 log = logging.getLogger("slivka.scheduler")
 
 _runner_bash_tpl = resources.read_text(__package__, "lsf-runner.bash.tpl")
+_runner_array_bash_tpl = resources.read_text(
+    __package__, "lsf-runner-array.bash.tpl"
+)
+_array_job_name = 'slivka'
 
 
 _status_letters = _StatusLetterDict({
@@ -35,23 +43,78 @@ _status_letters = _StatusLetterDict({
 })
 
 
-@cached(TTLCache(maxsize=1, ttl=5))
-def _job_stat():
-    stdout = subprocess.check_output(
-        ['bjobs', '-noheader', '-w'],
-        encoding='ascii'
+# array elements share the job id and are told apart by the job name
+_bjobs_line_regex = re.compile(
+    r'^(\w+)\s+\S+\s+([A-Z]+)\b(?:.*?\s%s(\[\d+\])\s)?' % _array_job_name
+)
+_bjobs_ignored_regex = re.compile(r'is not found')
+
+
+def _job_stat(job_ids: Sequence[str]):
+    """ Yields job id and state pairs of the listed jobs.
+
+    Elements of job arrays are yielded with their index appended
+    to the job id in the ``jobid[index]`` form.
+    """
+    lines = stream_command(
+        ['bjobs', '-noheader', '-w', *job_ids],
+        _bjobs_line_regex, ignore=_bjobs_ignored_regex
     )
-    return {
-        jid: _status_letters[letter]
-        for jid, letter in re.findall(r'^(\w+)\s+\w+\s+([A-Z]+)', stdout, re.MULTILINE)
-    }
+    for jid, letter, index in lines:
+        yield jid + (index or ''), _status_letters[letter]
+
+
+_number_regex = re.compile(r'^\s*(\d+(?:\.\d+)?)')
+_bjobs_memory_regex = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT])bytes', re.I)
+
+
+def _number(value) -> Optional[float]:
+    """ Reads the leading number of the field e.g. ``125 second(s)``. """
+    match = _number_regex.match(value)
+    return float(match.group(1)) if match is not None else None
+
+
+def _job_usage(job_ids: Sequence[str]) -> Dict[str, ResourceUsage]:
+    """ Fetches the resources used by the jobs, including finished ones.
+
+    LSF keeps the finished jobs for the ``CLEAN_PERIOD``, the jobs
+    cleaned before being queried are missing from the result.
+    """
+    stdout = subprocess.run(
+        ['bjobs', '-a', '-noheader', '-o',
+         "jobid jobindex pend_time run_time cpu_used max_mem delimiter='|'",
+         *job_ids],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='ascii'
+    ).stdout
+    usage = {}
+    for line in stdout.splitlines():
+        fields = line.split('|')
+        if len(fields) != 6:
+            continue
+        jid, index, pend_time, run_time, cpu_used, max_mem = fields
+        if index.strip() not in ('', '0'):
+            jid = '%s[%s]' % (jid, index.strip())
+        memory = _bjobs_memory_regex.match(max_mem)
+        usage[jid.strip()] = ResourceUsage(
+            queue_time=_number(pend_time),
+            wall_time=_number(run_time),
+            cpu_time=_number(cpu_used),
+            max_rss=memory and int(
+                _parse_memory(memory.group(1) + memory.group(2)) * 1024
+            )
+        )
+    return usage
 
 
-class LSFRunner(Runner):
+class LSFRunner(PackingMixin, Runner):
     finished_job_timestamp = defaultdict(datetime.now)
 
-    def __init__(self, *args, bsubargs=(), **kwargs):
+    def __init__(self, *args, bsubargs=(), status_ttl=5, pack_size=None,
+                 pack_window=30, pack_parallel=1, **kwargs):
         super().__init__(*args, **kwargs)
+        self._init_packing(pack_size, pack_window, pack_parallel)
+        self._watcher = get_watcher()
+        self._status_cache = JobStatusCache(_job_stat, ttl=status_ttl)
         if isinstance(bsubargs, str):
             bsubargs = shlex.split(bsubargs)
         self.bsub_args = bsubargs
@@ -72,7 +135,7 @@ class LSFRunner(Runner):
             # we could possibly switch to "-o /dev/null" if we decide we don't want
             # the job report at all.
             ['bsub', '-o', 'stdout.lsf', '-e', 'stderr',
-             *self.bsub_args],
+             *self._walltime_args(), *self.bsub_args],
             input=input_script,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -81,46 +144,145 @@ class LSFRunner(Runner):
             encoding='ascii'
         )
         proc.check_returncode()
-        _job_stat.cache_clear()
         match = re.match(r'^Job <(\d+)>', proc.stdout)
         return Job(match.group(1), command.cwd)
 
     def batch_submit(self, commands: Sequence[Command]) -> Sequence[Job]:
-        return list(map(self.submit, commands))
+        """
+        Submits the commands as a single job array. The script
+        dispatches the commands by the array index, changing to the
+        working directory and redirecting the output streams of each
+        command itself. The job report is discarded. The ids of
+        the jobs take the ``jobid[index]`` form accepted by
+        ``bjobs`` and ``bkill``.
+
+        If packing is enabled, the commands are submitted in packs
+        run by a single job each instead.
+        """
+        commands = list(commands)
+        if self.packing.enabled:
+            jobs = []
+            for pack in self.packing.split(commands):
+                jobs.extend(self._submit_pack(pack))
+            return jobs
+        if len(commands) <= 1:
+            return list(map(self.submit, commands))
+        proc = subprocess.run(
+            ['bsub', '-J', '%s[1-%d]' % (_array_job_name, len(commands)),
+             '-o', os.devnull, '-e', os.devnull, *self._walltime_args(),
+             *self.bsub_args],
+            input=_array_script(commands),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=commands[0].cwd,
+            env=self.env,
+            encoding='ascii'
+        )
+        proc.check_returncode()
+        match = re.match(r'^Job <(\d+)>', proc.stdout)
+        return [
+            Job('%s[%d]' % (match.group(1), index), command.cwd)
+            for index, command in enumerate(commands, 1)
+        ]
+
+    def _walltime_args(self, rounds=1):
+        """ Returns the run limit option covering ``rounds`` jobs. """
+        if self.walltime is None:
+            return []
+        return ['-W', str(math.ceil(self.walltime * rounds / 60))]
+
+    def _submit_pack(self, commands: Sequence[Command]) -> Sequence[Job]:
+        """ Submits the commands as a single packed job. """
+        proc = subprocess.run(
+            ['bsub', '-o', os.devnull, '-e', os.devnull,
+             *self._walltime_args(self.packing.rounds(len(commands))),
+             *self.bsub_args],
+            input=pack_script(commands, self.packing.parallel),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=commands[0].cwd,
+            env=self.env,
+            encoding='ascii'
+        )
+        proc.check_returncode()
+        match = re.match(r'^Job <(\d+)>', proc.stdout)
+        return self._pack_jobs(match.group(1), commands)
 
     def check_status(self, job: Job) -> JobStatus:
         return self.batch_check_status([job])[0]
 
     def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
-        statuses = _job_stat()
+        # packed jobs share the state of their allocation
+        statuses = self._status_cache.get_many(
+            allocation_id(job.id) for job in jobs)
+        self._member_states(jobs, statuses)
+        # jobs finished according to LSF are listed as DONE or EXIT
+        finished = self._watcher.poll(
+            (job.cwd for job in jobs),
+            probe=(job.cwd for job in jobs
+                   if statuses.get(job.id) in
+                   (None, JobStatus.COMPLETED, JobStatus.ERROR))
+        )
         result = []
         for job in jobs:
-            status = statuses.get(job.id)
-            if status is None or status == JobStatus.COMPLETED:
-                fn = os.path.join(job.cwd, 'finished')
-                try:
-                    with open(fn) as fp:
-                        return_code = int(fp.read())
-                    self.finished_job_timestamp.pop(job.id, None)
-                    status = (
-                        JobStatus.COMPLETED if return_code == 0 else
-                        JobStatus.ERROR if return_code == 127 else
-                        JobStatus.INTERRUPTED if return_code >= 128 else
-                        JobStatus.INTERRUPTED if return_code < 0 else
-                        JobStatus.FAILED
-                    )
-                except FileNotFoundError:
+            return_code = finished.get(job.cwd)
+            if return_code is not None:
+                status = (
+                    JobStatus.COMPLETED if return_code == 0 else
+                    JobStatus.ERROR if return_code == 127 else
+                    JobStatus.INTERRUPTED if return_code >= 128 else
+                    JobStatus.INTERRUPTED if return_code < 0 else
+                    JobStatus.FAILED
+                )
+            else:
+                status = statuses.get(job.id)
+                if status is None or status == JobStatus.COMPLETED:
+                    # one minute window for file system synchronization
                     ts = self.finished_job_timestamp[job.id]
                     if datetime.now() - ts < timedelta(minutes=1):
                         status = JobStatus.RUNNING
                     else:
-                        del self.finished_job_timestamp[job.id]
                         status = JobStatus.INTERRUPTED
+            if status.is_finished():
+                self.release_jobs([job])
             result.append(status)
         return result
 
+    def release_jobs(self, jobs: Collection[Job]):
+        for job in jobs:
+            self._watcher.discard(job.cwd)
+            self.finished_job_timestamp.pop(job.id, None)
+        self._release_members(jobs)
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        return self.batch_get_usage([job])[0]
+
+    def batch_get_usage(self, jobs: Sequence[Job]) \
+            -> Sequence[Optional[ResourceUsage]]:
+        # bjobs reports only the allocations of the packed jobs
+        job_ids = [job.id for job in jobs if not is_pack_member(job.id)]
+        if not job_ids:
+            return [None] * len(jobs)
+        usage = _job_usage(job_ids)
+        return [usage.get(job.id) for job in jobs]
+
     def cancel(self, job: Job):
-        subprocess.run(['bkill', job.id])
+        self.batch_cancel([job])
 
     def batch_cancel(self, jobs: Sequence[Job]):
-        subprocess.run(['bkill', *(job.id for job in jobs)])
+        job_ids = self._cancel_packed(jobs)
+        if job_ids:
+            subprocess.run(['bkill', *job_ids])
+
+
+def _array_script(commands: Sequence[Command]) -> str:
+    """ Creates the script running the command of the array element. """
+    tasks = (
+        _array_task_tpl.format(
+            index=index,
+            cwd=bash_quote(command.cwd),
+            cmd=str.join(' ', map(bash_quote, command.args))
+        )
+        for index, command in enumerate(commands, 1)
+    )
+    return _runner_array_bash_tpl.format(tasks=str.join('', tasks))
@@ -0,0 +1,39 @@
+#!/usr/bin/env bash
+# runs the packed jobs, at most {parallel} at a time
+run_job() {{
+  cd "$1" || return 1
+  shift
+  if [ -e cancelled ]; then
+    echo 143 > finished
+    return
+  fi
+  touch started
+  "$@" >stdout 2>stderr &
+  local pid=$!
+  (
+    while kill -0 $pid 2>/dev/null; do
+      if [ -e cancelled ]; then
+        kill $pid
+        break
+      fi
+      sleep 2
+    done
+  ) &
+  local watcher=$!
+  wait $pid
+  local return_code=$?
+  kill $watcher 2>/dev/null
+  echo $return_code > finished
+}}
+
+running=0
+start() {{
+  if [ $running -ge {parallel} ]; then
+    wait -n
+    running=$((running - 1))
+  fi
+  run_job "$@" &
+  running=$((running + 1))
+}}
+
+{tasks}wait
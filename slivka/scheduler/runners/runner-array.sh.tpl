@@ -0,0 +1,3 @@
+#!/usr/bin/env sh
+case "$SGE_TASK_ID" in
+{tasks}esac
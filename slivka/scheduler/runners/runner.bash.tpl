@@ -1,4 +1,6 @@
 #!/usr/bin/env bash
 touch started
 {cmd}
-echo $? > finished
+return_code=$?
+echo $return_code > finished
+exit $return_code
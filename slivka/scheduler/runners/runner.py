@@ -1,3 +1,4 @@
+import atexit
 import contextlib
 import copy
 import filecmp
@@ -7,10 +8,12 @@ import os
 import shlex
 import shutil
 from collections import ChainMap, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union, Dict, Collection, Sequence, Optional, Any
 
 from slivka import JobStatus
 from slivka.conf import ServiceConfig
+from slivka.conf.loaders import parse_duration
 from slivka.utils.env import expandvars
 
 log = logging.getLogger('slivka.scheduler')
@@ -19,6 +22,22 @@ log = logging.getLogger('slivka.scheduler')
 RunnerID = namedtuple('RunnerID', 'service, runner')
 Command = namedtuple("Command", ["args", "cwd"])
 Job = namedtuple("Job", ["id", "cwd"])
+ResourceUsage = namedtuple(
+    "ResourceUsage", ["queue_time", "wall_time", "cpu_time", "max_rss"],
+    defaults=(None, None, None, None)
+)
+ResourceUsage.__doc__ = """ Resources used by the finished job.
+
+Times are given in seconds and the maximum resident set size
+in kilobytes. Values not reported by the queuing system are None.
+"""
+
+# job directories are prepared concurrently as file system metadata
+# operations are slow on network file systems
+_staging_executor = ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix='job-staging'
+)
+atexit.register(_staging_executor.shutdown)
 
 
 class Runner:
@@ -51,10 +70,16 @@ class Runner:
         in the command line
     :param outputs: list of output file definitions, unused by the
         base ``Runner`` but some implementations may make use of it.
+    :param walltime: maximum run time of the jobs in seconds enforced
+        by the scheduler, unlimited if None. Runners using queuing
+        systems pass it to the queuing system as well.
     """
     _next_id = (RunnerID('unknown', 'runner-%d' % i)
                 for i in itertools.count(1)).__next__
     JOBS_DIR = None
+    #: maximum number of commands passed to a single
+    #: :py:meth:`batch_submit` call by :py:meth:`batch_start`
+    submit_chunk_size = 100
 
     def __init__(self,
                  runner_id: Optional[RunnerID],
@@ -63,10 +88,12 @@ class Runner:
                  consts: Dict[str, Any],
                  outputs: List[ServiceConfig.OutputFile],
                  env: Dict[str, str],
-                 selector_options: Dict[str, Any] = None):
+                 selector_options: Dict[str, Any] = None,
+                 walltime: Optional[float] = None):
         self.id = runner_id or self._next_id()
         self.outputs = outputs
         self.selector_options = selector_options or {}
+        self.walltime = parse_duration(walltime)
 
         self.env = {
             'PATH': os.getenv('PATH'),
@@ -90,6 +117,8 @@ class Runner:
             argument.arg = shlex.split(args)
             if argument.id in consts:
                 argument.default = consts[argument.id]
+        # argument templates are compiled once and reused for every job
+        self._templates = list(map(_ArgumentTemplate, self.arguments))
 
     def get_name(self): return self.id.runner
     name = property(get_name)
@@ -113,50 +142,30 @@ class Runner:
         :return: list of command line arguments
         """
         args = []
-        for argument in self.arguments:
-            value = values.get(argument.id)
+        for template in self._templates:
+            value = values.get(template.id)
             if value is None:
-                value = argument.default
+                value = template.default
             if value is None or value is False:
                 continue
-
-            if isinstance(value, list):
-                if argument.symlink:
-                    value = [self._symlink_name(argument.symlink, i)
-                             for i in range(len(value))]
-                if argument.join is not None:
-                    value = str.join(argument.join, value)
-            elif argument.symlink:
-                value = argument.symlink
-
-            if isinstance(value, list):
-                args.extend(
-                    arg.replace('$(value)', val)
-                    for val in value
-                    for arg in argument.arg
-                )
-            else:
-                args.extend(
-                    arg.replace('$(value)', value)
-                    for arg in argument.arg
-                )
+            args.extend(template.expand(value))
         return args
 
     def _prepare_job(self, inputs, cwd):
         os.makedirs(cwd, exist_ok=True)
-        for argument in self.arguments:
-            if argument.symlink:
-                val = inputs.get(argument.id)
+        for template in self._templates:
+            if template.symlink:
+                val = inputs.get(template.id)
                 if isinstance(val, list):
-                    for i, src in enumerate(val):
+                    names = template.symlink_names(len(val))
+                    for src, dst in zip(val, names):
                         if not os.path.isfile(src):
                             raise FileNotFoundError("file '%s' does not exist" % src)
-                        dst = self._symlink_name(argument.symlink, i)
                         _mklink(src, os.path.join(cwd, dst))
                 elif isinstance(val, str):
                     if not os.path.isfile(val):
                         raise FileNotFoundError("file '%s' does not exist" % val)
-                    _mklink(val, os.path.join(cwd, argument.symlink))
+                    _mklink(val, os.path.join(cwd, template.symlink))
                 # None is also an option here and should be ignored
 
     def start(self, inputs: dict, cwd: str) -> Job:
@@ -184,21 +193,58 @@ class Runner:
         An alternative to the :py:meth:`.run` method submitting
         multiple jobs at once with :py:meth:`.batch_submit`.
 
+        Job directories are prepared concurrently by a bounded pool
+        of threads and the commands are passed to
+        :py:meth:`.batch_submit` in chunks of :py:attr:`submit_chunk_size`
+        as soon as they are ready, so the first jobs are submitted
+        while the remaining ones are still being staged.
+        If any of the jobs fails to start, the jobs already submitted
+        are cancelled and the exception is re-raised.
+
         :param inputs: list of maps containing input values for each job
         :param cwds: list of working directories for the jobs
         :return: iterable of job id and working directory pairs
         """
-        cmds = []
-        for cwd, inp in zip(cwds, inputs):
-            self._prepare_job(inp, cwd)
-            cmd = self.command + self.build_args(inp)
-            cmds.append(cmd)
-        if log.isEnabledFor(logging.INFO):
-            for i, cmd, cwd in zip(itertools.count(1), cmds, cwds):
-                log.info('%s starting command "%s" in %s (%d of %d)',
-                         self.__class__.__name__, ' '.join(map(repr, cmd)),
-                         cwd, i, len(cmds))
-        return self.batch_submit(list(map(Command._make, zip(cmds, cwds))))
+        staged = _staging_executor.map(self._stage_command, inputs, cwds)
+        total = len(cwds)
+        jobs = []
+        try:
+            for chunk in _chunks(staged, self.submit_chunk_size):
+                if log.isEnabledFor(logging.INFO):
+                    for i, cmd in enumerate(chunk, len(jobs) + 1):
+                        log.info('%s starting command "%s" in %s (%d of %d)',
+                                 self.__class__.__name__,
+                                 ' '.join(map(repr, cmd.args)),
+                                 cmd.cwd, i, total)
+                jobs.extend(self.batch_submit(chunk))
+        except BaseException:
+            if jobs:
+                log.warning('%s cancelling %d jobs of the partially '
+                            'submitted batch', self, len(jobs))
+                with contextlib.suppress(Exception):
+                    self.batch_cancel(jobs)
+            raise
+        finally:
+            staged.close()
+        return jobs
+
+    def is_batch_ready(self, count: int, wait_time: float) -> bool:
+        """ Tells the scheduler whether to start the accepted jobs now.
+
+        Runners which benefit from submitting many jobs together
+        may hold the accepted jobs back until enough of them
+        have accumulated.
+
+        Default implementation always returns True.
+
+        :param count: number of the jobs waiting to be started
+        :param wait_time: seconds the oldest of the jobs has been waiting
+        """
+        return True
+
+    def _stage_command(self, inputs, cwd) -> Command:
+        self._prepare_job(inputs, cwd)
+        return Command(self.command + self.build_args(inputs), cwd)
 
     def submit(self, command: Command) -> Job:
         """ Submits the job to the queuing system.
@@ -280,10 +326,95 @@ class Runner:
         for job in jobs:
             self.cancel(job)
 
+    def release_jobs(self, jobs: Collection[Job]):
+        """ Frees the resources used to track the jobs.
+
+        Called by the scheduler for the jobs it stops monitoring
+        before the runner reports them finished, e.g. the jobs
+        interrupted on exceeding the walltime. Deriving classes
+        keeping the per-job state should implement this method.
+
+        Default implementation does nothing.
+        """
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        """ Returns the resources used by the finished job.
+
+        Called by the scheduler once, after the job is reported
+        finished by :py:meth:`check_status`. Deriving classes may
+        implement this method if the queuing system keeps
+        the accounting of the jobs.
+
+        Default implementation returns None.
+
+        :param job: job as returned by :py:meth:`submit`
+        :return: resource usage or None if unknown
+        """
+        return None
+
+    def batch_get_usage(self, jobs: Sequence[Job]) \
+            -> Sequence[Optional[ResourceUsage]]:
+        """ Returns the resources used by multiple finished jobs.
+
+        Default implementation calls :py:meth:`get_usage`.
+        """
+        return list(map(self.get_usage, jobs))
+
     def __repr__(self):
         return '%s(%s, %s)' % (self.__class__.__name__, self.service_name, self.name)
 
 
+class _ArgumentTemplate:
+    """ Argument definition pre-processed for fast interpolation.
+
+    Each argument string is split on the ``$(value)`` placeholder
+    when the runner is created, so inserting the value into the
+    argument is reduced to a single :py:meth:`str.join` call.
+    Arguments without the placeholder are stored as one-element
+    tuples which join into the original string regardless
+    of the value.
+    """
+    __slots__ = ('id', 'default', 'symlink', 'join', 'parts', '_symlink_names')
+
+    def __init__(self, argument: ServiceConfig.Argument):
+        self.id = argument.id
+        self.default = argument.default
+        self.symlink = argument.symlink
+        self.join = argument.join
+        self.parts = [tuple(arg.split('$(value)')) for arg in argument.arg]
+        self._symlink_names = []
+
+    def symlink_names(self, count) -> List[str]:
+        names = self._symlink_names
+        if len(names) < count:
+            # replaced rather than extended in place as the templates
+            # are shared by the staging threads
+            names = [Runner._symlink_name(self.symlink, i)
+                     for i in range(count)]
+            self._symlink_names = names
+        return names[:count]
+
+    def expand(self, value) -> List[str]:
+        """ Returns the list of arguments with the value inserted. """
+        if isinstance(value, list):
+            if self.symlink:
+                value = self.symlink_names(len(value))
+            if self.join is None:
+                return [val.join(part) for val in value for part in self.parts]
+            value = self.join.join(value)
+        elif self.symlink:
+            value = self.symlink
+        return [value.join(part) for part in self.parts]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
 def _mklink(src, dst):
     try:
         os.symlink(src, dst)
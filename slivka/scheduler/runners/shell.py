@@ -1,58 +1,331 @@
+import collections
 import contextlib
 import logging
 import os
+import re
+import shlex
+import signal
 import subprocess
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Sequence, Set, Tuple
 
 from slivka import JobStatus
-from .runner import Runner, Command, Job
+from slivka.compat import resources
+from slivka.utils import LimitedSizeDict
+from ._reaper import get_reaper
+from ._sentinel import SENTINEL_FILE, read_return_code
+from .runner import Runner, Command, Job, ResourceUsage
 
 log = logging.getLogger('slivka.scheduler')
 
+_runner_sh_tpl = resources.read_text(__package__, "runner.sh.tpl")
+_SCRIPT_FILE = 'run.sh'
+_PROCESS_FILE = 'process'
+
+_size_regex = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', re.I)
+_size_units = {'': 1, 'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 ** 2}
+
+
+def _parse_memory(value) -> Optional[float]:
+    """ Converts the memory amount to megabytes.
+
+    Numbers are interpreted as megabytes, strings may have one of
+    the K, M, G or T unit suffixes.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = _size_regex.match(value)
+    if match is None:
+        raise ValueError("Invalid memory amount %r" % value)
+    number, unit = match.groups()
+    return float(number) * _size_units[unit.upper()]
+
+
+def _process_start_time(pid) -> Optional[int]:
+    """ Reads the start time of the process from the proc file system.
+
+    :return: start time in clock ticks since boot or None if
+        the process does not exist or the proc fs is not available
+    """
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as fp:
+            stat = fp.read()
+    except OSError:
+        return None
+    # the command name in parentheses may contain spaces
+    return int(stat[stat.rindex(b')') + 2:].split()[19])
+
+
+def _read_process_record(cwd) -> Optional[Tuple[int, Optional[int]]]:
+    """ Reads the pid and start time of the job process. """
+    try:
+        with open(os.path.join(cwd, _PROCESS_FILE)) as fp:
+            fields = fp.read().split()
+        pid = int(fields[0])
+        start_time = int(fields[1]) if len(fields) > 1 else None
+    except (OSError, ValueError, IndexError):
+        return None
+    return pid, start_time
+
+
+def _is_alive(pid, start_time) -> bool:
+    """ Checks if the process exists and is not a re-used pid. """
+    if start_time is not None:
+        return _process_start_time(pid) == start_time
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _return_code_status(return_code) -> JobStatus:
+    if return_code == 0:
+        return JobStatus.COMPLETED
+    if return_code == 127:
+        return JobStatus.ERROR
+    if 0 < return_code < 128:
+        return JobStatus.FAILED
+    # killed by a signal
+    return JobStatus.INTERRUPTED
+
+
+class _ShellJob:
+    __slots__ = ('cwd', 'pid', 'start_time', 'return_code',
+                 'queued_at', 'started_at', 'usage')
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self.pid: Optional[int] = None
+        self.start_time: Optional[int] = None
+        self.return_code: Optional[int] = None
+        # monotonic times of the submission and the process start
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.usage: Optional[ResourceUsage] = None
+
 
 class ShellRunner(Runner):
     """ Implementation of the :py:class:`Runner` using subprocesses.
 
     This is the most primitive approach that runs the job
     as a subprocess. Useful, if you are handling
-    very few jobs and want to run them on the same system as
+    few jobs and want to run them on the same system as
     the scheduler with minimal overhead and no queueing system.
 
-    The number of processes running simultaneously is not controlled
-    so care must be taken not to exhaust all system resources.
+    The number of processes running simultaneously can be limited
+    with the ``max_jobs`` parameter or the ``cpus`` and ``memory``
+    budgets shared by the jobs requiring ``job_cpus`` and
+    ``job_memory`` each. Jobs exceeding the limits wait in the
+    internal queue and are started in the submission order as
+    the running ones finish. If no limits are set, the number of
+    processes is not controlled so care must be taken not to
+    exhaust all system resources.
+
+    The commands are run by the wrapper script which writes the
+    return code to the *finished* file in the job directory, in its
+    own session so that the entire process group can be cancelled.
+    The pid and the start time of the process are recorded in
+    the *process* file. When the scheduler is restarted, the running
+    jobs are recovered from those files and the queued jobs, whose
+    scripts were not run yet, are queued again.
 
-    If the scheduler is restarted, the process handles are lost.
+    The resources used by the jobs are taken from the ``wait4``
+    rusage of the wrapper process, which includes the processes
+    of the command. The usage of the recovered jobs is not known.
     """
-    procs = {}
+    #: number of the finished jobs whose usage is kept
+    #: until retrieved by :py:meth:`get_usage`
+    max_usage_records = 10000
+
+    def __init__(self, *args, max_jobs=None, cpus=None, memory=None,
+                 job_cpus=1, job_memory=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        memory = _parse_memory(memory)
+        job_memory = _parse_memory(job_memory)
+        job_cpus = float(job_cpus)
+        limits = []
+        if max_jobs is not None:
+            limits.append(int(max_jobs))
+        if cpus is not None and job_cpus > 0:
+            limits.append(int(float(cpus) // job_cpus))
+        if memory is not None and job_memory > 0:
+            limits.append(int(memory // job_memory))
+        #: max number of running processes, None if unlimited
+        self.slots = min(limits) if limits else None
+        if self.slots is not None and self.slots < 1:
+            raise ValueError(
+                "Resource limits of %s do not allow any job to run."
+                % self.get_name()
+            )
+        self._jobs: Dict[str, _ShellJob] = {}
+        self._queue = collections.deque()
+        # running jobs started by the previous scheduler process
+        self._adopted: Set[_ShellJob] = set()
+        self._running = 0
+        self._usage = LimitedSizeDict(self.max_usage_records)
+        self._lock = threading.RLock()
+        self._reaper = get_reaper()
 
     def submit(self, command: Command) -> Job:
-        """ Starts the job as a subprocess. """
-        proc = subprocess.Popen(
-            command.args,
-            stdout=open(os.path.join(command.cwd, 'stdout'), 'wb'),
-            stderr=open(os.path.join(command.cwd, 'stderr'), 'wb'),
-            cwd=command.cwd,
-            env=self.env,
-            shell=False
+        """ Starts the job as a subprocess or queues it if no slot is free. """
+        job_id = uuid.uuid4().hex
+        cmd = str.join(' ', map(shlex.quote, command.args))
+        with open(os.path.join(command.cwd, _SCRIPT_FILE), 'w') as fp:
+            fp.write(_runner_sh_tpl.format(cmd=cmd))
+        shell_job = _ShellJob(command.cwd)
+        with self._lock:
+            if self.slots is None or self._running < self.slots:
+                self._start(shell_job)
+            else:
+                self._queue.append(shell_job)
+            self._jobs[job_id] = shell_job
+        return Job(job_id, command.cwd)
+
+    def _start(self, shell_job: _ShellJob):
+        cwd = shell_job.cwd
+        with open(os.path.join(cwd, 'stdout'), 'wb') as stdout, \
+                open(os.path.join(cwd, 'stderr'), 'wb') as stderr:
+            proc = subprocess.Popen(
+                ['sh', _SCRIPT_FILE],
+                stdout=stdout,
+                stderr=stderr,
+                cwd=cwd,
+                env=self.env,
+                start_new_session=True
+            )
+        shell_job.pid = proc.pid
+        shell_job.start_time = _process_start_time(proc.pid)
+        shell_job.started_at = time.monotonic()
+        with open(os.path.join(cwd, _PROCESS_FILE), 'w') as fp:
+            if shell_job.start_time is None:
+                fp.write('%d\n' % proc.pid)
+            else:
+                fp.write('%d %d\n' % (proc.pid, shell_job.start_time))
+        self._running += 1
+        self._reaper.watch(
+            proc, lambda _, rc, rusage: self._finished(shell_job, rc, rusage)
         )
-        self.procs[proc.pid] = proc
-        return Job(proc.pid, command.cwd)
+
+    def _finished(self, shell_job: _ShellJob, return_code, rusage=None):
+        # the wrapper is killed before writing the return code if cancelled
+        recorded = read_return_code(shell_job.cwd)
+        if recorded is None and return_code is not None:
+            _write_return_code(shell_job.cwd, return_code)
+            recorded = return_code
+        if shell_job.started_at is not None:
+            shell_job.usage = ResourceUsage(
+                queue_time=shell_job.started_at - shell_job.queued_at,
+                wall_time=time.monotonic() - shell_job.started_at,
+                cpu_time=rusage and rusage.ru_utime + rusage.ru_stime,
+                max_rss=rusage and rusage.ru_maxrss
+            )
+        with self._lock:
+            shell_job.return_code = (
+                recorded if recorded is not None else -signal.SIGKILL
+            )
+            self._running -= 1
+            self._start_queued()
+
+    def _start_queued(self):
+        while self._queue and (self.slots is None or self._running < self.slots):
+            shell_job = self._queue.popleft()
+            try:
+                self._start(shell_job)
+            except OSError:
+                log.exception("Starting job in %s failed.", shell_job.cwd)
+                _write_return_code(shell_job.cwd, 127)
+                shell_job.return_code = 127
+
+    def _recover(self, job: Job) -> Optional[_ShellJob]:
+        """ Restores the job started by the previous scheduler process.
+
+        Running processes are adopted and the jobs which were not
+        started yet are queued again. Returns None if the job state
+        cannot be recovered.
+        """
+        record = _read_process_record(job.cwd)
+        if record is not None:
+            pid, start_time = record
+            if not _is_alive(pid, start_time):
+                return None
+            shell_job = _ShellJob(job.cwd)
+            shell_job.pid, shell_job.start_time = pid, start_time
+            self._adopted.add(shell_job)
+            self._running += 1
+            log.info("Recovered running job %s (pid %d).", job.id, pid)
+        elif os.path.exists(os.path.join(job.cwd, _SCRIPT_FILE)):
+            shell_job = _ShellJob(job.cwd)
+            self._queue.append(shell_job)
+            self._start_queued()
+            log.info("Queued job %s again.", job.id)
+        else:
+            return None
+        self._jobs[job.id] = shell_job
+        return shell_job
+
+    def _reap_adopted(self):
+        # adopted processes are not children and must be polled
+        for shell_job in list(self._adopted):
+            if not _is_alive(shell_job.pid, shell_job.start_time):
+                self._adopted.discard(shell_job)
+                self._finished(shell_job, None)
 
     def check_status(self, job: Job) -> JobStatus:
-        try:
-            return_code = self.procs[job.id].poll()
-        except KeyError:
-            return JobStatus.INTERRUPTED
-        if return_code is None:
-            return JobStatus.RUNNING
-        if return_code == 0:
-            return JobStatus.COMPLETED
-        if return_code == 127:
-            return JobStatus.ERROR
-        if return_code > 0:
-            return JobStatus.FAILED
-        if return_code < 0:
-            return JobStatus.INTERRUPTED
+        return self.batch_check_status([job])[0]
+
+    def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
+        with self._lock:
+            self._reap_adopted()
+            return [self._status(job) for job in jobs]
+
+    def _status(self, job: Job) -> JobStatus:
+        shell_job = self._jobs.get(job.id)
+        if shell_job is None:
+            return_code = read_return_code(job.cwd)
+            if return_code is not None:
+                return _return_code_status(return_code)
+            shell_job = self._recover(job)
+            if shell_job is None:
+                return JobStatus.INTERRUPTED
+        if shell_job.return_code is None:
+            return (JobStatus.QUEUED if shell_job.pid is None
+                    else JobStatus.RUNNING)
+        del self._jobs[job.id]
+        if shell_job.usage is not None:
+            self._usage[job.id] = shell_job.usage
+        return _return_code_status(shell_job.return_code)
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        with self._lock:
+            return self._usage.pop(job.id, None)
 
     def cancel(self, job: Job):
-        with contextlib.suppress(OSError, KeyError):
-            self.procs[job.id].terminate()
+        with self._lock:
+            shell_job = self._jobs.get(job.id)
+            if shell_job is None:
+                if read_return_code(job.cwd) is not None:
+                    return
+                shell_job = self._recover(job)
+            if shell_job is None or shell_job.return_code is not None:
+                return
+            if shell_job.pid is None:
+                self._queue.remove(shell_job)
+                _write_return_code(job.cwd, -signal.SIGTERM)
+                shell_job.return_code = -signal.SIGTERM
+            elif _is_alive(shell_job.pid, shell_job.start_time):
+                # the wrapper script leads the process group
+                with contextlib.suppress(OSError):
+                    os.killpg(shell_job.pid, signal.SIGTERM)
+
+
+def _write_return_code(cwd, return_code):
+    try:
+        with open(os.path.join(cwd, SENTINEL_FILE), 'w') as fp:
+            fp.write('%d\n' % return_code)
+    except OSError:
+        log.exception("Writing the return code to %s failed.", cwd)
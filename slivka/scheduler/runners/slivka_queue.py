@@ -1,12 +1,17 @@
 import functools
 import logging
+import re
 import shlex
+import threading
+import time
+from typing import Collection, Sequence, Dict, Optional
 
 import slivka.conf
 from slivka import JobStatus
-from slivka.local_queue import LocalQueueClient
+from slivka.local_queue import LocalQueueClient, RequestError, StatusSubscriber
 from . import Command
-from .runner import Runner, Job
+from .runner import Runner, Job, ResourceUsage
+from .shell import _parse_memory
 
 log = logging.getLogger('slivka.scheduler')
 
@@ -16,6 +21,22 @@ def _get_client(address):
     return LocalQueueClient(address)
 
 
+def _progress(state: JobStatus) -> int:
+    """ Orders the states so the notifications can not move the job back. """
+    if state.is_finished():
+        return 3
+    return {JobStatus.QUEUED: 1, JobStatus.RUNNING: 2}.get(state, 0)
+
+
+def _connectable_address(notify_address, queue_address):
+    """ Replaces the wildcard host of the bound address with the queue host. """
+    match = re.match(r'tcp://(0\.0\.0\.0|\*|\[::\]):(\d+)$', notify_address)
+    if match is None:
+        return notify_address
+    host = queue_address.split('://', 1)[-1].rsplit(':', 1)[0]
+    return 'tcp://%s:%s' % (host, match.group(2))
+
+
 class SlivkaQueueRunner(Runner):
     """ Implementation of the :py:class:`Runner` for Slivka workers.
 
@@ -24,24 +45,157 @@ class SlivkaQueueRunner(Runner):
     It has an advantage of running jobs on a separate system/node,
     controlling the number of simultaneous jobs and preserving jobs
     between scheduler restarts.
+
+    Batch operations are sent to the queue as lists of up to
+    ``batch_size`` requests, all of the lists sent at once
+    without waiting for the preceding responses.
+
+    Unless the ``subscribe`` parameter is false, the runner subscribes
+    to the state notifications published by the queue and serves
+    the job states from the cache updated by the notifications.
+    The queue is asked for the states only of the jobs not seen
+    before or, if any notifications were lost, of all the jobs.
+
+    The jobs are submitted with the ``priority``, the number of
+    ``cores`` and the ``memory`` (in megabytes or with a unit suffix)
+    given in the runner parameters, used by the queue to order
+    the jobs and to share its resources between them.
+
+    The resources used by the finished jobs are measured by the queue
+    and retrieved along with the job states.
     """
-    def __init__(self, *args, address=None, **kwargs):
+    batch_size = 1000
+    #: seconds between the attempts to subscribe to the notifications
+    subscribe_retry_interval = 60
+
+    def __init__(self, *args, address=None, subscribe=True, priority=0,
+                 cores=1, memory=0, **kwargs):
         super().__init__(*args, **kwargs)
+        self.resources = {
+            'priority': int(priority),
+            'cores': float(cores),
+            'memory': _parse_memory(memory)
+        }
         if address is None:
             address = slivka.conf.settings.local_queue.host
         self.client = _get_client(address)
+        if isinstance(subscribe, str):
+            subscribe = subscribe.lower() in ('true', 'yes', '1')
+        self.subscribe = subscribe
+        self._subscriber: Optional[StatusSubscriber] = None
+        self._subscribe_time = float('-inf')
+        self._states: Dict[int, JobStatus] = {}
+        self._lock = threading.Lock()
+
+    def _get_subscriber(self) -> Optional[StatusSubscriber]:
+        if self._subscriber is not None or not self.subscribe:
+            return self._subscriber
+        now = time.monotonic()
+        if now - self._subscribe_time < self.subscribe_retry_interval:
+            return None
+        self._subscribe_time = now
+        try:
+            info = self.client.get_info()
+        except (ConnectionError, RequestError) as e:
+            log.warning("Subscribing to the queue notifications failed: %s", e)
+            return None
+        self._subscriber = StatusSubscriber(
+            _connectable_address(info['notify'], self.client.address),
+            info['epoch'], info['seq']
+        )
+        # notifications sent before the subscription may have been missed
+        self._states.clear()
+        return self._subscriber
 
     def submit(self, command: Command) -> Job:
         response = self.client.submit_job(
             cmd=str.join(' ', map(shlex.quote, command.args)),
             cwd=command.cwd,
-            env=self.env
+            env=self.env,
+            **self.resources
         )
         return Job(response.id, command.cwd)
 
+    def batch_submit(self, commands: Sequence[Command]) -> Sequence[Job]:
+        with self._lock:
+            # subscribe before the notifications about new jobs are sent
+            self._get_subscriber()
+        responses = self.client.submit_jobs(
+            [(str.join(' ', map(shlex.quote, command.args)),
+              command.cwd, self.env)
+             for command in commands],
+            batch_size=self.batch_size,
+            **self.resources
+        )
+        jobs = [
+            Job(response.id, command.cwd)
+            for response, command in zip(responses, commands)
+        ]
+        if self._subscriber is not None:
+            with self._lock:
+                for job in jobs:
+                    self._states.setdefault(job.id, JobStatus.QUEUED)
+        return jobs
+
     def check_status(self, job: Job) -> JobStatus:
         response = self.client.get_job_status(job.id)
         return JobStatus(response.state)
 
+    def _fetch_states(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
+        responses = self.client.get_job_statuses(
+            [job.id for job in jobs], batch_size=self.batch_size
+        )
+        return [JobStatus(response.state) for response in responses]
+
+    def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
+        with self._lock:
+            subscriber = self._get_subscriber()
+            if subscriber is None:
+                return self._fetch_states(jobs)
+            cache = self._states
+            updates, gap = subscriber.receive()
+            if gap:
+                log.debug("Job state notifications lost, fetching all states.")
+                cache.clear()
+            for update in updates:
+                state = JobStatus(update.state)
+                known = cache.get(update.id)
+                if known is not None and _progress(state) >= _progress(known):
+                    cache[update.id] = state
+            missing = [job for job in jobs if job.id not in cache]
+            for job, state in zip(missing, self._fetch_states(missing)):
+                known = cache.get(job.id)
+                if known is None or _progress(state) >= _progress(known):
+                    cache[job.id] = state
+            states = [cache[job.id] for job in jobs]
+            for job, state in zip(jobs, states):
+                if state.is_finished() or state == JobStatus.UNKNOWN:
+                    # no longer tracked by the scheduler
+                    del cache[job.id]
+            return states
+
+    def release_jobs(self, jobs: Collection[Job]):
+        with self._lock:
+            for job in jobs:
+                self._states.pop(job.id, None)
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        return self.batch_get_usage([job])[0]
+
+    def batch_get_usage(self, jobs: Sequence[Job]) \
+            -> Sequence[Optional[ResourceUsage]]:
+        responses = self.client.get_job_statuses(
+            [job.id for job in jobs], batch_size=self.batch_size
+        )
+        return [
+            response.usage and ResourceUsage(**response.usage)
+            for response in responses
+        ]
+
     def cancel(self, job: Job):
         self.client.cancel_job(job.id)
+
+    def batch_cancel(self, jobs: Sequence[Job]):
+        self.client.cancel_jobs(
+            [job.id for job in jobs], batch_size=self.batch_size
+        )
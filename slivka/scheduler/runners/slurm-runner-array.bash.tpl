@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+case "$SLURM_ARRAY_TASK_ID" in
+{tasks}esac
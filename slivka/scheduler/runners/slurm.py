@@ -1,20 +1,23 @@
 import logging
+import math
 import os
-import pwd
 import re
 import shlex
 import subprocess
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Sequence
-
-from cachetools import cached, TTLCache
+from typing import Sequence, Collection, Dict, Optional
 
 from slivka import JobStatus
 from slivka.compat import resources
 from ._bash_lex import bash_quote
+from ._packing import (PackingMixin, allocation_id, is_pack_member,
+                       pack_script)
+from ._sentinel import get_watcher
+from ._status_cache import JobStatusCache, stream_command
 from .grid_engine import _StatusLetterDict
-from .runner import Runner, Job, Command
+from .runner import Runner, Job, Command, ResourceUsage
+from .shell import _parse_memory
 
 log = logging.getLogger("slivka.scheduler")
 
@@ -47,27 +50,166 @@ _status_letters = _StatusLetterDict({
     'TO': JobStatus.INTERRUPTED
 })
 
-username = pwd.getpwuid(os.getuid()).pw_name
+# final job states reported by the accounting, see sacct(1)
+_accounting_states = {
+    'BOOT_FAIL': JobStatus.ERROR,
+    'CANCELLED': JobStatus.INTERRUPTED,
+    'COMPLETED': JobStatus.COMPLETED,
+    'COMPLETING': JobStatus.RUNNING,
+    'DEADLINE': JobStatus.INTERRUPTED,
+    'FAILED': JobStatus.FAILED,
+    'NODE_FAIL': JobStatus.ERROR,
+    'OUT_OF_MEMORY': JobStatus.ERROR,
+    'PENDING': JobStatus.QUEUED,
+    'PREEMPTED': JobStatus.INTERRUPTED,
+    'REQUEUED': JobStatus.QUEUED,
+    'RESIZING': JobStatus.RUNNING,
+    'REVOKED': JobStatus.DELETED,
+    'RUNNING': JobStatus.RUNNING,
+    'SUSPENDED': JobStatus.QUEUED,
+    'TIMEOUT': JobStatus.INTERRUPTED,
+}
 
+_squeue_line_regex = re.compile(r'^(\w+) ([A-Z]+)$')
+_squeue_ignored_regex = re.compile(r'Invalid job id')
 
-@cached(TTLCache(maxsize=1, ttl=5))
-def _job_stat():
-    stdout = subprocess.check_output(
+
+def _job_stat(job_ids: Sequence[str]):
+    """ Yields job id and state pairs of the listed jobs. """
+    lines = stream_command(
         ['squeue', '--array', '--format=%i %t', '--noheader', '--states=all',
-         '--user=%s' % username],
+         '--jobs=%s' % ','.join(job_ids)],
+        _squeue_line_regex, ignore=_squeue_ignored_regex
+    )
+    for jid, letter in lines:
+        yield jid, _status_letters[letter]
+
+
+def _job_accounting(job_ids: Sequence[str]) -> Dict[str, JobStatus]:
+    """ Fetches the states of the jobs from the Slurm accounting.
+
+    Only the job allocations are queried, the job steps are omitted.
+    Jobs not recorded in the accounting database are missing from
+    the result.
+    """
+    stdout = subprocess.check_output(
+        ['sacct', '--noheader', '--parsable2', '--allocations',
+         '--format=JobID,State,ExitCode', '--jobs=%s' % ','.join(job_ids)],
         encoding='ascii'
     )
+    result = {}
+    for line in stdout.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3:
+            continue
+        jid, state, exit_code = fields
+        # state may be followed by a reason e.g. "CANCELLED by 1000"
+        state = state.split(' ', 1)[0].rstrip('+')
+        status = _accounting_states.get(state)
+        if status is None:
+            log.warning('Unknown accounting state %s of job %s', state, jid)
+            continue
+        if status == JobStatus.FAILED:
+            return_code = int(exit_code.split(':', 1)[0] or 0)
+            status = (
+                JobStatus.ERROR if return_code == 127 else
+                JobStatus.INTERRUPTED if return_code >= 128 else
+                JobStatus.FAILED
+            )
+        result[jid] = status
+    return result
+
+
+def _parse_duration(value) -> Optional[float]:
+    """ Converts the ``[DD-[HH:]]MM:SS[.sss]`` duration to seconds. """
+    if not value:
+        return None
+    days, _, clock = value.rpartition('-')
+    seconds = 0.0
+    for part in clock.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400
+
+
+def _time_between(start, end) -> Optional[float]:
+    """ Returns seconds between two accounting timestamps if both known. """
+    try:
+        start = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+        end = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        # "Unknown" or "None" if the job did not start
+        return None
+    return (end - start).total_seconds()
+
+
+def _job_usage(job_ids: Sequence[str]) -> Dict[str, ResourceUsage]:
+    """ Fetches the resources used by the jobs from the Slurm accounting.
+
+    The times are taken from the job allocations and the memory
+    from the job steps, as the allocations do not report it.
+    """
+    stdout = subprocess.check_output(
+        ['sacct', '--noheader', '--parsable2',
+         '--format=JobID,Submit,Start,ElapsedRaw,TotalCPU,MaxRSS',
+         '--jobs=%s' % ','.join(job_ids)],
+        encoding='ascii'
+    )
+    usage = {}
+    max_rss = {}
+    for line in stdout.splitlines():
+        fields = line.split('|')
+        if len(fields) != 6:
+            continue
+        jid, submit, start, elapsed, total_cpu, rss = fields
+        jid, _, step = jid.partition('.')
+        try:
+            if step and rss:
+                rss = int(_parse_memory(rss) * 1024)
+                max_rss[jid] = max(max_rss.get(jid, 0), rss)
+            elif not step:
+                usage[jid] = ResourceUsage(
+                    queue_time=_time_between(submit, start),
+                    wall_time=float(elapsed) if elapsed else None,
+                    cpu_time=_parse_duration(total_cpu)
+                )
+        except ValueError:
+            log.warning('Invalid accounting record of job %s: %s', jid, line)
     return {
-        jid: _status_letters[letter]
-        for jid, letter in re.findall(r'^(\w+) ([A-Z]+)$', stdout, re.MULTILINE)
+        jid: record._replace(max_rss=max_rss.get(jid))
+        for jid, record in usage.items()
     }
 
 
-class SlurmRunner(Runner):
+class SlurmRunner(PackingMixin, Runner):
+    """ Implementation of the :py:class:`Runner` for Slurm.
+
+    Jobs are submitted with ``sbatch`` and monitored with ``squeue``
+    limited to the jobs being tracked, whose output is cached for
+    ``status_ttl`` seconds.
+    The final states of the jobs which left the queue are resolved
+    from the Slurm accounting with ``sacct``, unless
+    ``use_accounting`` parameter is false, and the completion
+    sentinel files otherwise. The resources used by the finished
+    jobs are also retrieved from the accounting.
+
+    If ``pack_size`` is set, the short jobs are packed into shared
+    allocations of up to ``pack_size`` jobs, see
+    :py:mod:`slivka.scheduler.runners._packing`.
+    """
     finished_job_timestamp = defaultdict(datetime.now)
+    accounting_chunk_size = 1000
+    _accounting_failed = False
 
-    def __init__(self, *args, sbatchargs=(), **kwargs):
+    def __init__(self, *args, sbatchargs=(), use_accounting=True,
+                 status_ttl=5, pack_size=None, pack_window=30,
+                 pack_parallel=1, **kwargs):
         super().__init__(*args, **kwargs)
+        self._init_packing(pack_size, pack_window, pack_parallel)
+        self._watcher = get_watcher()
+        self._status_cache = JobStatusCache(_job_stat, ttl=status_ttl)
+        if isinstance(use_accounting, str):
+            use_accounting = use_accounting.lower() in ('true', 'yes', '1')
+        self.use_accounting = use_accounting
         if isinstance(sbatchargs, str):
             sbatchargs = shlex.split(sbatchargs)
         self.sbatch_args = sbatchargs
@@ -81,7 +223,7 @@ class SlurmRunner(Runner):
         input_script = _runner_bash_tpl.format(cmd=cmd)
         proc = subprocess.run(
             ['sbatch', '--output=stdout', '--error=stderr', '--parsable',
-             *self.sbatch_args],
+             *self._walltime_args(), *self.sbatch_args],
             input=input_script,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -90,46 +232,148 @@ class SlurmRunner(Runner):
             encoding='ascii'
         )
         proc.check_returncode()
-        _job_stat.cache_clear()
         match = re.match(r'^(\w+)', proc.stdout)
         return Job(match.group(0), command.cwd)
 
     def batch_submit(self, commands: Sequence[Command]) -> Sequence[Job]:
-        return list(map(self.submit, commands))
+        if not self.packing.enabled:
+            return list(map(self.submit, commands))
+        jobs = []
+        for pack in self.packing.split(commands):
+            jobs.extend(self._submit_pack(pack))
+        return jobs
+
+    def _walltime_args(self, rounds=1):
+        """ Returns the time limit option covering ``rounds`` jobs. """
+        if self.walltime is None:
+            return []
+        minutes = math.ceil(self.walltime * rounds / 60)
+        return ['--time=%d-%02d:%02d:00' % (
+            minutes // 1440, minutes // 60 % 24, minutes % 60)]
+
+    def _submit_pack(self, commands: Sequence[Command]) -> Sequence[Job]:
+        """ Submits the commands as a single packed job. """
+        proc = subprocess.run(
+            ['sbatch', '--output=%s' % os.devnull, '--error=%s' % os.devnull,
+             '--parsable',
+             *self._walltime_args(self.packing.rounds(len(commands))),
+             *self.sbatch_args],
+            input=pack_script(commands, self.packing.parallel),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=commands[0].cwd,
+            env=self.env,
+            encoding='ascii'
+        )
+        proc.check_returncode()
+        match = re.match(r'^(\w+)', proc.stdout)
+        return self._pack_jobs(match.group(0), commands)
 
     def check_status(self, job: Job) -> JobStatus:
         return self.batch_check_status([job])[0]
 
     def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
-        statuses = _job_stat()
+        # packed jobs share the state of their allocation
+        statuses = self._status_cache.get_many(
+            allocation_id(job.id) for job in jobs)
+        self._member_states(jobs, statuses)
+        # sentinel files noticed by the watcher; not read directly
+        finished = self._watcher.poll((job.cwd for job in jobs), probe=())
+        gone = [
+            job for job in jobs
+            if job.cwd not in finished and
+            statuses.get(job.id) in (None, JobStatus.COMPLETED)
+        ]
+        # the accounting knows only the allocations of the packed jobs
+        accounted = self._fetch_accounting(
+            [job.id for job in gone if not is_pack_member(job.id)])
+        # the accounting may lag behind and still list the job unfinished
+        final = {
+            job_id: status for job_id, status in accounted.items()
+            if status.is_finished()
+        }
+        finished.update(self._watcher.poll(
+            job.cwd for job in gone if job.id not in final
+        ))
         result = []
         for job in jobs:
-            status = statuses.get(job.id)
-            if status is None or status == JobStatus.COMPLETED:
-                fn = os.path.join(job.cwd, 'finished')
-                try:
-                    with open(fn) as fp:
-                        return_code = int(fp.read())
-                    self.finished_job_timestamp.pop(job.id, None)
-                    status = (
-                        JobStatus.COMPLETED if return_code == 0 else
-                        JobStatus.ERROR if return_code == 127 else
-                        JobStatus.INTERRUPTED if return_code >= 128 else
-                        JobStatus.INTERRUPTED if return_code < 0 else
-                        JobStatus.FAILED
-                    )
-                except FileNotFoundError:
+            return_code = finished.get(job.cwd)
+            if return_code is not None:
+                status = (
+                    JobStatus.COMPLETED if return_code == 0 else
+                    JobStatus.ERROR if return_code == 127 else
+                    JobStatus.INTERRUPTED if return_code >= 128 else
+                    JobStatus.INTERRUPTED if return_code < 0 else
+                    JobStatus.FAILED
+                )
+            elif job.id in final:
+                status = final[job.id]
+            else:
+                status = statuses.get(job.id)
+                if status is None or status == JobStatus.COMPLETED:
+                    # one minute window for file system synchronization
+                    # and the accounting to catch up
                     ts = self.finished_job_timestamp[job.id]
                     if datetime.now() - ts < timedelta(minutes=1):
-                        status = JobStatus.RUNNING
+                        status = accounted.get(job.id, JobStatus.RUNNING)
                     else:
-                        del self.finished_job_timestamp[job.id]
                         status = JobStatus.INTERRUPTED
+            if status.is_finished():
+                self.release_jobs([job])
             result.append(status)
         return result
 
+    def release_jobs(self, jobs: Collection[Job]):
+        for job in jobs:
+            self._watcher.discard(job.cwd)
+            self.finished_job_timestamp.pop(job.id, None)
+        self._release_members(jobs)
+
+    def _fetch_accounting(self, job_ids) -> Dict[str, JobStatus]:
+        if not job_ids or not self.use_accounting:
+            return {}
+        accounted = {}
+        try:
+            for i in range(0, len(job_ids), self.accounting_chunk_size):
+                accounted.update(_job_accounting(
+                    job_ids[i:i + self.accounting_chunk_size]
+                ))
+        except (OSError, subprocess.CalledProcessError) as e:
+            # accounting may be disabled or the database unreachable
+            if not SlurmRunner._accounting_failed:
+                log.warning("Slurm accounting query failed: %s. Falling "
+                            "back to the sentinel files.", e)
+            SlurmRunner._accounting_failed = True
+            return {}
+        SlurmRunner._accounting_failed = False
+        return accounted
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        return self.batch_get_usage([job])[0]
+
+    def batch_get_usage(self, jobs: Sequence[Job]) \
+            -> Sequence[Optional[ResourceUsage]]:
+        if not jobs or not self.use_accounting:
+            return [None] * len(jobs)
+        # the accounting does not separate the packed jobs
+        job_ids = [job.id for job in jobs if not is_pack_member(job.id)]
+        if not job_ids:
+            return [None] * len(jobs)
+        usage = {}
+        try:
+            for i in range(0, len(job_ids), self.accounting_chunk_size):
+                usage.update(_job_usage(
+                    job_ids[i:i + self.accounting_chunk_size]
+                ))
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning("Slurm accounting query failed: %s.", e)
+            return [None] * len(jobs)
+        return [usage.get(job.id) for job in jobs]
+
     def cancel(self, job: Job):
-        subprocess.run(['scancel', job.id])
+        self.batch_cancel([job])
 
     def batch_cancel(self, jobs: Sequence[Job]):
-        subprocess.run(['scancel', *(job.id for job in jobs)])
+        job_ids = self._cancel_packed(jobs)
+        if job_ids:
+            subprocess.run(['scancel', *job_ids])
@@ -0,0 +1,386 @@
+""" Runner submitting jobs through the Slurm REST API.
+
+Unlike :py:class:`SlurmRunner`, which spawns ``sbatch``, ``squeue``
+and ``scancel`` processes, :py:class:`SlurmRestRunner` talks to the
+``slurmrestd`` daemon over persistent HTTP connections kept in
+a pool and shared by the runner threads.
+"""
+import getpass
+import http.client
+import json
+import logging
+import math
+import os
+import queue
+import re
+import socket
+import urllib.parse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Collection, Sequence, Optional, Tuple
+
+from slivka import JobStatus
+from slivka.compat import resources
+from ._bash_lex import bash_quote
+from ._sentinel import get_watcher
+from ._status_cache import JobStatusCache
+from .grid_engine import _array_task_tpl, _task_ranges
+from .runner import Runner, Job, Command
+from .slurm import _accounting_states
+
+log = logging.getLogger("slivka.scheduler")
+
+_runner_bash_tpl = resources.read_text(__package__, "runner.bash.tpl")
+_runner_array_bash_tpl = resources.read_text(
+    __package__, "slurm-runner-array.bash.tpl"
+)
+
+
+class SlurmRestError(Exception):
+    """ Raised when slurmrestd rejects the request. """
+
+    def __init__(self, status, errors=()):
+        self.status = status
+        self.errors = list(errors)
+        messages = [
+            error.get('description') or error.get('error') or str(error)
+            for error in self.errors
+        ]
+        super().__init__(
+            "HTTP %d: %s" % (status, str.join('; ', messages) or 'no details')
+        )
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP connection over a unix domain socket. """
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class _ConnectionPool:
+    """ Pool of persistent HTTP connections to a single server.
+
+    Up to ``size`` idle connections are kept open for reuse.
+    Concurrent requests exceeding the pool size open additional
+    connections which are closed after the response is read.
+
+    :param url: server url, the ``unix`` scheme denotes a path
+        to the unix socket
+    :param headers: headers sent with every request
+    :param size: max number of idle connections
+    :param timeout: socket timeout in seconds
+    """
+
+    def __init__(self, url, headers=None, size=4, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme == 'unix':
+            self._factory = partial(
+                _UnixHTTPConnection, parsed.path, timeout=timeout
+            )
+            self._prefix = ''
+        elif parsed.scheme in ('http', 'https'):
+            cls = (http.client.HTTPSConnection if parsed.scheme == 'https'
+                   else http.client.HTTPConnection)
+            self._factory = partial(
+                cls, parsed.hostname, parsed.port, timeout=timeout
+            )
+            self._prefix = parsed.path.rstrip('/')
+        else:
+            raise ValueError("Unsupported url scheme %r" % parsed.scheme)
+        self._headers = dict(headers or {})
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def request(self, method, path, body=None):
+        """ Sends the request and returns the status and the body. """
+        headers = dict(self._headers)
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        headers['Accept'] = 'application/json'
+        while True:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._factory(), False
+            try:
+                conn.request(method, self._prefix + path, body, headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                # the server closed the idle connection; retry with a new one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, content
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _number(value) -> Optional[int]:
+    """ Unwraps the numbers which newer API versions wrap in objects. """
+    if isinstance(value, dict):
+        if not value.get('set', True) or value.get('infinite'):
+            return None
+        return value.get('number')
+    return value
+
+
+def _version_info(version: str) -> Tuple[int, ...]:
+    """ Converts the API version such as ``v0.0.40`` to a tuple. """
+    numbers = re.findall(r'\d+', version)
+    if not numbers:
+        raise ValueError("Invalid API version %r" % version)
+    return tuple(map(int, numbers))
+
+
+def _job_state(job: dict) -> JobStatus:
+    state = job.get('job_state')
+    if isinstance(state, list):
+        # base state followed by the flags
+        state = state[0] if state else None
+    status = _accounting_states.get(state)
+    if status is None:
+        log.warning('Unknown state %s of job %s', state, job.get('job_id'))
+        return JobStatus.UNKNOWN
+    return status
+
+
+class SlurmRestRunner(Runner):
+    """ Implementation of the :py:class:`Runner` for the Slurm REST API.
+
+    Jobs are submitted to, monitored and cancelled by ``slurmrestd``
+    at the ``url`` given either as a http(s) address or a path to
+    the unix socket with the ``unix://`` prefix. Batches are submitted
+    as single array jobs and the states of the tracked jobs are fetched
+    by their ids in a single request and cached for ``status_ttl``
+    seconds.
+    The final states are resolved from the completion sentinel files.
+
+    The JSON web token is taken from the ``token`` parameter or
+    the ``SLURM_JWT`` environment variable and sent together with
+    the ``user`` name, unless the unix socket authentication is used.
+    The ``job_properties`` are merged into the job descriptions
+    to specify the partition, time limit, etc.
+    """
+    finished_job_timestamp = defaultdict(datetime.now)
+
+    def __init__(self, *args, url, api_version='v0.0.40', token=None,
+                 user=None, job_properties=None, pool_size=4, timeout=30,
+                 status_ttl=5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api_version = api_version
+        self._version_info = _version_info(api_version)
+        self.job_properties = dict(job_properties or {})
+        token = token or os.getenv('SLURM_JWT')
+        headers = {}
+        if token:
+            headers['X-SLURM-USER-TOKEN'] = token
+            headers['X-SLURM-USER-NAME'] = user or getpass.getuser()
+        self._pool = _ConnectionPool(
+            url, headers, size=int(pool_size), timeout=float(timeout)
+        )
+        self._watcher = get_watcher()
+        self._status_cache = JobStatusCache(self._job_stat, ttl=status_ttl)
+        self.env.update(
+            (env, os.getenv(env)) for env in os.environ
+            if env.startswith("SLURM") and env != 'SLURM_JWT'
+        )
+
+    def _request(self, method, path, body=None) -> dict:
+        status, content = self._pool.request(
+            method, '/slurm/%s%s' % (self.api_version, path), body
+        )
+        try:
+            data = json.loads(content) if content else {}
+        except ValueError:
+            data = {}
+        if status >= 400 or data.get('errors'):
+            raise SlurmRestError(status, data.get('errors', ()))
+        return data
+
+    def _job_description(self, cwd, **properties):
+        if self.walltime is not None and 'time_limit' not in self.job_properties:
+            minutes = math.ceil(self.walltime / 60)
+            properties.setdefault('time_limit', (
+                {'set': True, 'infinite': False, 'number': minutes}
+                if self._version_info >= (0, 0, 40) else minutes
+            ))
+        return {
+            **self.job_properties,
+            'current_working_directory': cwd,
+            'environment': [
+                '%s=%s' % item for item in self.env.items()
+                if item[1] is not None
+            ],
+            **properties
+        }
+
+    def submit(self, command: Command) -> Job:
+        cmd = str.join(' ', map(bash_quote, command.args))
+        data = self._request('POST', '/job/submit', {
+            'script': _runner_bash_tpl.format(cmd=cmd),
+            'job': self._job_description(
+                command.cwd,
+                standard_output=os.path.join(command.cwd, 'stdout'),
+                standard_error=os.path.join(command.cwd, 'stderr')
+            )
+        })
+        return Job(str(data['job_id']), command.cwd)
+
+    def batch_submit(self, commands: Sequence[Command]) -> Sequence[Job]:
+        """
+        Submits the commands as a single array job whose script
+        dispatches the commands by the task id. The ids of the jobs
+        take the ``jobid_taskid`` form.
+        """
+        commands = list(commands)
+        if len(commands) <= 1:
+            return list(map(self.submit, commands))
+        data = self._request('POST', '/job/submit', {
+            'script': _array_script(commands),
+            'job': self._job_description(
+                commands[0].cwd,
+                array='1-%d' % len(commands),
+                standard_output=os.devnull,
+                standard_error=os.devnull
+            )
+        })
+        return [
+            Job('%s_%d' % (data['job_id'], index), command.cwd)
+            for index, command in enumerate(commands, 1)
+        ]
+
+    def _job_stat(self, job_ids: Sequence[str]):
+        """ Yields job id and state pairs of the listed jobs.
+
+        The jobs are requested by their ids, the array tasks by the id
+        of their array job. Pending tasks of array jobs are listed as
+        a single record with the task ranges which are matched against
+        the requested task ids.
+        """
+        plain_ids = set()
+        task_ids = defaultdict(list)
+        for jid in job_ids:
+            number, _, task = jid.partition('_')
+            if task:
+                task_ids[number].append((int(task), jid))
+            else:
+                plain_ids.add(number)
+        numbers = str.join(',', dict.fromkeys(
+            jid.partition('_')[0] for jid in job_ids))
+        for job in self._request('GET', '/job/%s' % numbers).get('jobs', ()):
+            array_id = _number(job.get('array_job_id'))
+            if not array_id:
+                jid = str(_number(job.get('job_id')))
+                if jid in plain_ids:
+                    yield jid, _job_state(job)
+                continue
+            tasks = task_ids.get(str(array_id))
+            if not tasks:
+                continue
+            task = _number(job.get('array_task_id'))
+            if task is not None:
+                ranges = [(task, task, 1)]
+            else:
+                spec = job.get('array_task_string') or ''
+                # strip the limit of simultaneous tasks e.g. "1-10%2"
+                ranges = list(_task_ranges(spec.split('%', 1)[0])) if spec else []
+            for task, jid in tasks:
+                if any(first <= task <= last and (task - first) % step == 0
+                       for first, last, step in ranges):
+                    yield jid, _job_state(job)
+
+    def check_status(self, job: Job) -> JobStatus:
+        return self.batch_check_status([job])[0]
+
+    def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
+        statuses = self._status_cache.get_many(job.id for job in jobs)
+        finished = self._watcher.poll(
+            (job.cwd for job in jobs),
+            probe=(job.cwd for job in jobs
+                   if statuses.get(job.id) in
+                   (None, JobStatus.COMPLETED, JobStatus.FAILED))
+        )
+        result = []
+        for job in jobs:
+            return_code = finished.get(job.cwd)
+            if return_code is not None:
+                status = (
+                    JobStatus.COMPLETED if return_code == 0 else
+                    JobStatus.ERROR if return_code == 127 else
+                    JobStatus.INTERRUPTED if return_code >= 128 else
+                    JobStatus.INTERRUPTED if return_code < 0 else
+                    JobStatus.FAILED
+                )
+            else:
+                status = statuses.get(job.id)
+                if status is None or status == JobStatus.COMPLETED:
+                    # one minute window for file system synchronization
+                    ts = self.finished_job_timestamp[job.id]
+                    if datetime.now() - ts < timedelta(minutes=1):
+                        status = JobStatus.RUNNING
+                    else:
+                        status = JobStatus.INTERRUPTED
+            if status.is_finished():
+                self.release_jobs([job])
+            result.append(status)
+        return result
+
+    def release_jobs(self, jobs: Collection[Job]):
+        for job in jobs:
+            self._watcher.discard(job.cwd)
+            self.finished_job_timestamp.pop(job.id, None)
+
+    def cancel(self, job: Job):
+        try:
+            self._request('DELETE', '/job/%s' % job.id)
+        except SlurmRestError as e:
+            log.warning("Cancelling job %s failed: %s", job.id, e)
+        self._status_cache.invalidate([job.id])
+
+    def batch_cancel(self, jobs: Sequence[Job]):
+        for job in jobs:
+            self.cancel(job)
+
+
+def _array_script(commands: Sequence[Command]) -> str:
+    """ Creates the script running the command of the array task. """
+    tasks = (
+        _array_task_tpl.format(
+            index=index,
+            cwd=bash_quote(command.cwd),
+            cmd=str.join(' ', map(bash_quote, command.args))
+        )
+        for index, command in enumerate(commands, 1)
+    )
+    return _runner_array_bash_tpl.format(tasks=str.join('', tasks))
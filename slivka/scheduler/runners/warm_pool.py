@@ -0,0 +1,547 @@
+""" Execution of the Python scripts in the pool of warm workers.
+
+The :py:class:`WarmPoolRunner` keeps the worker processes which have
+the service script or module and its dependencies already imported,
+so the jobs do not pay for the interpreter start-up and the imports.
+Each job is run inside an idle worker by calling the entry function
+of the script, or executing the script as ``__main__`` if it has
+none, with the working directory, the command line arguments and
+the standard output and error streams switched to those of the job.
+
+The workers are replaced after running a number of jobs, after
+their memory usage grows over the limit or when a job raises
+an unexpected exception, so the state leaked by the jobs does not
+accumulate.
+"""
+import atexit
+import builtins
+import collections
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import runpy
+import signal
+import sys
+import threading
+import time
+import traceback
+import uuid
+import weakref
+from multiprocessing import connection
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from slivka import JobStatus
+from slivka.utils import LimitedSizeDict
+from ._sentinel import read_return_code
+from .runner import Runner, Command, Job, ResourceUsage
+from .shell import _parse_memory, _return_code_status, _write_return_code
+
+log = logging.getLogger('slivka.scheduler')
+
+_ARGS_FILE = 'args.json'
+_STARTED_FILE = 'started'
+
+
+class _Target(NamedTuple):
+    """ Python code run by the workers. """
+    script: Optional[str] = None
+    module: Optional[str] = None
+    entry: Optional[str] = None
+
+    @property
+    def argv0(self):
+        return self.script or self.module
+
+
+def _parse_command(command: List[str], entry=None):
+    """ Finds the script or the module run by the python command.
+
+    If the command starts with the python interpreter, its options
+    are skipped and the script path or the ``-m module`` option
+    follows them, otherwise the command itself is the script.
+
+    :return: the target and the number of the consumed arguments
+    """
+    index = 0
+    if command and os.path.basename(command[0]).startswith('python'):
+        index = 1
+        while (index < len(command) and command[index] != '-m' and
+               command[index].startswith('-')):
+            index += 1
+    if index < len(command) and command[index] == '-m':
+        if index + 1 < len(command):
+            return _Target(module=command[index + 1], entry=entry), index + 2
+    elif index < len(command):
+        return _Target(script=command[index], entry=entry), index + 1
+    raise ValueError(
+        "The command %r does not run a python script or module."
+        % ' '.join(command)
+    )
+
+
+def _load_target(target: _Target):
+    """ Returns the function running the job in the worker. """
+    if target.module is not None:
+        if target.entry is not None:
+            return getattr(importlib.import_module(target.module), target.entry)
+        return lambda: runpy.run_module(
+            target.module, run_name='__main__', alter_sys=True)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(target.script)))
+    if target.entry is not None:
+        # the script is imported once without running its main block
+        namespace = runpy.run_path(target.script, run_name='__slivka_worker__')
+        return namespace[target.entry]
+    with open(target.script, 'rb') as fp:
+        code = compile(fp.read(), target.script, 'exec')
+
+    def run():
+        exec(code, {'__name__': '__main__', '__file__': target.script,
+                    '__builtins__': builtins})
+    return run
+
+
+def _exit_code(code) -> int:
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _run_job(run, target: _Target, cwd, args):
+    """ Runs the job in the worker process.
+
+    :return: return code, wall time, cpu time, max rss and whether
+        the worker should be replaced
+    """
+    started = time.monotonic()
+    before = _cpu_time()
+    saved_argv, saved_cwd = sys.argv, os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = os.dup(1), os.dup(2)
+    recycle = False
+    try:
+        os.chdir(cwd)
+        open(_STARTED_FILE, 'w').close()
+        with open('stdout', 'wb') as stdout, open('stderr', 'wb') as stderr:
+            os.dup2(stdout.fileno(), 1)
+            os.dup2(stderr.fileno(), 2)
+        sys.argv = [target.argv0, *args]
+        try:
+            result = run()
+            return_code = (
+                result if isinstance(result, int) and
+                not isinstance(result, bool) else 0
+            )
+        except SystemExit as e:
+            return_code = _exit_code(e.code)
+        except BaseException:
+            traceback.print_exc()
+            return_code = 1
+            recycle = True
+    except OSError:
+        traceback.print_exc(file=sys.__stderr__)
+        return_code = 127
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        os.close(saved_fds[0])
+        os.close(saved_fds[1])
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+    return (return_code, time.monotonic() - started, _cpu_time() - before,
+            _max_rss(), recycle)
+
+
+def _cpu_time():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _max_rss():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def _worker_main(conn, target: _Target, env, preload):
+    """ Main function of the worker process. """
+    # the workers are stopped by the scheduler
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ.clear()
+    os.environ.update((key, val) for key, val in env.items() if val is not None)
+    sys.stdin = open(os.devnull)
+    try:
+        for name in preload:
+            importlib.import_module(name)
+        run = _load_target(target)
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+        return
+    conn.send(('ready',))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        cwd, args = request
+        conn.send(('done', *_run_job(run, target, cwd, args)))
+
+
+class _PoolJob:
+    __slots__ = ('cwd', 'args', 'return_code', 'queued_at', 'started_at',
+                 'usage', 'worker')
+
+    def __init__(self, cwd, args):
+        self.cwd = cwd
+        self.args = args
+        self.return_code: Optional[int] = None
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.usage: Optional[ResourceUsage] = None
+        self.worker: Optional[_Worker] = None
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'ready', 'job', 'jobs_done')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.job: Optional[_PoolJob] = None
+        self.jobs_done = 0
+
+
+def _mp_context():
+    # workers must not be forked from the threaded scheduler
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class WarmPoolRunner(Runner):
+    """ Implementation of the :py:class:`Runner` using warm python workers.
+
+    Runs the python script or module given in the command in a pool
+    of ``workers`` processes, which import the script, along with
+    the ``preload`` modules, once when started. If ``entry`` is given,
+    the function of that name is called for every job, otherwise
+    the whole script is executed as ``__main__``. The command line
+    arguments of the job are available in :py:data:`sys.argv`.
+    The return value of the entry function or the code passed to
+    :py:func:`sys.exit` becomes the return code of the job.
+
+    The workers are replaced after ``max_jobs_per_worker`` jobs,
+    when their peak memory usage exceeds ``max_worker_memory``,
+    or when a job raises an exception other than :py:exc:`SystemExit`.
+    The jobs are queued until a worker is free and the queued jobs
+    are restored if the scheduler restarts. Cancelled running jobs
+    are stopped together with their worker.
+
+    The queue time, wall time and CPU time of the jobs are measured
+    by the workers, the maximum resident set size is the peak size
+    of the worker which ran the job.
+    """
+    #: number of the finished jobs whose usage is kept
+    #: until retrieved by :py:meth:`get_usage`
+    max_usage_records = 10000
+
+    def __init__(self, *args, workers=None, entry=None, preload=(),
+                 max_jobs_per_worker=100, max_worker_memory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._target, self._prefix_length = _parse_command(self.command, entry)
+        self.workers = int(workers) if workers else (os.cpu_count() or 1)
+        if isinstance(preload, str):
+            preload = preload.split()
+        self.preload = list(preload)
+        self.max_jobs_per_worker = int(max_jobs_per_worker)
+        #: memory limit of the workers in megabytes
+        self.max_worker_memory = _parse_memory(max_worker_memory)
+        self._jobs: Dict[str, _PoolJob] = {}
+        self._queue = collections.deque()
+        self._pool: List[_Worker] = []
+        self._retired = []
+        self._usage = LimitedSizeDict(self.max_usage_records)
+        self._lock = threading.RLock()
+        self._context = _mp_context()
+        self._startup_failed = False
+        self._thread = None
+        self._wakeup_r = self._wakeup_w = None
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        self._thread = threading.Thread(
+            target=self._run, name='warm-pool-%s' % self.name, daemon=True
+        )
+        self._thread.start()
+        _live_runners.add(self)
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def submit(self, command: Command) -> Job:
+        """ Queues the job to be run by the next free worker. """
+        job_id = uuid.uuid4().hex
+        args = list(command.args[self._prefix_length:])
+        with open(os.path.join(command.cwd, _ARGS_FILE), 'w') as fp:
+            json.dump(args, fp)
+        with self._lock:
+            self._ensure_started()
+            self._jobs[job_id] = pool_job = _PoolJob(command.cwd, args)
+            self._queue.append(pool_job)
+        self._wakeup()
+        return Job(job_id, command.cwd)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                self._dispatch()
+                waitables = {self._wakeup_r: None}
+                for worker in self._pool:
+                    waitables[worker.conn] = worker
+                    waitables[worker.process.sentinel] = worker
+            try:
+                ready = connection.wait(list(waitables))
+            except OSError:
+                # connections closed by close()
+                continue
+            with self._lock:
+                if self._closed:
+                    return
+                for obj in ready:
+                    worker = waitables[obj]
+                    if worker is None:
+                        os.read(self._wakeup_r, 512)
+                    elif worker in self._pool:
+                        if obj is worker.conn:
+                            self._receive(worker)
+                        else:
+                            self._retire(worker)
+                self._join_retired()
+
+    def _dispatch(self):
+        while len(self._pool) < self.workers and \
+                (self._queue or not self._startup_failed):
+            self._spawn()
+        for worker in self._pool:
+            if not self._queue:
+                break
+            if worker.ready and worker.job is None:
+                pool_job = self._queue.popleft()
+                try:
+                    worker.conn.send((pool_job.cwd, pool_job.args))
+                except OSError:
+                    self._queue.appendleft(pool_job)
+                    self._retire(worker)
+                    continue
+                pool_job.started_at = time.monotonic()
+                pool_job.worker = worker
+                worker.job = pool_job
+
+    def _spawn(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self._target, self.env, self.preload),
+            name='%s-worker' % self.name
+        )
+        process.start()
+        child_conn.close()
+        self._pool.append(_Worker(process, conn))
+
+    def _receive(self, worker: _Worker):
+        try:
+            message = worker.conn.recv()
+        except (EOFError, OSError):
+            self._retire(worker)
+            return
+        if message[0] == 'ready':
+            worker.ready = True
+            self._startup_failed = False
+        elif message[0] == 'error':
+            log.error("Worker of %s failed to start.\n%s", self, message[1])
+            self._startup_failed = True
+            # the job which was to be run fails in place of the worker
+            if self._queue:
+                pool_job = self._queue.popleft()
+                _write_stderr(pool_job.cwd, message[1])
+                self._finish(pool_job, 127)
+            self._retire(worker)
+        elif message[0] == 'done':
+            _, return_code, wall_time, cpu_time, max_rss, recycle = message
+            pool_job, worker.job = worker.job, None
+            worker.jobs_done += 1
+            pool_job.worker = None
+            self._finish(pool_job, return_code, ResourceUsage(
+                queue_time=pool_job.started_at - pool_job.queued_at,
+                wall_time=wall_time,
+                cpu_time=cpu_time,
+                max_rss=max_rss
+            ))
+            if (recycle or worker.jobs_done >= self.max_jobs_per_worker or
+                    self.max_worker_memory is not None and
+                    max_rss / 1024 > self.max_worker_memory):
+                self._retire(worker)
+
+    def _retire(self, worker: _Worker):
+        """ Removes the worker from the pool, failing its job if any. """
+        self._pool.remove(worker)
+        if worker.job is None:
+            # idle workers exit on their own
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        else:
+            worker.process.join(1)
+            if worker.process.exitcode is None:
+                worker.process.kill()
+                worker.process.join()
+            pool_job, worker.job = worker.job, None
+            pool_job.worker = None
+            if pool_job.started_at is not None:
+                usage = ResourceUsage(
+                    queue_time=pool_job.started_at - pool_job.queued_at,
+                    wall_time=time.monotonic() - pool_job.started_at
+                )
+            else:
+                usage = None
+            self._finish(pool_job, worker.process.exitcode or -signal.SIGKILL,
+                         usage)
+        worker.conn.close()
+        self._retired.append(worker.process)
+
+    def _join_retired(self):
+        for process in self._retired:
+            process.join(0)
+        self._retired = [p for p in self._retired if p.exitcode is None]
+
+    def _finish(self, pool_job: _PoolJob, return_code, usage=None):
+        _write_return_code(pool_job.cwd, return_code)
+        pool_job.usage = usage
+        pool_job.return_code = return_code
+
+    def _recover(self, job: Job) -> Optional[_PoolJob]:
+        """ Queues again the job of the previous scheduler process.
+
+        Only the jobs which have not started are restored.
+        """
+        if os.path.exists(os.path.join(job.cwd, _STARTED_FILE)):
+            return None
+        try:
+            with open(os.path.join(job.cwd, _ARGS_FILE)) as fp:
+                args = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        self._ensure_started()
+        pool_job = self._jobs[job.id] = _PoolJob(job.cwd, args)
+        self._queue.append(pool_job)
+        self._wakeup()
+        log.info("Queued job %s again.", job.id)
+        return pool_job
+
+    def check_status(self, job: Job) -> JobStatus:
+        return self.batch_check_status([job])[0]
+
+    def batch_check_status(self, jobs: Sequence[Job]) -> Sequence[JobStatus]:
+        with self._lock:
+            return [self._status(job) for job in jobs]
+
+    def _status(self, job: Job) -> JobStatus:
+        pool_job = self._jobs.get(job.id)
+        if pool_job is None:
+            return_code = read_return_code(job.cwd)
+            if return_code is not None:
+                return _return_code_status(return_code)
+            pool_job = self._recover(job)
+            if pool_job is None:
+                return JobStatus.INTERRUPTED
+        if pool_job.return_code is None:
+            return (JobStatus.QUEUED if pool_job.started_at is None
+                    else JobStatus.RUNNING)
+        del self._jobs[job.id]
+        if pool_job.usage is not None:
+            self._usage[job.id] = pool_job.usage
+        return _return_code_status(pool_job.return_code)
+
+    def get_usage(self, job: Job) -> Optional[ResourceUsage]:
+        with self._lock:
+            return self._usage.pop(job.id, None)
+
+    def cancel(self, job: Job):
+        with self._lock:
+            pool_job = self._jobs.get(job.id)
+            if pool_job is None:
+                if read_return_code(job.cwd) is not None:
+                    return
+                pool_job = self._recover(job)
+            if pool_job is None or pool_job.return_code is not None:
+                return
+            if pool_job.worker is None:
+                self._queue.remove(pool_job)
+                self._finish(pool_job, -signal.SIGTERM)
+            else:
+                # the worker is replaced once it exits
+                pool_job.worker.process.terminate()
+
+    def close(self):
+        """ Stops the workers, interrupting the running jobs. """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers, self._pool = self._pool, []
+        if self._thread is None:
+            return
+        self._wakeup()
+        for worker in workers:
+            worker.process.terminate()
+        for worker in workers:
+            worker.process.join(5)
+            worker.conn.close()
+        self._thread.join(5)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+
+def _write_stderr(cwd, text):
+    try:
+        with open(os.path.join(cwd, 'stderr'), 'w') as fp:
+            fp.write(text)
+    except OSError:
+        log.exception("Writing the error to %s failed.", cwd)
+
+
+_live_runners = weakref.WeakSet()
+
+
+@atexit.register
+def _close_runners():
+    # must run before the multiprocessing exit handler joining the workers
+    for runner in list(_live_runners):
+        runner.close()
@@ -1,13 +1,12 @@
-import contextlib
 import inspect
 import logging
 import os
 import threading
 from collections import defaultdict, namedtuple, OrderedDict
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
 from typing import (Iterable, Dict, List, Any, Union, DefaultDict,
-                    Sequence, Callable, Tuple)
+                    Sequence, Callable, Tuple, Optional)
 
 import attrs
 import pymongo.errors
@@ -18,6 +17,7 @@ from slivka.db.documents import JobRequest, CancelRequest
 from slivka.db.helpers import delete_many, push_many
 from slivka.utils import JobStatus, BackoffCounter
 from slivka.utils import retry_call
+from .estimator import RuntimeEstimator
 from .runners import Job as JobTuple
 from .runners.runner import RunnerID, Runner
 from ..utils.path import request_id_to_job_path
@@ -58,6 +58,7 @@ class Scheduler:
         self._backoff_counters: DefaultDict[Any, BackoffCounter] = \
             defaultdict(partial(BackoffCounter, max_tries=10))
         self._auto_reconnect_handler = partial(_auto_reconnect_handler, self.log)
+        self.estimator = RuntimeEstimator()
 
     @property
     def is_running(self):
@@ -96,6 +97,10 @@ class Scheduler:
         if self._finished.is_set():
             raise RuntimeError("scheduler can only be started once")
         self.log.info('scheduler started')
+        try:
+            self.estimator.load_history(slivka.db.database)
+        except pymongo.errors.PyMongoError:
+            self.log.exception("Loading the job history failed.")
         try:
             while not self._finished.wait(1):
                 self.main_loop()
@@ -163,6 +168,12 @@ class Scheduler:
                     runner_options={
                         r.name: r.selector_options
                         for r in runners
+                    },
+                    runtime=self.estimator.estimate_runtime(
+                        request.service, request.inputs),
+                    queue_wait={
+                        r.name: self.estimator.estimate_wait(r.id)
+                        for r in runners
                     }
                 )
             runner_name = selector(request.inputs, **kwargs)
@@ -194,29 +205,66 @@ class Scheduler:
             retry_call(
                 fn, pymongo.errors.AutoReconnect, handler=auto_reconnect_handler
             )
-            fn = partial(_bulk_set_status_filter_by_status, database, job_ids,
-                         (JobStatus.QUEUED, JobStatus.RUNNING), JobStatus.CANCELLING)
-            retry_call(
-                fn, pymongo.errors.AutoReconnect, handler=auto_reconnect_handler
-            )
-            cursor = JobRequest.find(database, status=JobStatus.CANCELLING)
+            # requests already CANCELLING had their cancellation sent
+            # earlier and are only waiting for the runner to stop them
             cancelling = retry_call(
-                partial(list, cursor), pymongo.errors.AutoReconnect,
-                handler=auto_reconnect_handler
-            )
-            for request in cancelling:
-                assert request.runner is not None
-                # fixme: do not blindly trust data from the database
-                #        the runner may not exist
-                runner = self.runners[request.service, request.runner]
-                job = request.job
-                assert job is not None
-                with contextlib.suppress(OSError):
-                    runner.cancel(JobTuple(job.job_id, job.work_dir))
-            retry_call(
-                partial(delete_many, database, cancel_requests),
+                partial(_fetch_requests_by_id, database, job_ids,
+                        (JobStatus.QUEUED, JobStatus.RUNNING)),
                 pymongo.errors.AutoReconnect, handler=auto_reconnect_handler
             )
+            failed = set()
+            if cancelling:
+                failed = {
+                    request.id for request in self.cancel_jobs(cancelling)
+                }
+                sent = [request.id for request in cancelling
+                        if request.id not in failed]
+                if sent:
+                    fn = partial(_bulk_set_status_filter_by_status, database,
+                                 sent, (JobStatus.QUEUED, JobStatus.RUNNING),
+                                 JobStatus.CANCELLING)
+                    retry_call(
+                        fn, pymongo.errors.AutoReconnect,
+                        handler=auto_reconnect_handler
+                    )
+            # cancel requests of the failed jobs are kept and retried
+            handled = [cr for cr in cancel_requests if cr.job_id not in failed]
+            if handled:
+                retry_call(
+                    partial(delete_many, database, handled),
+                    pymongo.errors.AutoReconnect,
+                    handler=auto_reconnect_handler
+                )
+
+    def cancel_jobs(self, requests: Iterable[JobRequest]) -> List[JobRequest]:
+        """ Requests cancellation of the jobs from their runners.
+
+        The jobs are grouped by the runner and each group is cancelled
+        with a single :py:meth:`Runner.batch_cancel` call. Failures are
+        logged and the requests whose cancellation failed are returned,
+        so it can be attempted again.
+        """
+        grouped = defaultdict(list)
+        for request in requests:
+            assert request.job is not None
+            grouped[RunnerID(request.service, request.runner)].append(request)
+        failed = []
+        for runner_id, group in grouped.items():
+            try:
+                runner = self.runners[runner_id]
+            except KeyError:
+                self.log.error("Runner (%s, %s) does not exist",
+                               runner_id.service, runner_id.runner)
+                continue
+            jobs = [JobTuple(r.job.job_id, r.job.work_dir) for r in group]
+            try:
+                runner.batch_cancel(jobs)
+            except Exception:
+                self.log.exception("Cancelling jobs of %s failed.", runner)
+                failed.extend(group)
+            else:
+                self.log.info("Cancelling %d jobs of %s.", len(jobs), runner)
+        return failed
 
     def _run_accepted(self, database):
         auto_reconnect_handler = self._auto_reconnect_handler
@@ -232,6 +280,10 @@ class Scheduler:
                 except KeyError:
                     self.log.exception("Runner does not exist.")
                     raise ExecutionFailed(None)
+                oldest = min(request.timestamp for request in requests)
+                wait_time = (datetime.now() - oldest).total_seconds()
+                if not runner.is_batch_ready(len(requests), wait_time):
+                    continue
                 self.log.debug("Starting jobs with %s.", runner)
                 started = self._start_requests(runner, requests)
                 queued = []
@@ -242,6 +294,9 @@ class Scheduler:
                         work_dir=job.cwd
                     )
                     request.status = JobStatus.QUEUED
+                    request.estimated_completion_time = \
+                        self.estimator.estimate_completion(
+                            request.service, request.inputs, runner.id)
                 if queued:
                     retry_call(
                         partial(push_many, database, queued),
@@ -289,7 +344,8 @@ class Scheduler:
         auto_reconnect_handler = self._auto_reconnect_handler
         items = retry_call(
             partial(_fetch_requests_for_status, database,
-                    filter={'$in': (JobStatus.QUEUED, JobStatus.RUNNING)}),
+                    filter={'$in': (JobStatus.QUEUED, JobStatus.RUNNING,
+                                    JobStatus.CANCELLING)}),
             pymongo.errors.AutoReconnect, handler=auto_reconnect_handler
         )
         for item in items:
@@ -305,12 +361,25 @@ class Scheduler:
                     req.status = JobStatus.ERROR
                 updated = requests
             else:
-                updated = self.monitor_jobs(runner, requests)
+                updated = list(self.monitor_jobs(runner, requests))
+                seen = {id(request) for request in updated}
+                updated.extend(
+                    request for request in self.enforce_walltime(runner, requests)
+                    if id(request) not in seen
+                )
+                self.estimator.set_queued(_id, sum(
+                    r.status == JobStatus.QUEUED for r in requests))
             if not updated:
                 continue
+            finished = []
             for request in updated:
                 if request.status.is_finished():
                     request.completion_time = ts
+                    finished.append(request)
+            if finished and _id in self.runners:
+                self.collect_usage(self.runners[_id], finished)
+                for request in finished:
+                    self.estimator.observe(request, _id)
             retry_call(
                 partial(push_many, database, updated),
                 pymongo.errors.AutoReconnect, handler=auto_reconnect_handler
@@ -330,9 +399,16 @@ class Scheduler:
         try:
             statuses = runner.batch_check_status(
                 [JobTuple(r.job.job_id, r.job.cwd) for r in requests])
+            now = datetime.now()
             for request, status in zip(requests, statuses):
+                if (request.status == JobStatus.CANCELLING and
+                        status in (JobStatus.QUEUED, JobStatus.RUNNING)):
+                    # cancellation sent, waiting for the job to stop
+                    continue
                 if request.status != status:
                     request.status = status
+                    if status == JobStatus.RUNNING and request.start_time is None:
+                        request.start_time = now
                     updated.append(request)
             if updated and all(r.status == JobStatus.ERROR for r in updated):
                 self.log.exception(
@@ -345,8 +421,69 @@ class Scheduler:
                 for request in requests:
                     request.status = JobStatus.ERROR
                 updated.extend(requests)
+                self._release_jobs(runner, requests)
         return updated
 
+    def enforce_walltime(self, runner: Runner, requests: List[JobRequest]) \
+            -> List[JobRequest]:
+        """ Cancels the jobs running longer than the runner walltime.
+
+        The run time is counted from the moment the job was first
+        seen running. The cancelled requests are marked as INTERRUPTED
+        with the reason and returned. If the cancellation fails,
+        the jobs are left running and cancelled on the next attempt.
+        """
+        if runner.walltime is None:
+            return []
+        deadline = datetime.now() - timedelta(seconds=runner.walltime)
+        expired = [
+            request for request in requests
+            if request.status == JobStatus.RUNNING and
+            request.start_time is not None and
+            request.start_time < deadline
+        ]
+        if not expired:
+            return []
+        try:
+            runner.batch_cancel(
+                [JobTuple(r.job.job_id, r.job.cwd) for r in expired])
+        except Exception:
+            self.log.exception("Cancelling jobs of %s exceeding the "
+                               "walltime failed.", runner)
+            return []
+        self.log.info("Interrupted %d jobs of %s exceeding the walltime.",
+                      len(expired), runner)
+        reason = "Exceeded the walltime of %g seconds." % runner.walltime
+        for request in expired:
+            request.status = JobStatus.INTERRUPTED
+            request.status_reason = reason
+        self._release_jobs(runner, expired)
+        return expired
+
+    def _release_jobs(self, runner: Runner, requests: List[JobRequest]):
+        """ Lets the runner stop tracking the jobs no longer monitored. """
+        try:
+            runner.release_jobs(
+                [JobTuple(r.job.job_id, r.job.cwd) for r in requests])
+        except Exception:
+            self.log.exception("Releasing jobs of %s failed.", runner)
+
+    def collect_usage(self, runner: Runner, requests: List[JobRequest]):
+        """ Stores the resources used by the finished jobs.
+
+        Failures are logged and leave the usage of the requests unset
+        as the accounting is not essential to the job completion.
+        """
+        try:
+            usages = runner.batch_get_usage(
+                [JobTuple(r.job.job_id, r.job.cwd) for r in requests])
+        except Exception:
+            self.log.exception("Fetching resource usage for %s failed.", runner)
+            return
+        for request, usage in zip(requests, usages):
+            if usage is not None:
+                request.usage = usage._asdict()
+
 
 def _auto_reconnect_handler(log, exception):
     assert isinstance(exception, pymongo.errors.AutoReconnect)
@@ -381,6 +518,13 @@ def _fetch_cancel_requests(database) -> List[CancelRequest]:
     return list(CancelRequest.find(database))
 
 
+def _fetch_requests_by_id(database, job_ids, statuses) -> List[JobRequest]:
+    requests = JobRequest.collection(database).find(
+        {'_id': {'$in': job_ids}, 'status': {'$in': statuses}}
+    )
+    return [JobRequest(**kwargs) for kwargs in requests]
+
+
 def _bulk_set_status_filter_by_status(database, job_ids, from_statuses, to_status):
     JobRequest.collection(database).update_many(
         {'_id': {'$in': job_ids},
@@ -429,6 +573,10 @@ class SelectorContext:
     service: str
     runners: List[str]
     runner_options: Dict[str, Dict[str, Any]]
+    #: predicted run time of the job in seconds, None if unknown
+    runtime: Optional[float] = None
+    #: expected queue wait in seconds of each runner, None if unknown
+    queue_wait: Dict[str, Optional[float]] = attrs.Factory(dict)
 
 
 class SelectorMeta(type):
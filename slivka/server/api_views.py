@@ -198,8 +198,27 @@ def _job_resource(job_request: JobRequest):
                 job_request.completion_time and
                 job_request.completion_time.strftime(_DATETIME_STRF) or None
         ),
+        'estimatedCompletionTime': (
+                not job_request.status.is_finished() and
+                job_request.get('estimated_completion_time') and
+                job_request['estimated_completion_time']
+                .strftime(_DATETIME_STRF) or None
+        ),
         'finished': job_request.status.is_finished(),
-        'status': job_request.status.name
+        'status': job_request.status.name,
+        'statusReason': job_request.get('status_reason'),
+        'usage': _usage_resource(job_request.get('usage'))
+    }
+
+
+def _usage_resource(usage):
+    if usage is None:
+        return None
+    return {
+        'queueTime': usage.get('queue_time'),
+        'wallTime': usage.get('wall_time'),
+        'cpuTime': usage.get('cpu_time'),
+        'maxRss': usage.get('max_rss')
     }
 
 
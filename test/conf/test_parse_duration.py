@@ -0,0 +1,28 @@
+import pytest
+
+from slivka.conf.loaders import parse_duration
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        (90, 90),
+        ("90", 90),
+        ("45s", 45),
+        ("30m", 1800),
+        ("1.5h", 5400),
+        ("2d", 172800),
+        ("10:00", 600),
+        ("1:00:00", 3600),
+        ("2-01:00:00", 176400),
+    ],
+)
+def test_parse_duration(value, expected):
+    assert parse_duration(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "abc", "1:2:3:4", "x-1:00", "10x"])
+def test_parse_invalid_duration(value):
+    with pytest.raises(ValueError):
+        parse_duration(value)
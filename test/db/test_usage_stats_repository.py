@@ -231,3 +231,19 @@ def test_usage_stats_list_all_filter_service_and_date(
     )
     expected_output = [UsageStats(date(2020, 11, 1), "example-1", 8)]
     assert_that(output, contains_inanyorder(*expected_output))
+
+
+@pytest.mark.parametrize(
+    "job_requests", ["testdata/requests_set_1.yaml"], indirect=True
+)
+def test_usage_stats_include_archived_requests(
+    mongo_client, database, usage_stats_repository, job_requests
+):
+    if isinstance(mongo_client, mongomock.MongoClient):
+        pytest.skip("Unable to test with mongomock database")
+    archived = JobRequest.collection(database).find_one_and_delete({})
+    JobRequest.archive_collection(database).insert_one(archived)
+    assert_that(
+        usage_stats_repository.list_all(),
+        contains_inanyorder(UsageStats(date(2020, 3, 1), "example-0", 3))
+    )
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from slivka.local_queue import LocalQueue, LocalQueueClient
+
+
+@pytest.fixture()
+def socket_path(tmp_path):
+    return tmp_path / "local-queue.sock"
+
+
+@pytest.fixture()
+def queue_address(socket_path):
+    return "ipc://%s" % socket_path
+
+
+@pytest.fixture()
+def start_queue(queue_address, socket_path):
+    """Factory running the queue in a background thread until stopped."""
+    running = []
+
+    def start(**kwargs):
+        kwargs.setdefault("workers", 2)
+        queue = LocalQueue(queue_address, **kwargs)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=queue.run, args=(loop,), daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        running.append((queue, loop, thread))
+        return queue
+
+    def stop(queue):
+        for item in running:
+            if item[0] is queue:
+                running.remove(item)
+                _, loop, thread = item
+                loop.call_soon_threadsafe(queue.stop)
+                thread.join(5)
+                queue.close(loop)
+                loop.close()
+                if socket_path.exists():
+                    socket_path.unlink()
+                return
+
+    start.stop = stop
+    yield start
+    for queue, _, _ in list(running):
+        stop(queue)
+
+
+@pytest.fixture()
+def local_queue(start_queue):
+    return start_queue()
+
+
+@pytest.fixture()
+def client(local_queue, queue_address):
+    return LocalQueueClient(queue_address)
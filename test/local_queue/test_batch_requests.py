@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.local_queue import RequestError
+from slivka.scheduler.runners import Command, RunnerID, SlivkaQueueRunner
+
+
+def wait_for_states(client, ids, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        states = [r.state for r in client.get_job_statuses(ids)]
+        if all(JobStatus(state).is_finished() for state in states):
+            return states
+        if time.monotonic() > deadline:
+            return states
+        time.sleep(0.02)
+
+
+def test_batch_submit(client, tmp_path):
+    jobs = [("true", str(tmp_path), {}), ("false", str(tmp_path), {})]
+    responses = client.submit_jobs(jobs)
+    assert len(responses) == 2
+    assert len({r.id for r in responses}) == 2
+    assert all(r.state == JobStatus.QUEUED for r in responses)
+
+
+def test_batch_status(client, tmp_path):
+    responses = client.submit_jobs(
+        [("true", str(tmp_path), {}), ("exit 1", str(tmp_path), {})]
+    )
+    states = wait_for_states(client, [r.id for r in responses])
+    assert states == [JobStatus.COMPLETED, JobStatus.FAILED]
+
+
+def test_batch_status_of_unknown_job(client):
+    (response,) = client.get_job_statuses([12345])
+    assert response.state == JobStatus.UNKNOWN
+
+
+def test_batch_cancel(client, tmp_path):
+    responses = client.submit_jobs(
+        [("sleep 10", str(tmp_path), {}) for _ in range(3)]
+    )
+    ids = [r.id for r in responses]
+    client.cancel_jobs(ids)
+    assert wait_for_states(client, ids) == [JobStatus.INTERRUPTED] * 3
+
+
+def test_empty_batch(client):
+    assert client.get_job_statuses([]) == []
+
+
+def test_invalid_message_in_batch(client):
+    with pytest.raises(RequestError):
+        client._batch_request([{"method": "GET", "id": 1}, {"method": "PUT"}])
+
+
+def test_runner_batch_methods(local_queue, queue_address, tmp_path):
+    runner = SlivkaQueueRunner(
+        RunnerID("example", "queue"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        address=queue_address,
+    )
+    runner.batch_size = 2
+    commands = [Command(["sh", "-c", "exit %d" % i], str(tmp_path))
+                for i in range(3)]
+    jobs = runner.batch_submit(commands)
+    assert [job.cwd for job in jobs] == [str(tmp_path)] * 3
+    wait_for_states(runner.client, [job.id for job in jobs])
+    assert runner.batch_check_status(jobs) == [
+        JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.FAILED
+    ]
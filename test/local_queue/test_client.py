@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import zmq
+
+from slivka import JobStatus
+from slivka.local_queue import AsyncLocalQueueClient, LocalQueueClient
+
+
+@pytest.fixture()
+def fake_server(queue_address):
+    """ROUTER socket standing in for the queue, answering on demand."""
+    socket = zmq.Context.instance().socket(zmq.ROUTER)
+    socket.bind(queue_address)
+    yield socket
+    socket.close(linger=0)
+
+
+def recv_request(socket, timeout=1000):
+    assert socket.poll(timeout)
+    *envelope, payload = socket.recv_multipart()
+    return envelope, json.loads(payload)
+
+
+def reply(socket, envelope, response):
+    socket.send_multipart(envelope + [json.dumps(response).encode()])
+
+
+def test_requests_pipelined(local_queue, client, tmp_path):
+    responses = client.request_many(
+        [{"method": "POST", "cmd": "true", "cwd": str(tmp_path), "env": {}}
+         for _ in range(5)] + [{"method": "INFO"}]
+    )
+    assert [r["ok"] for r in responses] == [True] * 6
+    assert len({r["id"] for r in responses[:5]}) == 5
+    assert "epoch" in responses[5]
+
+
+def test_batches_split_and_joined(local_queue, client, tmp_path):
+    responses = client.submit_jobs(
+        [("true", str(tmp_path), {}) for _ in range(5)], batch_size=2
+    )
+    ids = [r.id for r in responses]
+    assert len(set(ids)) == 5
+    statuses = client.get_job_statuses(ids, batch_size=2)
+    assert [s.id for s in statuses] == ids
+
+
+def test_timeout_raises_connection_error(fake_server, queue_address):
+    client = LocalQueueClient(queue_address, timeout=0.05)
+    with pytest.raises(ConnectionError):
+        client.get_job_status(1)
+
+
+def test_late_reply_discarded(fake_server, queue_address):
+    client = LocalQueueClient(queue_address, timeout=0.05)
+    with pytest.raises(ConnectionError):
+        client.get_job_status(1)
+    late_envelope, _ = recv_request(fake_server)
+    reply(fake_server, late_envelope,
+          {"ok": True, "id": 1, "state": 3, "returncode": 0})
+
+    def answer():
+        envelope, message = recv_request(fake_server)
+        reply(fake_server, envelope,
+              {"ok": True, "id": message["id"], "state": 1, "returncode": None})
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    client.timeout = 1
+    # the reply to the timed out request is not mistaken for this one
+    assert client.get_job_status(2).id == 2
+    thread.join()
+
+
+def test_request_sent_after_server_starts(start_queue, queue_address):
+    client = LocalQueueClient(queue_address, timeout=1)
+    start_queue()
+    assert "epoch" in client.get_info()
+
+
+def test_req_clients_supported(local_queue, queue_address):
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    socket.connect(queue_address)
+    try:
+        socket.send_json({"method": "GET", "id": 1})
+        assert socket.poll(1000)
+        assert socket.recv_json()["state"] == JobStatus.UNKNOWN
+    finally:
+        socket.close(linger=0)
+
+
+def test_malformed_message_answered(local_queue, queue_address):
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    socket.connect(queue_address)
+    try:
+        socket.send(b"not json")
+        assert socket.poll(1000)
+        assert socket.recv_json() == {"ok": False, "error": "invalid-message"}
+    finally:
+        socket.close(linger=0)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_async_client(local_queue, queue_address, tmp_path):
+    async def main():
+        client = AsyncLocalQueueClient(queue_address, timeout=1)
+        try:
+            submitted = await asyncio.gather(*(
+                client.submit_job("true", str(tmp_path), {}) for _ in range(3)
+            ))
+            ids = [job.id for job in submitted]
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                states = await client.get_job_statuses(ids)
+                if all(JobStatus(s.state).is_finished() for s in states):
+                    break
+                await asyncio.sleep(0.02)
+            return ids, states
+        finally:
+            client.close()
+
+    ids, states = run(main())
+    assert len(set(ids)) == 3
+    assert [s.state for s in states] == [JobStatus.COMPLETED] * 3
+
+
+def test_async_client_timeout(fake_server, queue_address):
+    async def main():
+        client = AsyncLocalQueueClient(queue_address, timeout=0.05)
+        try:
+            await client.get_job_status(1)
+        finally:
+            client.close()
+
+    with pytest.raises(ConnectionError):
+        run(main())
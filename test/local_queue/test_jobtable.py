@@ -0,0 +1,130 @@
+import time
+
+from slivka import JobStatus
+from slivka.local_queue.jobtable import JobRecord, JobTable
+from slivka.local_queue.server import Job
+
+
+def finished_job(state=JobStatus.COMPLETED, return_code=0):
+    job = Job("true", "/tmp", {}, state=state)
+    job.return_code = return_code
+    return job
+
+
+def test_jobs_share_equal_environments():
+    first = Job("true", "/tmp", {"PATH": "/bin", "HOME": "/root"})
+    second = Job("false", "/tmp", {"HOME": "/root", "PATH": "/bin"})
+    assert first.env is second.env
+
+
+def test_environment_of_submitter_not_modified():
+    env = {"HOME": "/root"}
+    job = Job("true", "/tmp", env)
+    assert env == {"HOME": "/root"}
+    assert "PATH" in job.env
+
+
+def test_active_job_returned():
+    table = JobTable()
+    job = Job("true", "/tmp", {})
+    table.add(job)
+    assert table[job.id] is job
+    assert table.get_active(job.id) is job
+
+
+def test_finished_job_reduced_to_record():
+    table = JobTable()
+    job = Job("false", "/tmp", {})
+    table.add(job)
+    job.state, job.return_code = JobStatus.FAILED, 1
+    table.finish(job)
+    assert table.get_active(job.id) is None
+    assert table[job.id] == JobRecord(job.id, JobStatus.FAILED, 1)
+    assert len(table) == 1
+
+
+def test_finished_job_usage_kept():
+    table = JobTable()
+    job = Job("true", "/tmp", {})
+    table.add(job)
+    job.state, job.return_code = JobStatus.COMPLETED, 0
+    job.usage = {"queue_time": 0.5, "wall_time": 2.0, "max_rss": 1024}
+    table.finish(job)
+    assert table[job.id].usage == {
+        "queue_time": 0.5, "wall_time": 2.0, "cpu_time": None, "max_rss": 1024
+    }
+
+
+def test_unknown_job():
+    table = JobTable()
+    assert table.get(1) is None
+    assert 1 not in table
+
+
+def test_oldest_finished_evicted_over_limit():
+    table = JobTable(max_finished=16)
+    jobs = [finished_job() for _ in range(17)]
+    for job in jobs:
+        table.add(job)
+    assert table.evict() == 1
+    assert [job.id in table for job in jobs] == [False] + [True] * 16
+
+
+def test_eviction_in_batches():
+    table = JobTable(max_finished=16)
+    jobs = [finished_job() for _ in range(18)]
+    for job in jobs:
+        table.add(job)
+    # evicted automatically after exceeding the limit by a sixteenth
+    assert len(table) == 16
+    assert jobs[-1].id in table
+
+
+def test_expired_finished_evicted():
+    table = JobTable(finished_ttl=60)
+    old, new = finished_job(), finished_job()
+    table.add(old)
+    table.add(new)
+    table._times[0] -= 120
+    assert table.evict() == 1
+    assert old.id not in table and new.id in table
+
+
+def test_active_jobs_not_evicted():
+    table = JobTable(max_finished=0, finished_ttl=0)
+    job = Job("true", "/tmp", {})
+    table.add(job)
+    table.evict(now=time.time() + 1)
+    assert table.get_active(job.id) is job
+
+
+def test_deleted_record_not_returned():
+    table = JobTable(max_finished=16)
+    jobs = [finished_job() for _ in range(17)]
+    for job in jobs:
+        table.add(job)
+    table.delete(jobs[1].id)
+    assert jobs[1].id not in table
+    assert table.evict() == 1
+    assert len(table) == 15
+    assert jobs[2].id in table
+
+
+def test_queue_reports_evicted_jobs_unknown(start_queue, queue_address, tmp_path):
+    from slivka.local_queue import LocalQueueClient
+
+    queue = start_queue(max_finished=1)
+    client = LocalQueueClient(queue_address, timeout=1)
+    first = client.submit_job("true", str(tmp_path), {}).id
+    deadline = time.monotonic() + 5
+    while (JobStatus(client.get_job_status(first).state) != JobStatus.COMPLETED
+           and time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert client.get_job_status(first).returncode == 0
+    assert queue.jobs.get_active(first) is None
+    for _ in range(2):
+        client.submit_job("true", str(tmp_path), {})
+    deadline = time.monotonic() + 5
+    while first in queue.jobs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.get_job_status(first).state == JobStatus.UNKNOWN
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueueClient
+from slivka.local_queue.journal import JobJournal
+from slivka.local_queue.server import Job
+
+
+@pytest.fixture()
+def journal(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.db"), max_finished=2)
+    yield journal
+    journal.close()
+
+
+def wait_for_state(client, job_id, states, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        state = client.get_job_status(job_id).state
+        if state in states or time.monotonic() > deadline:
+            return state
+        time.sleep(0.02)
+
+
+def test_journal_stores_jobs(journal):
+    job = Job("echo hello", "/tmp", {"PATH": "/bin"})
+    journal.add(job)
+    job.state, job.return_code = JobStatus.COMPLETED, 0
+    journal.update(job)
+    journal.flush()
+    (entry,) = journal.load()
+    assert entry.id == job.id
+    assert (entry.cmd, entry.cwd, entry.env) == ("echo hello", "/tmp", {"PATH": "/bin"})
+    assert (entry.state, entry.return_code) == (JobStatus.COMPLETED, 0)
+
+
+def test_journal_deletes_jobs(journal):
+    job = Job("true", "/tmp")
+    journal.add(job)
+    journal.flush()
+    journal.delete(job.id)
+    journal.flush()
+    assert journal.load() == []
+
+
+def test_compact_keeps_recent_finished_jobs(journal):
+    jobs = [Job("true", "/tmp") for _ in range(4)]
+    jobs[0].state = JobStatus.QUEUED
+    for job in jobs[1:]:
+        job.state = JobStatus.COMPLETED
+    for job in jobs:
+        journal.add(job)
+        journal.flush()
+    assert journal.compact() == 1
+    assert [entry.id for entry in journal.load()] == [
+        jobs[0].id, jobs[2].id, jobs[3].id
+    ]
+
+
+def test_queue_restores_jobs(start_queue, queue_address, tmp_path):
+    path = str(tmp_path / "journal.db")
+    queue = start_queue(workers=1, journal=path)
+    client = LocalQueueClient(queue_address)
+    finished = client.submit_job("true", str(tmp_path), {}).id
+    assert wait_for_state(client, finished, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    running = client.submit_job("sleep 10", str(tmp_path), {}).id
+    queued = client.submit_job("true", str(tmp_path), {}).id
+    wait_for_state(client, running, [JobStatus.RUNNING])
+    start_queue.stop(queue)
+
+    start_queue(workers=1, journal=path)
+    client = LocalQueueClient(queue_address)
+    assert client.get_job_status(finished).state == JobStatus.COMPLETED
+    assert client.get_job_status(running).state == JobStatus.INTERRUPTED
+    assert wait_for_state(client, queued, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
@@ -0,0 +1,135 @@
+import time
+from unittest import mock
+
+import pytest
+
+from slivka import JobStatus
+from slivka.local_queue import StatusSubscriber
+from slivka.scheduler.runners import Command, RunnerID, SlivkaQueueRunner
+
+
+def receive_until(subscriber, predicate, timeout=5):
+    updates, gap = [], False
+    deadline = time.monotonic() + timeout
+    while not predicate(updates) and time.monotonic() < deadline:
+        new_updates, new_gap = subscriber.receive()
+        updates.extend(new_updates)
+        gap = gap or new_gap
+        time.sleep(0.01)
+    return updates, gap
+
+
+@pytest.fixture()
+def subscriber(client):
+    info = client.get_info()
+    subscriber = StatusSubscriber(info["notify"], info["epoch"], info["seq"])
+    time.sleep(0.1)  # let the subscription propagate
+    yield subscriber
+    subscriber.close()
+
+
+@pytest.fixture()
+def runner(local_queue, queue_address):
+    return SlivkaQueueRunner(
+        RunnerID("example", "queue"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        address=queue_address,
+    )
+
+
+def test_state_transitions_published(client, subscriber, tmp_path):
+    job_id = client.submit_job("true", str(tmp_path), {}).id
+    updates, gap = receive_until(
+        subscriber, lambda u: any(x.state == JobStatus.COMPLETED for x in u)
+    )
+    assert [(u.id, u.state) for u in updates] == [
+        (job_id, JobStatus.RUNNING), (job_id, JobStatus.COMPLETED)
+    ]
+    assert not gap
+
+
+def test_gap_detected(client, subscriber, tmp_path):
+    subscriber.seq -= 1
+    client.submit_job("true", str(tmp_path), {})
+    _, gap = receive_until(subscriber, lambda u: len(u) >= 1)
+    assert gap
+
+
+def test_restart_detected(client, subscriber, tmp_path):
+    subscriber.epoch = "0"
+    client.submit_job("true", str(tmp_path), {})
+    _, gap = receive_until(subscriber, lambda u: len(u) >= 1)
+    assert gap
+
+
+def spy_fetched_ids(runner):
+    fetched = []
+    get_job_statuses = runner.client.get_job_statuses
+
+    def spy(ids, **kwargs):
+        ids = list(ids)
+        fetched.extend(ids)
+        return get_job_statuses(ids, **kwargs)
+
+    return fetched, mock.patch.object(runner.client, "get_job_statuses", spy)
+
+
+def test_runner_serves_states_from_notifications(runner, tmp_path):
+    runner._get_subscriber()
+    time.sleep(0.1)  # let the subscription propagate
+    jobs = runner.batch_submit(
+        [Command(["sleep", "0.2"], str(tmp_path)) for _ in range(2)]
+    )
+    fetched, spy = spy_fetched_ids(runner)
+    states = {}
+    with spy:
+        deadline = time.monotonic() + 5
+        while len(states) < len(jobs) and time.monotonic() < deadline:
+            # finished jobs are no longer checked, as in the scheduler
+            pending = [job for job in jobs if job.id not in states]
+            for job, state in zip(pending, runner.batch_check_status(pending)):
+                if state.is_finished():
+                    states[job.id] = state
+            time.sleep(0.02)
+    assert list(states.values()) == [JobStatus.COMPLETED] * 2
+    assert fetched == []
+
+
+def test_runner_fetches_states_after_gap(runner, tmp_path):
+    (job,) = runner.batch_submit([Command(["true"], str(tmp_path))])
+    runner._subscriber.seq -= 1
+    time.sleep(0.3)
+    fetched, spy = spy_fetched_ids(runner)
+    with spy:
+        assert runner.batch_check_status([job]) == [JobStatus.COMPLETED]
+    assert fetched == [job.id]
+
+
+def test_released_job_states_dropped(runner, tmp_path):
+    runner._get_subscriber()
+    (job,) = runner.batch_submit([Command(["sleep", "1"], str(tmp_path))])
+    assert runner.batch_check_status([job]) != [JobStatus.COMPLETED]
+    assert job.id in runner._states
+    runner.release_jobs([job])
+    assert job.id not in runner._states
+
+
+def test_runner_polls_without_subscription(local_queue, queue_address, tmp_path):
+    runner = SlivkaQueueRunner(
+        RunnerID("example", "queue"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        address=queue_address,
+        subscribe=False,
+    )
+    (job,) = runner.batch_submit([Command(["true"], str(tmp_path))])
+    time.sleep(0.3)
+    assert runner.batch_check_status([job]) == [JobStatus.COMPLETED]
+    assert runner._subscriber is None
@@ -0,0 +1,38 @@
+import asyncio
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from slivka.local_queue.server import _wait_process
+
+
+@pytest.fixture()
+def no_pidfd(monkeypatch):
+    monkeypatch.delattr(os, "pidfd_open", raising=False)
+
+
+def test_processes_waited_without_pidfd(no_pidfd):
+    async def run():
+        loop = asyncio.get_running_loop()
+        # a single thread would be held by the long process
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        long = subprocess.Popen(["sleep", "5"])
+        short = subprocess.Popen(["sh", "-c", "exit 3"])
+        long_waiter = asyncio.ensure_future(_wait_process(long))
+        try:
+            return_code, rusage = await asyncio.wait_for(
+                _wait_process(short), timeout=2
+            )
+            assert return_code == 3
+            assert rusage is not None
+        finally:
+            long.kill()
+            await long_waiter
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
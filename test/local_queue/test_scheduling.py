@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.local_queue import LocalQueue, LocalQueueClient, RequestError
+from slivka.scheduler.runners import Command, RunnerID, SlivkaQueueRunner
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture()
+def make_client(start_queue, queue_address):
+    def make(**kwargs):
+        start_queue(**kwargs)
+        return LocalQueueClient(queue_address, timeout=1)
+    return make
+
+
+@pytest.fixture()
+def job_dir(tmp_path):
+    counter = iter(range(1000))
+
+    def make():
+        path = tmp_path / str(next(counter))
+        path.mkdir()
+        return str(path)
+    return make
+
+
+def state(client, job_id):
+    return JobStatus(client.get_job_status(job_id).state)
+
+
+def test_higher_priority_started_first(make_client, job_dir, tmp_path):
+    client = make_client(workers=1)
+    log = tmp_path / "order"
+    first = client.submit_job(
+        "sleep 0.2; echo first >> %s" % log, job_dir(), {}
+    ).id
+    assert wait_for(lambda: state(client, first) == JobStatus.RUNNING)
+    low = client.submit_job("echo low >> %s" % log, job_dir(), {}).id
+    high = client.submit_job(
+        "echo high >> %s" % log, job_dir(), {}, priority=10
+    ).id
+    assert wait_for(lambda: state(client, low).is_finished())
+    assert state(client, high) == JobStatus.COMPLETED
+    assert log.read_text().split() == ["first", "high", "low"]
+
+
+def test_wide_job_uses_multiple_cores(make_client, job_dir):
+    client = make_client(workers=4)
+    wide = client.submit_job("sleep 0.5", job_dir(), {}, cores=4).id
+    assert wait_for(lambda: state(client, wide) == JobStatus.RUNNING)
+    narrow = client.submit_job("true", job_dir(), {}).id
+    time.sleep(0.1)
+    assert state(client, narrow) == JobStatus.QUEUED
+    assert wait_for(lambda: state(client, narrow) == JobStatus.COMPLETED)
+
+
+def test_memory_limit(make_client, job_dir):
+    client = make_client(workers=2, memory=100)
+    first = client.submit_job("sleep 0.5", job_dir(), {}, memory=80).id
+    second = client.submit_job("true", job_dir(), {}, memory=80).id
+    assert wait_for(lambda: state(client, first) == JobStatus.RUNNING)
+    assert state(client, second) == JobStatus.QUEUED
+
+
+def test_small_job_backfilled(make_client, job_dir):
+    client = make_client(workers=2)
+    client.submit_job("sleep 0.5", job_dir(), {})
+    wide = client.submit_job("true", job_dir(), {}, cores=2).id
+    small = client.submit_job("sleep 0.5", job_dir(), {}).id
+    assert wait_for(lambda: state(client, small) == JobStatus.RUNNING)
+    assert state(client, wide) == JobStatus.QUEUED
+    assert wait_for(lambda: state(client, wide) == JobStatus.COMPLETED)
+
+
+def test_starving_job_not_overtaken(make_client, job_dir, monkeypatch):
+    monkeypatch.setattr(LocalQueue, "starvation_limit", 0)
+    client = make_client(workers=2)
+    client.submit_job("sleep 0.3", job_dir(), {})
+    wide = client.submit_job("true", job_dir(), {}, cores=2).id
+    small = client.submit_job("true", job_dir(), {}).id
+    time.sleep(0.1)
+    assert state(client, small) == JobStatus.QUEUED
+    assert wait_for(lambda: state(client, small) == JobStatus.COMPLETED)
+    assert state(client, wide) == JobStatus.COMPLETED
+
+
+def test_job_exceeding_resources_rejected(make_client, job_dir):
+    client = make_client(workers=2)
+    with pytest.raises(RequestError, match="insufficient-resources"):
+        client.submit_job("true", job_dir(), {}, cores=4)
+
+
+def test_runner_submits_resources(start_queue, queue_address, job_dir):
+    queue = start_queue(workers=4)
+    runner = SlivkaQueueRunner(
+        RunnerID("example", "queue"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        address=queue_address,
+        priority=5,
+        cores=2,
+        memory="1G",
+    )
+    (job,) = runner.batch_submit([Command(["sleep", "0.5"], job_dir())])
+    queued = queue.jobs.get_active(job.id)
+    assert (queued.priority, queued.cores, queued.memory) == (5, 2, 1024)
+
+
+def test_runner_retrieves_job_usage(start_queue, queue_address, job_dir):
+    start_queue(workers=1)
+    runner = SlivkaQueueRunner(
+        RunnerID("example", "queue"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        address=queue_address,
+        subscribe=False,
+    )
+    first, second = runner.batch_submit(
+        [Command(["sleep", "0.2"], job_dir()) for _ in range(2)]
+    )
+    assert wait_for(
+        lambda: runner.batch_check_status([second]) == [JobStatus.COMPLETED]
+    )
+    usage = runner.get_usage(second)
+    assert usage.queue_time >= 0.15
+    assert usage.wall_time >= 0.2
+    assert usage.cpu_time >= 0
+    assert usage.max_rss > 0
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import zmq
+
+from slivka import JobStatus
+from slivka.local_queue import (
+    LocalQueue, LocalQueueClient, QueueWorker, RequestError
+)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture()
+def worker_address(tmp_path):
+    return "ipc://%s" % (tmp_path / "workers.sock")
+
+
+@pytest.fixture()
+def local_queue(start_queue, worker_address):
+    return start_queue(workers=0, worker_address=worker_address)
+
+
+@pytest.fixture()
+def start_worker(worker_address):
+    running = []
+
+    def start(slots=1, name=None):
+        worker = QueueWorker(worker_address, slots=slots, name=name)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=worker.run, args=(loop,), daemon=True)
+        thread.start()
+        running.append((worker, loop, thread))
+        return worker
+
+    def stop(worker):
+        for item in running:
+            if item[0] is worker:
+                running.remove(item)
+                _, loop, thread = item
+                loop.call_soon_threadsafe(worker.stop)
+                thread.join(5)
+                worker.close(loop)
+                loop.close()
+                return
+
+    start.stop = stop
+    yield start
+    for worker, _, _ in list(running):
+        stop(worker)
+
+
+def wait_finished(client, job_ids, timeout=5):
+    states = {}
+
+    def all_finished():
+        for job_id in job_ids:
+            states[job_id] = JobStatus(client.get_job_status(job_id).state)
+        return all(state.is_finished() for state in states.values())
+
+    wait_for(all_finished, timeout)
+    return [states[job_id] for job_id in job_ids]
+
+
+def test_workers_register(local_queue, start_worker):
+    start_worker(slots=2, name="alpha")
+    start_worker(slots=3, name="beta")
+    assert wait_for(lambda: len(local_queue.nodes) == 2)
+    assert sorted((n.name, n.slots) for n in local_queue.nodes.values()) == [
+        ("alpha", 2), ("beta", 3)
+    ]
+
+
+def test_job_run_by_remote_worker(local_queue, start_worker, client, tmp_path):
+    start_worker()
+    assert wait_for(lambda: local_queue.nodes)
+    job_id = client.submit_job("echo hello; exit 3", str(tmp_path), {}).id
+    assert wait_finished(client, [job_id]) == [JobStatus.FAILED]
+    assert client.get_job_status(job_id).returncode == 3
+    assert (tmp_path / "stdout").read_text() == "hello\n"
+
+
+def test_remote_job_usage_reported(
+        local_queue, start_worker, client, tmp_path):
+    start_worker()
+    assert wait_for(lambda: local_queue.nodes)
+    job_id = client.submit_job("sleep 0.2", str(tmp_path), {}).id
+    assert wait_finished(client, [job_id]) == [JobStatus.COMPLETED]
+    usage = client.get_job_status(job_id).usage
+    assert usage["queue_time"] >= 0
+    assert usage["wall_time"] >= 0.2
+    assert usage["max_rss"] > 0
+
+
+def test_jobs_balanced_between_workers(
+        local_queue, start_worker, client, tmp_path):
+    start_worker(name="alpha")
+    start_worker(name="beta")
+    assert wait_for(lambda: len(local_queue.nodes) == 2)
+    job_ids = []
+    for i in range(2):
+        cwd = tmp_path / str(i)
+        cwd.mkdir()
+        job_ids.append(client.submit_job("sleep 0.5", str(cwd), {}).id)
+    assert wait_for(lambda: all(
+        len(node.jobs) == 1 for node in local_queue.nodes.values()
+    ))
+    assert wait_finished(client, job_ids) == [JobStatus.COMPLETED] * 2
+
+
+def test_jobs_wait_for_free_slots(local_queue, start_worker, client, tmp_path):
+    start_worker(slots=1)
+    assert wait_for(lambda: local_queue.nodes)
+    job_ids = []
+    for i in range(2):
+        cwd = tmp_path / str(i)
+        cwd.mkdir()
+        job_ids.append(client.submit_job("sleep 0.2", str(cwd), {}).id)
+    time.sleep(0.1)
+    assert [JobStatus(client.get_job_status(job_id).state)
+            for job_id in job_ids] == [JobStatus.RUNNING, JobStatus.QUEUED]
+    assert wait_finished(client, job_ids) == [JobStatus.COMPLETED] * 2
+
+
+def test_job_larger_than_workers_rejected(
+        local_queue, start_worker, client, tmp_path):
+    start_worker(slots=2)
+    assert wait_for(lambda: local_queue.nodes)
+    with pytest.raises(RequestError, match="insufficient-resources"):
+        client.submit_job("true", str(tmp_path), {}, cores=4)
+
+
+def test_oversized_job_not_holding_workers(
+        local_queue, start_worker, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(LocalQueue, "starvation_limit", 0)
+    (tmp_path / "wide").mkdir()
+    (tmp_path / "small").mkdir()
+    # submitted before the workers connect, so it is accepted
+    wide = client.submit_job("true", str(tmp_path / "wide"), {}, cores=4).id
+    start_worker(slots=1)
+    assert wait_for(lambda: local_queue.nodes)
+    time.sleep(0.1)
+    small = client.submit_job("true", str(tmp_path / "small"), {}).id
+    assert wait_finished(client, [small]) == [JobStatus.COMPLETED]
+    assert client.get_job_status(wide).state == JobStatus.QUEUED
+
+
+def test_cancel_remote_job(local_queue, start_worker, client, tmp_path):
+    start_worker()
+    assert wait_for(lambda: local_queue.nodes)
+    job_id = client.submit_job("sleep 5", str(tmp_path), {}).id
+    assert wait_for(lambda: client.get_job_status(job_id).state ==
+                    JobStatus.RUNNING)
+    client.cancel_job(job_id)
+    assert wait_finished(client, [job_id]) == [JobStatus.INTERRUPTED]
+
+
+def test_stopped_worker_jobs_interrupted(
+        local_queue, start_worker, client, tmp_path):
+    worker = start_worker()
+    assert wait_for(lambda: local_queue.nodes)
+    job_id = client.submit_job("sleep 5", str(tmp_path), {}).id
+    assert wait_for(lambda: worker.jobs)
+    start_worker.stop(worker)
+    assert wait_finished(client, [job_id]) == [JobStatus.INTERRUPTED]
+    assert wait_for(lambda: not local_queue.nodes)
+
+
+def test_lost_worker_jobs_interrupted(
+        start_queue, worker_address, queue_address, monkeypatch, tmp_path):
+    monkeypatch.setattr(LocalQueue, "heartbeat_interval", 0.05)
+    monkeypatch.setattr(LocalQueue, "worker_timeout", 0.2)
+    queue = start_queue(workers=0, worker_address=worker_address)
+    client = LocalQueueClient(queue_address)
+    # worker which receives the job and never reports back
+    socket = zmq.Context.instance().socket(zmq.DEALER)
+    socket.connect(worker_address)
+    try:
+        socket.send_json(
+            {"type": "HEARTBEAT", "name": "silent", "slots": 1, "running": []}
+        )
+        assert wait_for(lambda: queue.nodes)
+        job_id = client.submit_job("true", str(tmp_path), {}).id
+        assert socket.poll(5000)
+        assert json.loads(socket.recv())["id"] == job_id
+        assert wait_finished(client, [job_id]) == [JobStatus.INTERRUPTED]
+        assert not queue.nodes
+    finally:
+        socket.close(linger=0)
+
+
+def test_malformed_worker_message_dropped(
+        local_queue, start_worker, worker_address):
+    ctx = zmq.Context.instance()
+    socket = ctx.socket(zmq.DEALER)
+    socket.connect(worker_address)
+    try:
+        socket.send_multipart([b"stray", b"frames"])
+        socket.send(b"not json")
+        start_worker(name="alpha")
+        assert wait_for(lambda: len(local_queue.nodes) == 1)
+    finally:
+        socket.close(linger=0)
+
+
+def test_worker_drops_malformed_messages(start_worker, worker_address, tmp_path):
+    ctx = zmq.Context.instance()
+    router = ctx.socket(zmq.ROUTER)
+    router.bind(worker_address)
+    router.rcvtimeo = 5000
+    try:
+        start_worker()
+        identity, _ = router.recv_multipart()
+        router.send_multipart([identity, b"not json"])
+        router.send_multipart([identity, b"{}"])
+        router.send_multipart([identity, b"a", b"b"])
+        router.send_multipart([identity, json.dumps({
+            "type": "RUN", "id": 1, "cmd": "true", "cwd": str(tmp_path),
+            "env": {}
+        }).encode()])
+        while True:
+            _, payload = router.recv_multipart()
+            message = json.loads(payload)
+            if message["type"] == "STATE":
+                break
+        assert message["id"] == 1
+        assert message["state"] == JobStatus.COMPLETED
+    finally:
+        router.close(linger=0)
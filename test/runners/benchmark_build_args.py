@@ -0,0 +1,90 @@
+"""Micro-benchmark of the command line construction.
+
+Compares :py:meth:`Runner.build_args` using pre-compiled argument
+templates with the original implementation which interpreted the
+argument definitions for every job.
+
+Run with ``python -m test.runners.benchmark_build_args``
+"""
+import timeit
+
+from slivka.conf import ServiceConfig
+from slivka.scheduler import Runner
+
+Argument = ServiceConfig.Argument
+
+
+def legacy_build_args(runner, values):
+    args = []
+    for argument in runner.arguments:
+        value = values.get(argument.id)
+        if value is None:
+            value = argument.default
+        if value is None or value is False:
+            continue
+
+        if isinstance(value, list):
+            if argument.symlink:
+                value = [runner._symlink_name(argument.symlink, i)
+                         for i in range(len(value))]
+            if argument.join is not None:
+                value = str.join(argument.join, value)
+        elif argument.symlink:
+            value = argument.symlink
+
+        if isinstance(value, list):
+            args.extend(
+                arg.replace('$(value)', val)
+                for val in value
+                for arg in argument.arg
+            )
+        else:
+            args.extend(
+                arg.replace('$(value)', value)
+                for arg in argument.arg
+            )
+    return args
+
+
+def main(number=20000):
+    runner = Runner(
+        runner_id=None,
+        command="example",
+        args=[
+            Argument("input", "--infile $(value)", symlink="input.txt"),
+            Argument("opt", "--opt=$(value)"),
+            Argument("rep", "--rep $(value)", join=","),
+            Argument("files", "-f $(value)", symlink="file"),
+            Argument("delay", "--delay $(value)"),
+            Argument("flag", "--flag"),
+            Argument("threads", "--threads $(value)", default="4"),
+            Argument("_separator", "--", default="present"),
+            Argument("arg", "$(value)"),
+        ],
+        consts={},
+        outputs=[],
+        env={},
+    )
+    values = {
+        "input": "/tmp/upload/input-file",
+        "opt": "some text",
+        "rep": ["a", "b", "c", "d"],
+        "files": ["/tmp/a", "/tmp/b", "/tmp/c"],
+        "delay": "5",
+        "flag": "true",
+        "arg": "foobar",
+    }
+    assert runner.build_args(values) == legacy_build_args(runner, values)
+    legacy = min(timeit.repeat(
+        lambda: legacy_build_args(runner, values), number=number, repeat=5
+    ))
+    compiled = min(timeit.repeat(
+        lambda: runner.build_args(values), number=number, repeat=5
+    ))
+    print("legacy:   %.2f us per call" % (legacy / number * 1e6))
+    print("compiled: %.2f us per call" % (compiled / number * 1e6))
+    print("speedup:  %.2fx" % (legacy / compiled))
+
+
+if __name__ == "__main__":
+    main()
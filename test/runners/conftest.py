@@ -0,0 +1,48 @@
+import os
+import stat
+from unittest import mock
+
+import pytest
+
+
+class FakeCommand:
+    """Stand-in executable printing prepared output and logging its args."""
+
+    def __init__(self, bin_dir, name):
+        self.path = bin_dir / name
+        self.output_path = bin_dir / (name + ".out")
+        self.args_path = bin_dir / (name + ".args")
+        self.set_output("")
+
+    def set_output(self, output, return_code=0):
+        self.output_path.write_text(output)
+        self.path.write_text(
+            "#!/bin/sh\n"
+            f'echo "$@" >> "{self.args_path}"\n'
+            f'cat "{self.output_path}"\n'
+            f"exit {return_code}\n"
+        )
+        self.path.chmod(self.path.stat().st_mode | stat.S_IEXEC)
+
+    @property
+    def calls(self):
+        if not self.args_path.exists():
+            return []
+        return self.args_path.read_text().splitlines()
+
+
+@pytest.fixture()
+def fake_bin(tmp_path):
+    """Directory prepended to the PATH for stand-in executables."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    path = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+    with mock.patch.dict(os.environ, PATH=path):
+        yield bin_dir
+
+
+@pytest.fixture()
+def fake_command(fake_bin):
+    def factory(name):
+        return FakeCommand(fake_bin, name)
+    return factory
@@ -0,0 +1,188 @@
+"""Minimal stand-in for the slurmrestd daemon.
+
+Implements the job submission, listing and cancellation endpoints
+of the Slurm REST API closely enough to exercise
+:py:class:`SlurmRestRunner`. Jobs never run; their states are set
+by the tests through :py:meth:`FakeSlurmRestd.set_state`.
+
+Run with ``python -m test.runners.fake_slurmrestd [port]``
+"""
+import itertools
+import json
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSlurmRestd(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), api_version="v0.0.40",
+                 token=None):
+        super().__init__(address, _Handler)
+        self.api_version = api_version
+        self.token = token
+        self.jobs = {}
+        self.submissions = []
+        self.requests = []
+        self.connections = 0
+        self._ids = itertools.count(1001)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True
+        )
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def set_state(self, job_id, state):
+        """Sets the state of the job or array task given as ``id_task``."""
+        with self._lock:
+            self.jobs[str(job_id)]["job_state"] = [state]
+
+    def submit(self, body):
+        with self._lock:
+            self.submissions.append(body)
+            job_id = next(self._ids)
+            array = body["job"].get("array")
+            if array is None:
+                self.jobs[str(job_id)] = {
+                    "job_id": job_id,
+                    "array_job_id": {"set": True, "number": 0},
+                    "array_task_id": {"set": False, "number": 0},
+                    "job_state": ["PENDING"],
+                }
+            else:
+                first, last = map(int, array.split("-"))
+                for task in range(first, last + 1):
+                    self.jobs["%d_%d" % (job_id, task)] = {
+                        "job_id": job_id + task,
+                        "array_job_id": {"set": True, "number": job_id},
+                        "array_task_id": {"set": True, "number": task},
+                        "job_state": ["PENDING"],
+                    }
+            return job_id
+
+    def list_jobs(self, job_ids=None):
+        """Lists the jobs, or the ``job_ids`` and all the tasks of the
+        array jobs among them."""
+        with self._lock:
+            jobs = [
+                dict(job) for job in self.jobs.values()
+                if job_ids is None or str(
+                    job["array_job_id"]["number"] or job["job_id"]
+                ) in job_ids
+            ]
+        # pending tasks of an array are reported in a single record
+        pending = {}
+        result = []
+        for job in jobs:
+            array_id = job["array_job_id"]["number"]
+            if array_id and job["job_state"] == ["PENDING"]:
+                pending.setdefault(array_id, []).append(
+                    job["array_task_id"]["number"]
+                )
+            else:
+                result.append(job)
+        for array_id, tasks in pending.items():
+            result.append({
+                "job_id": array_id,
+                "array_job_id": {"set": True, "number": array_id},
+                "array_task_id": {"set": False, "number": 0},
+                "array_task_string": ",".join(map(str, tasks)),
+                "job_state": ["PENDING"],
+            })
+        return result
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job["job_state"] = ["CANCELLED"]
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: FakeSlurmRestd
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _route(self, method):
+        self.server.requests.append((method, self.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        if (self.server.token is not None and
+                self.headers.get("X-SLURM-USER-TOKEN") != self.server.token):
+            return self._send(401, {"errors": [
+                {"error": "Authentication failure"}
+            ]})
+        prefix = "/slurm/%s" % self.server.api_version
+        path = self.path.split("?", 1)[0]
+        if method == "POST" and path == prefix + "/job/submit":
+            job_id = self.server.submit(body)
+            return self._send(200, {
+                "job_id": job_id, "step_id": "batch", "errors": []
+            })
+        if method == "GET" and path == prefix + "/jobs":
+            return self._send(200, {
+                "jobs": self.server.list_jobs(), "errors": []
+            })
+        match = re.fullmatch(re.escape(prefix) + r"/job/([\w,]+)", path)
+        if method == "GET" and match:
+            job_ids = match.group(1).split(",")
+            return self._send(200, {
+                "jobs": self.server.list_jobs(job_ids), "errors": []
+            })
+        if method == "DELETE" and match:
+            if self.server.cancel(match.group(1)):
+                return self._send(200, {"errors": []})
+            return self._send(404, {"errors": [
+                {"description": "Invalid job id specified"}
+            ]})
+        self._send(404, {"errors": [{"description": "Unknown endpoint"}]})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6820
+    server = FakeSlurmRestd(("127.0.0.1", port))
+    print("Serving fake slurmrestd at %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -238,6 +238,20 @@ class TestSingleInputInterpolation:
         args = runner.build_args({"input": ["a", "b", "c"]})
         assert args == ["-m", "a b c"]
 
+    @pytest.mark.argument("-f $(value)", symlink="file")
+    def test_build_args_if_multiple_symlinks(self, runner):
+        args = runner.build_args({"input": ["x.txt", "y.txt"]})
+        assert args == ["-f", "file.0000", "-f", "file.0001"]
+
+    @pytest.mark.argument("-f=$(value)", symlink="file", join=",")
+    def test_build_args_if_multiple_symlinks_joined(self, runner):
+        args = runner.build_args({"input": ["x.txt", "y.txt"]})
+        assert args == ["-f=file.0000,file.0001"]
+
+    @pytest.mark.argument("$(value):$(value)")
+    def test_build_args_if_placeholder_repeated(self, runner):
+        assert runner.build_args({"input": "val"}) == ["val:val"]
+
 
 @pytest.mark.parametrize("command_env", [{}])
 @pytest.mark.parametrize(
@@ -439,3 +453,35 @@ def test_batch_start_with_parameters_submits_commands(
             for i in range(n)
         ]
     )
+
+
+def test_batch_start_submits_in_chunks(
+    runner, job_directory_factory, mock_submit
+):
+    n = 7
+    inputs = [{} for _ in range(n)]
+    cwds = [job_directory_factory() for _ in range(n)]
+    mock_submit.side_effect = lambda cmd: Job(cmd.cwd[-4:], cmd.cwd)
+    with mock.patch.object(runner, "submit_chunk_size", 3), \
+            mock.patch.object(
+                runner, "batch_submit", wraps=runner.batch_submit
+            ) as mock_batch_submit:
+        jobs = runner.batch_start(inputs, cwds)
+    assert [len(c.args[0]) for c in mock_batch_submit.call_args_list] == [3, 3, 1]
+    assert jobs == [Job(cwd[-4:], cwd) for cwd in cwds]
+    assert all(os.path.isdir(cwd) for cwd in cwds)
+
+
+@pytest.mark.runner(args=[Argument("input", "$(value)", symlink="input.txt")])
+def test_batch_start_cancels_submitted_jobs_if_staging_failed(
+    runner, job_directory_factory, mock_submit
+):
+    infile = tempfile.NamedTemporaryFile()
+    inputs = [{"input": infile.name}, {"input": "/nonexistent/file"}]
+    cwds = [job_directory_factory() for _ in inputs]
+    mock_submit.side_effect = lambda cmd: Job("0000", cmd.cwd)
+    with mock.patch.object(runner, "submit_chunk_size", 1), \
+            mock.patch.object(runner, "batch_cancel") as mock_cancel:
+        with pytest.raises(FileNotFoundError):
+            runner.batch_start(inputs, cwds)
+    mock_cancel.assert_called_once_with([Job("0000", cwds[0])])
@@ -0,0 +1,213 @@
+import os
+import subprocess
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, ResourceUsage, RunnerID
+from slivka.scheduler.runners.grid_engine import GridEngineRunner, _array_script
+
+QSTAT_XML = """\
+<?xml version='1.0'?>
+<job_info xmlns:xsd="http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>1001</JB_job_number>
+      <JB_name>run.sh</JB_name>
+      <state>r</state>
+      <slots>1</slots>
+    </job_list>
+    <job_list state="running">
+      <JB_job_number>1002</JB_job_number>
+      <JB_name>array.sh</JB_name>
+      <state>r</state>
+      <slots>1</slots>
+      <tasks>1</tasks>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>1002</JB_job_number>
+      <JB_name>array.sh</JB_name>
+      <state>qw</state>
+      <slots>1</slots>
+      <tasks>2-6:2</tasks>
+    </job_list>
+  </job_info>
+</job_info>
+"""
+
+
+@pytest.fixture()
+def qsub(fake_command):
+    return fake_command("qsub")
+
+
+@pytest.fixture()
+def qstat(fake_command):
+    return fake_command("qstat")
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def factory():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return factory
+
+
+@pytest.fixture()
+def runner(fake_bin):
+    return GridEngineRunner(
+        RunnerID("example", "sge"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+    )
+
+
+def test_batch_submitted_as_array_job(runner, qsub, make_job_dir):
+    commands = [Command(["echo", str(i)], make_job_dir())
+                for i in range(3)]
+    qsub.set_output("1002.1-3:1\n")
+    jobs = runner.batch_submit(commands)
+    assert jobs == [Job(b"1002.%d" % i, cmd.cwd)
+                    for i, cmd in enumerate(commands, 1)]
+    assert len(qsub.calls) == 1
+    assert "-t 1-3" in qsub.calls[0]
+    assert "-S /bin/sh" in qsub.calls[0]
+    assert os.listdir(commands[0].cwd) == []
+
+
+@pytest.mark.parametrize("task_id", [1, 2])
+def test_array_script_runs_task_command(make_job_dir, task_id):
+    commands = [Command(["echo", "task one"], make_job_dir()),
+                Command(["echo", "task two"], make_job_dir())]
+    script = _array_script(commands)
+    env = dict(os.environ, SGE_TASK_ID=str(task_id))
+    subprocess.run(["sh", "-c", script], env=env, check=True)
+    cwd = commands[task_id - 1].cwd
+    with open(os.path.join(cwd, "stdout")) as fp:
+        assert fp.read() == ["task one\n", "task two\n"][task_id - 1]
+    with open(os.path.join(cwd, "finished")) as fp:
+        assert fp.read() == "0\n"
+    assert not os.path.exists(os.path.join(commands[2 - task_id].cwd, "stdout"))
+
+
+@pytest.mark.parametrize(
+    "job_id, expected_status",
+    [
+        (b"1001", JobStatus.RUNNING),
+        (b"1002.1", JobStatus.RUNNING),
+        (b"1002.2", JobStatus.QUEUED),
+        (b"1002.4", JobStatus.QUEUED),
+        # tasks not in the range are gone from the queue
+        (b"1002.3", JobStatus.RUNNING),
+        (b"1002.8", JobStatus.RUNNING),
+    ],
+)
+def test_status_parsed_from_xml(
+    runner, qstat, make_job_dir, job_id, expected_status
+):
+    qstat.set_output(QSTAT_XML)
+    job = Job(job_id, make_job_dir())
+    assert runner.check_status(job) == expected_status
+    assert qstat.calls == ["-xml"]
+
+
+def test_status_of_finished_task_read_from_sentinel(
+    runner, qstat, make_job_dir
+):
+    qstat.set_output(QSTAT_XML)
+    job = Job(b"1002.3", make_job_dir())
+    with open(os.path.join(job.cwd, "finished"), "w") as fp:
+        fp.write("1\n")
+    assert runner.check_status(job) == JobStatus.FAILED
+
+
+def test_queue_error_raised(runner, qstat, make_job_dir):
+    qstat.set_output("error: failed receiving gdi request\n", return_code=1)
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.check_status(Job(b"1001", make_job_dir()))
+
+
+QACCT_OUTPUT = """\
+==============================================================
+qname        all.q
+jobnumber    1002
+taskid       1
+qsub_time    Mon Jun 19 10:00:00 2023
+start_time   Mon Jun 19 10:00:30 2023
+end_time     Mon Jun 19 10:02:35 2023
+ru_wallclock 125s
+ru_maxrss    3072
+cpu          62.500s
+==============================================================
+qname        all.q
+jobnumber    1002
+taskid       2
+qsub_time    Mon Jun 19 10:00:00 2023
+start_time   -/-
+ru_wallclock 0s
+cpu          0.000s
+"""
+
+
+def test_usage_read_from_accounting(runner, fake_command, make_job_dir):
+    qacct = fake_command("qacct")
+    qacct.set_output(QACCT_OUTPUT)
+    jobs = [Job(jid, make_job_dir()) for jid in (b"1002.1", b"1002.2", b"1002.3")]
+    assert runner.batch_get_usage(jobs) == [
+        ResourceUsage(queue_time=30, wall_time=125, cpu_time=62.5,
+                      max_rss=3072),
+        ResourceUsage(wall_time=0, cpu_time=0),
+        None,
+    ]
+    assert qacct.calls == ["-j 1002"]
+
+
+def test_usage_of_many_jobs_read_at_once(runner, fake_command, make_job_dir):
+    qacct = fake_command("qacct")
+    qacct.set_output(QACCT_OUTPUT.replace("1002", "1003", 1))
+    jobs = [Job(jid, make_job_dir()) for jid in (b"1001", b"1002.2")]
+    since = datetime.now() - timedelta(days=1)
+    assert runner.batch_get_usage(jobs) == [
+        None, ResourceUsage(wall_time=0, cpu_time=0)
+    ]
+    assert len(qacct.calls) == 1
+    option, begin = qacct.calls[0].rsplit(" ", 1)
+    assert option == "-j -b"
+    assert datetime.strptime(begin, "%Y%m%d%H%M") >= since.replace(
+        second=0, microsecond=0)
+
+
+def test_walltime_passed_as_hard_runtime_limit(qsub, make_job_dir):
+    runner = GridEngineRunner(
+        RunnerID("example", "sge"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        walltime="1:30:00",
+    )
+    qsub.set_output("1002.1-2:1\n")
+    runner.batch_submit([Command(["true"], make_job_dir()) for _ in range(2)])
+    assert "-l h_rt=5400" in qsub.calls[0]
+
+
+def test_unlisted_job_interrupted_after_grace_period(
+    runner, qstat, make_job_dir
+):
+    qstat.set_output(QSTAT_XML)
+    job = Job(b"1003", make_job_dir())
+    runner.finished_job_timestamp[job.id] = datetime.now() - timedelta(minutes=2)
+    with mock.patch.object(runner._watcher, "discard") as mock_discard:
+        assert runner.check_status(job) == JobStatus.INTERRUPTED
+    mock_discard.assert_called_once_with(job.cwd)
+    assert job.id not in runner.finished_job_timestamp
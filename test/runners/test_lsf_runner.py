@@ -0,0 +1,134 @@
+import os
+import subprocess
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, ResourceUsage, RunnerID
+from slivka.scheduler.runners.lsf import LSFRunner, _array_script
+
+BJOBS_OUTPUT = """\
+1001    user    RUN   normal     host01      host02      example    Oct 19 10:00
+1002    user    RUN   normal     host01      host03      slivka[1]  Oct 19 10:01
+1002    user    PEND  normal     host01                  slivka[2]  Oct 19 10:01
+1002    user    DONE  normal     host01      host03      slivka[3]  Oct 19 10:01
+"""
+
+
+@pytest.fixture()
+def bsub(fake_command):
+    return fake_command("bsub")
+
+
+@pytest.fixture()
+def bjobs(fake_command):
+    return fake_command("bjobs")
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def factory():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return factory
+
+
+@pytest.fixture()
+def runner(fake_bin):
+    return LSFRunner(
+        RunnerID("example", "lsf"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+    )
+
+
+def test_batch_submitted_as_job_array(runner, bsub, make_job_dir):
+    commands = [Command(["echo", str(i)], make_job_dir()) for i in range(3)]
+    bsub.set_output("Job <1002> is submitted to default queue <normal>.\n")
+    jobs = runner.batch_submit(commands)
+    assert jobs == [Job("1002[%d]" % i, cmd.cwd)
+                    for i, cmd in enumerate(commands, 1)]
+    assert len(bsub.calls) == 1
+    assert "-J slivka[1-3]" in bsub.calls[0]
+
+
+@pytest.mark.parametrize("index", [1, 2])
+def test_array_script_runs_element_command(make_job_dir, index):
+    commands = [Command(["echo", "task one"], make_job_dir()),
+                Command(["echo", "task two"], make_job_dir())]
+    env = dict(os.environ, LSB_JOBINDEX=str(index))
+    subprocess.run(["bash", "-c", _array_script(commands)], env=env, check=True)
+    cwd = commands[index - 1].cwd
+    with open(os.path.join(cwd, "stdout")) as fp:
+        assert fp.read() == ["task one\n", "task two\n"][index - 1]
+    with open(os.path.join(cwd, "finished")) as fp:
+        assert fp.read() == "0\n"
+    assert not os.path.exists(os.path.join(commands[2 - index].cwd, "stdout"))
+
+
+def test_array_elements_status_parsed(runner, bjobs, make_job_dir):
+    bjobs.set_output(BJOBS_OUTPUT)
+    jobs = [Job(jid, make_job_dir())
+            for jid in ("1001", "1002[1]", "1002[2]", "1002[3]")]
+    assert runner.batch_check_status(jobs) == [
+        JobStatus.RUNNING, JobStatus.RUNNING, JobStatus.QUEUED,
+        # waiting for the sentinel file
+        JobStatus.RUNNING
+    ]
+    assert bjobs.calls == ["-noheader -w 1001 1002[1] 1002[2] 1002[3]"]
+
+
+def test_finished_array_element_read_from_sentinel(runner, bjobs, make_job_dir):
+    bjobs.set_output(BJOBS_OUTPUT)
+    job = Job("1002[3]", make_job_dir())
+    with open(os.path.join(job.cwd, "finished"), "w") as fp:
+        fp.write("0\n")
+    assert runner.check_status(job) == JobStatus.COMPLETED
+
+
+def test_usage_read_from_finished_jobs(runner, bjobs, make_job_dir):
+    bjobs.set_output(
+        "1001|0|30|125 second(s)|62.5 second(s)|3 Mbytes\n"
+        "1002|2|4|10 second(s)|0.2 second(s)|-\n"
+    )
+    jobs = [Job(jid, make_job_dir()) for jid in ("1001", "1002[2]", "1003")]
+    assert runner.batch_get_usage(jobs) == [
+        ResourceUsage(queue_time=30, wall_time=125, cpu_time=62.5,
+                      max_rss=3072),
+        ResourceUsage(queue_time=4, wall_time=10, cpu_time=0.2),
+        None,
+    ]
+    assert bjobs.calls[0].startswith("-a -noheader -o jobid jobindex")
+
+
+def test_walltime_passed_as_run_limit(bsub, make_job_dir):
+    runner = LSFRunner(
+        RunnerID("example", "lsf"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        walltime=90,
+    )
+    bsub.set_output("Job <1001> is submitted to default queue <normal>.\n")
+    runner.submit(Command(["true"], make_job_dir()))
+    assert "-W 2" in bsub.calls[0]
+
+
+def test_unlisted_job_interrupted_after_grace_period(
+    runner, bjobs, make_job_dir
+):
+    bjobs.set_output(BJOBS_OUTPUT)
+    job = Job("1003", make_job_dir())
+    runner.finished_job_timestamp[job.id] = datetime.now() - timedelta(minutes=2)
+    with mock.patch.object(runner._watcher, "discard") as mock_discard:
+        assert runner.check_status(job) == JobStatus.INTERRUPTED
+    mock_discard.assert_called_once_with(job.cwd)
+    assert job.id not in runner.finished_job_timestamp
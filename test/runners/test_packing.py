@@ -0,0 +1,222 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, RunnerID, SlurmRunner
+from slivka.scheduler.runners._packing import (
+    PackingPolicy,
+    allocation_id,
+    is_pack_member,
+    member_id,
+    pack_script,
+)
+
+
+def run_pack(commands, parallel=1):
+    subprocess.run(
+        ["bash"], input=pack_script(commands, parallel),
+        encoding="ascii", check=True, timeout=30
+    )
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def make():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return make
+
+
+def read_file(directory, name):
+    with open(os.path.join(directory, name)) as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize(
+    "allocation, index, expected",
+    [("1234", 3, "1234+3"), (b"1234", 3, b"1234+3")],
+)
+def test_member_id_round_trip(allocation, index, expected):
+    job_id = member_id(allocation, index)
+    assert job_id == expected
+    assert is_pack_member(job_id)
+    assert allocation_id(job_id) == allocation
+
+
+@pytest.mark.parametrize("job_id", ["1234", "1234[2]", b"1234.2"])
+def test_plain_job_not_pack_member(job_id):
+    assert not is_pack_member(job_id)
+    assert allocation_id(job_id) == job_id
+
+
+@pytest.mark.parametrize(
+    "count, wait_time, expected",
+    [(1, 0, False), (4, 29, False), (5, 0, True), (1, 30, True)],
+)
+def test_packing_policy_ready(count, wait_time, expected):
+    policy = PackingPolicy(size=5, window=30)
+    assert policy.is_ready(count, wait_time) is expected
+
+
+def test_packing_policy_disabled_always_ready():
+    assert PackingPolicy().is_ready(1, 0)
+
+
+def test_packing_policy_split():
+    commands = [Command(["true"], str(i)) for i in range(5)]
+    assert PackingPolicy(size=2).split(commands) == [
+        commands[0:2], commands[2:4], commands[4:5]
+    ]
+
+
+def test_pack_script_runs_commands_in_job_directories(make_job_dir):
+    cwds = [make_job_dir() for _ in range(3)]
+    commands = [
+        Command(["sh", "-c", "echo job%d; exit %d" % (i, i)], cwd)
+        for i, cwd in enumerate(cwds)
+    ]
+    run_pack(commands, parallel=2)
+    for i, cwd in enumerate(cwds):
+        assert os.path.exists(os.path.join(cwd, "started"))
+        assert read_file(cwd, "stdout") == "job%d\n" % i
+        assert read_file(cwd, "finished").strip() == str(i)
+
+
+def test_pack_script_limits_parallel_jobs(make_job_dir):
+    commands = [
+        Command(["sleep", "0.3"], make_job_dir()) for _ in range(4)
+    ]
+    start = time.monotonic()
+    run_pack(commands, parallel=2)
+    assert time.monotonic() - start >= 0.6
+
+
+def test_pack_script_skips_cancelled_job(make_job_dir):
+    cwd = make_job_dir()
+    open(os.path.join(cwd, "cancelled"), "w").close()
+    run_pack([Command(["echo", "hello"], cwd)])
+    assert not os.path.exists(os.path.join(cwd, "started"))
+    assert read_file(cwd, "finished").strip() == "143"
+
+
+@pytest.fixture()
+def sbatch(fake_bin):
+    # runs the submitted script immediately
+    path = fake_bin / "sbatch"
+    path.write_text("#!/bin/sh\nbash >/dev/null 2>&1\necho 42\n")
+    path.chmod(0o755)
+    return path
+
+
+@pytest.fixture()
+def packing_runner(fake_command, sbatch):
+    fake_command("squeue")
+    return SlurmRunner(
+        RunnerID("example", "slurm"),
+        command="sh -c",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        pack_size=2,
+        pack_window=10,
+    )
+
+
+def test_slurm_runner_submits_packs(packing_runner, make_job_dir):
+    commands = [
+        Command(["sh", "-c", "exit %d" % (i % 2)], make_job_dir())
+        for i in range(3)
+    ]
+    jobs = packing_runner.batch_submit(commands)
+    assert [job.id for job in jobs] == ["42+1", "42+2", "42+1"]
+    assert packing_runner.batch_check_status(jobs) == [
+        JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.COMPLETED
+    ]
+
+
+def test_slurm_runner_accounting_skipped_for_packs(
+    packing_runner, fake_command, make_job_dir
+):
+    sacct = fake_command("sacct")
+    job = Job("42+1", make_job_dir())
+    assert packing_runner.check_status(job) == JobStatus.RUNNING
+    assert packing_runner.get_usage(job) is None
+    assert sacct.calls == []
+
+
+def test_slurm_runner_cancels_pack_member_with_marker(
+    packing_runner, fake_command, make_job_dir
+):
+    scancel = fake_command("scancel")
+    job = Job("42+1", make_job_dir())
+    packing_runner.cancel(job)
+    assert os.path.exists(os.path.join(job.cwd, "cancelled"))
+    assert scancel.calls == []
+
+
+def test_slurm_runner_cancels_allocation_with_all_members(
+    packing_runner, fake_command, make_job_dir
+):
+    scancel = fake_command("scancel")
+    jobs = packing_runner.batch_submit(
+        [Command(["true"], make_job_dir()) for _ in range(2)]
+    )
+    packing_runner.batch_cancel(jobs[:1])
+    assert scancel.calls == []
+    packing_runner.batch_cancel(jobs[1:])
+    assert scancel.calls == ["42"]
+
+
+def test_slurm_runner_cancels_allocation_of_finished_members(
+    packing_runner, fake_command, make_job_dir
+):
+    scancel = fake_command("scancel")
+    jobs = packing_runner.batch_submit(
+        [Command(["true"], make_job_dir()) for _ in range(2)]
+    )
+    packing_runner.release_jobs(jobs[:1])
+    packing_runner.batch_cancel(jobs[1:])
+    assert scancel.calls == ["42"]
+
+
+def test_slurm_runner_pack_members_run_within_walltime(
+    fake_command, make_job_dir
+):
+    sbatch = fake_command("sbatch")
+    sbatch.set_output("42\n")
+    fake_command("squeue").set_output("42 R\n")
+    runner = SlurmRunner(
+        RunnerID("example", "slurm"),
+        command="sh -c",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        pack_size=2,
+        walltime=60,
+    )
+    jobs = runner.batch_submit(
+        [Command(["true"], make_job_dir()) for _ in range(2)]
+    )
+    # the allocation fits the members run one after another
+    assert "--time=0-00:02:00" in sbatch.calls[0].split()
+    open(os.path.join(jobs[0].cwd, "started"), "w").close()
+    # the second member is started by the pack after the first one
+    assert runner.batch_check_status(jobs) == [
+        JobStatus.RUNNING, JobStatus.QUEUED
+    ]
+    open(os.path.join(jobs[1].cwd, "started"), "w").close()
+    assert runner.batch_check_status(jobs) == [
+        JobStatus.RUNNING, JobStatus.RUNNING
+    ]
+
+
+def test_slurm_runner_batch_ready_when_pack_full(packing_runner):
+    assert not packing_runner.is_batch_ready(1, 0)
+    assert packing_runner.is_batch_ready(2, 0)
+    assert packing_runner.is_batch_ready(1, 10)
@@ -0,0 +1,118 @@
+import errno
+import logging
+import os
+from unittest import mock
+
+import pytest
+
+from slivka.scheduler.runners._sentinel import (
+    CompletionWatcher, _unescape_mount_point, read_return_code
+)
+
+
+def write_sentinel(path, content):
+    with open(os.path.join(path, "finished"), "w") as fp:
+        fp.write(content)
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def watcher(request):
+    watcher = CompletionWatcher(use_inotify=request.param)
+    if request.param and not watcher.event_driven:
+        pytest.skip("inotify not available")
+    yield watcher
+    watcher.close()
+
+
+@pytest.mark.parametrize(
+    "content, expected", [("0\n", 0), ("127\n", 127), ("", None)]
+)
+def test_read_return_code(tmp_path, content, expected):
+    write_sentinel(tmp_path, content)
+    assert read_return_code(tmp_path) == expected
+
+
+def test_read_return_code_if_missing(tmp_path):
+    assert read_return_code(tmp_path) is None
+
+
+def test_poll_if_not_finished(watcher, tmp_path):
+    assert watcher.poll([str(tmp_path)]) == {}
+
+
+def test_poll_if_finished_before_watched(watcher, tmp_path):
+    write_sentinel(tmp_path, "0\n")
+    assert watcher.poll([str(tmp_path)]) == {str(tmp_path): 0}
+
+
+def test_poll_if_finished_after_watched(watcher, tmp_path):
+    assert watcher.poll([str(tmp_path)]) == {}
+    write_sentinel(tmp_path, "1\n")
+    assert watcher.poll([str(tmp_path)]) == {str(tmp_path): 1}
+
+
+def test_poll_if_not_probed(watcher, tmp_path):
+    paths = [tmp_path / "a", tmp_path / "b"]
+    for path in paths:
+        path.mkdir()
+        write_sentinel(path, "0\n")
+    result = watcher.poll(map(str, paths), probe=[str(paths[0])])
+    if watcher.event_driven:
+        assert result == {str(paths[0]): 0, str(paths[1]): 0}
+    else:
+        assert result == {str(paths[0]): 0}
+
+
+def test_watched_directory_not_read_repeatedly(tmp_path):
+    watcher = CompletionWatcher()
+    if not watcher.event_driven:
+        pytest.skip("inotify not available")
+    watcher.poll([str(tmp_path)])
+    with mock.patch(
+        "slivka.scheduler.runners._sentinel.read_return_code"
+    ) as mock_read:
+        for _ in range(3):
+            assert watcher.poll([str(tmp_path)]) == {}
+    mock_read.assert_not_called()
+    watcher.close()
+
+
+def test_discard_forgets_return_code(watcher, tmp_path):
+    write_sentinel(tmp_path, "0\n")
+    watcher.poll([str(tmp_path)])
+    watcher.discard(str(tmp_path))
+    os.unlink(tmp_path / "finished")
+    assert watcher.poll([str(tmp_path)]) == {}
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (b"/mnt/data", "/mnt/data"),
+        (b"/mnt/my\\040disk", "/mnt/my disk"),
+        (b"/mnt/back\\134slash", "/mnt/back\\slash"),
+        ("/mnt/dane/żółw".encode(), "/mnt/dane/żółw"),
+    ],
+)
+def test_mount_point_unescaped(value, expected):
+    assert _unescape_mount_point(value) == expected
+
+
+def test_watch_limit_warned_once(tmp_path, caplog):
+    watcher = CompletionWatcher()
+    if not watcher.event_driven:
+        pytest.skip("inotify not available")
+    paths = [tmp_path / str(i) for i in range(3)]
+    for path in paths:
+        path.mkdir()
+    write_sentinel(paths[0], "0\n")
+    libc = mock.Mock(wraps=watcher._libc)
+    libc.inotify_add_watch.return_value = -1
+    with mock.patch.object(watcher, "_libc", libc), \
+            mock.patch("ctypes.get_errno", return_value=errno.ENOSPC), \
+            caplog.at_level(logging.WARNING):
+        for _ in range(3):
+            assert watcher.poll(map(str, paths)) == {str(paths[0]): 0}
+    assert libc.inotify_add_watch.call_count == 9
+    assert len(caplog.records) == 1
+    watcher.close()
@@ -0,0 +1,217 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, RunnerID, ShellRunner
+from slivka.scheduler.runners._reaper import ProcessReaper
+
+
+def wait_for_status(runner, job, statuses, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = runner.check_status(job)
+        if status in statuses or time.monotonic() > deadline:
+            return status
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def factory():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return factory
+
+
+def create_runner(**kwargs):
+    return ShellRunner(
+        RunnerID("example", "shell"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        **kwargs
+    )
+
+
+def sleep_command(cwd, seconds):
+    return Command([sys.executable, "-c", f"import time; time.sleep({seconds})"], cwd)
+
+
+@pytest.mark.parametrize(
+    "script, expected_status",
+    [
+        ("pass", JobStatus.COMPLETED),
+        ("raise SystemExit(1)", JobStatus.FAILED),
+        ("raise SystemExit(127)", JobStatus.ERROR),
+        ("import os; os.kill(os.getpid(), 9)", JobStatus.INTERRUPTED),
+    ],
+)
+def test_job_status(make_job_dir, script, expected_status):
+    runner = create_runner()
+    job = runner.submit(Command([sys.executable, "-c", script], make_job_dir()))
+    status = wait_for_status(runner, job, [expected_status])
+    assert status == expected_status
+
+
+def test_return_code_written_to_finished_file(make_job_dir):
+    runner = create_runner()
+    job = runner.submit(Command([sys.executable, "-c", "exit(3)"], make_job_dir()))
+    wait_for_status(runner, job, [JobStatus.FAILED])
+    with open(os.path.join(job.cwd, "finished")) as fp:
+        assert fp.read() == "3\n"
+
+
+def test_finished_job_status_read_by_new_runner(make_job_dir):
+    runner = create_runner()
+    job = runner.submit(Command([sys.executable, "-c", "exit(1)"], make_job_dir()))
+    wait_for_status(runner, job, [JobStatus.FAILED])
+    assert create_runner().check_status(job) == JobStatus.FAILED
+
+
+def test_jobs_over_limit_queued(make_job_dir):
+    runner = create_runner(max_jobs=1)
+    first = runner.submit(sleep_command(make_job_dir(), 0.3))
+    second = runner.submit(sleep_command(make_job_dir(), 0))
+    assert runner.check_status(first) == JobStatus.RUNNING
+    assert runner.check_status(second) == JobStatus.QUEUED
+    assert wait_for_status(runner, second, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    assert runner.check_status(first) == JobStatus.COMPLETED
+
+
+@pytest.mark.parametrize(
+    "limits, expected_slots",
+    [
+        ({}, None),
+        ({"max_jobs": 3}, 3),
+        ({"cpus": 8, "job_cpus": 2}, 4),
+        ({"memory": "16G", "job_memory": "3G"}, 5),
+        ({"max_jobs": 10, "cpus": 8, "memory": 2048, "job_memory": "1G"}, 2),
+    ],
+)
+def test_slots_computed_from_limits(limits, expected_slots):
+    assert create_runner(**limits).slots == expected_slots
+
+
+def test_job_exceeding_budget_rejected():
+    with pytest.raises(ValueError):
+        create_runner(cpus=2, job_cpus=4)
+
+
+def test_cancel_queued_job(make_job_dir):
+    runner = create_runner(max_jobs=1)
+    first = runner.submit(sleep_command(make_job_dir(), 0.2))
+    second = runner.submit(sleep_command(make_job_dir(), 0))
+    runner.cancel(second)
+    assert runner.check_status(second) == JobStatus.INTERRUPTED
+    wait_for_status(runner, first, [JobStatus.COMPLETED])
+    assert not os.path.exists(os.path.join(second.cwd, "stdout"))
+
+
+def test_cancel_running_job(make_job_dir):
+    runner = create_runner()
+    job = runner.submit(sleep_command(make_job_dir(), 10))
+    runner.cancel(job)
+    assert wait_for_status(runner, job, [JobStatus.INTERRUPTED]) == \
+        JobStatus.INTERRUPTED
+
+
+def test_command_run_by_wrapper_script(make_job_dir):
+    runner = create_runner()
+    job = runner.submit(Command(["echo", "hello world"], make_job_dir()))
+    wait_for_status(runner, job, [JobStatus.COMPLETED])
+    with open(os.path.join(job.cwd, "stdout")) as fp:
+        assert fp.read() == "hello world\n"
+    with open(os.path.join(job.cwd, "process")) as fp:
+        assert int(fp.read().split()[0]) > 0
+
+
+def test_running_job_recovered_by_new_runner(make_job_dir):
+    job = create_runner().submit(sleep_command(make_job_dir(), 0.3))
+    runner = create_runner()
+    assert runner.check_status(job) == JobStatus.RUNNING
+    assert wait_for_status(runner, job, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+
+
+def test_recovered_job_cancelled(make_job_dir):
+    job = create_runner().submit(sleep_command(make_job_dir(), 10))
+    runner = create_runner()
+    runner.cancel(job)
+    assert wait_for_status(runner, job, [JobStatus.INTERRUPTED]) == \
+        JobStatus.INTERRUPTED
+
+
+def test_queued_job_recovered_by_new_runner(make_job_dir):
+    old_runner = create_runner(max_jobs=1)
+    first = old_runner.submit(sleep_command(make_job_dir(), 0.3))
+    second = old_runner.submit(sleep_command(make_job_dir(), 0))
+    old_runner._queue.clear()  # the old scheduler process is gone
+    runner = create_runner(max_jobs=1)
+    assert runner.check_status(first) == JobStatus.RUNNING
+    assert runner.check_status(second) == JobStatus.QUEUED
+    assert wait_for_status(runner, second, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+
+
+def test_job_interrupted_if_process_lost(make_job_dir):
+    cwd = make_job_dir()
+    with open(os.path.join(cwd, "process"), "w") as fp:
+        fp.write("%d 0\n" % os.getpid())
+    job = Job("lost", cwd)
+    assert create_runner().check_status(job) == JobStatus.INTERRUPTED
+
+
+@pytest.mark.parametrize("use_pidfd", [True, False], ids=["pidfd", "threads"])
+def test_reaper_notifies_exit(use_pidfd):
+    reaper = ProcessReaper(use_pidfd=use_pidfd)
+    if use_pidfd and not reaper.event_driven:
+        pytest.skip("pidfd not available")
+    exited = threading.Event()
+    result = []
+
+    def callback(proc, return_code, rusage):
+        result.append((return_code, proc.returncode))
+        usage.append(rusage)
+        exited.set()
+
+    usage = []
+    proc = subprocess.Popen([sys.executable, "-c", "exit(5)"])
+    reaper.watch(proc, callback)
+    assert exited.wait(5)
+    assert result == [(5, 5)]
+    assert usage[0].ru_maxrss > 0
+    reaper.close()
+
+
+def test_finished_job_usage(make_job_dir):
+    runner = create_runner()
+    job = runner.submit(sleep_command(make_job_dir(), 0.2))
+    assert wait_for_status(runner, job, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    usage = runner.get_usage(job)
+    assert usage.queue_time >= 0
+    assert usage.wall_time >= 0.2
+    assert usage.cpu_time > 0
+    assert usage.max_rss > 0
+    # the usage is handed over only once
+    assert runner.get_usage(job) is None
+
+
+def test_queued_job_usage_includes_queue_time(make_job_dir):
+    runner = create_runner(max_jobs=1)
+    first = runner.submit(sleep_command(make_job_dir(), 0.2))
+    second = runner.submit(sleep_command(make_job_dir(), 0))
+    statuses = runner.batch_check_status([first, second])
+    assert statuses == [JobStatus.RUNNING, JobStatus.QUEUED]
+    assert wait_for_status(runner, second, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    assert runner.get_usage(second).queue_time >= 0.15
@@ -0,0 +1,155 @@
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, RunnerID, SlurmRestRunner
+from slivka.scheduler.runners.slurm_rest import SlurmRestError, _version_info
+from test.runners.fake_slurmrestd import FakeSlurmRestd
+
+
+@pytest.fixture()
+def slurmrestd():
+    server = FakeSlurmRestd(token="secret").start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def factory():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return factory
+
+
+@pytest.fixture()
+def runner(slurmrestd):
+    runner = SlurmRestRunner(
+        RunnerID("example", "slurm-rest"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        url=slurmrestd.url,
+        token="secret",
+        user="slivka",
+        job_properties={"partition": "short"},
+    )
+    yield runner
+    runner._pool.close()
+
+
+def test_submit_single_job(runner, slurmrestd, make_job_dir):
+    cwd = make_job_dir()
+    job = runner.submit(Command(["echo", "hello"], cwd))
+    assert job == Job("1001", cwd)
+    description = slurmrestd.submissions[0]["job"]
+    assert description["current_working_directory"] == cwd
+    assert description["standard_output"] == os.path.join(cwd, "stdout")
+    assert description["partition"] == "short"
+    assert "echo hello" in slurmrestd.submissions[0]["script"]
+
+
+def test_batch_submitted_as_array_job(runner, slurmrestd, make_job_dir):
+    commands = [Command(["echo", str(i)], make_job_dir()) for i in range(3)]
+    jobs = runner.batch_submit(commands)
+    assert jobs == [Job("1001_%d" % i, cmd.cwd)
+                    for i, cmd in enumerate(commands, 1)]
+    assert len(slurmrestd.submissions) == 1
+    assert slurmrestd.submissions[0]["job"]["array"] == "1-3"
+
+
+def test_array_task_states(runner, slurmrestd, make_job_dir):
+    commands = [Command(["echo", str(i)], make_job_dir()) for i in range(3)]
+    jobs = runner.batch_submit(commands)
+    slurmrestd.set_state("1001_2", "RUNNING")
+    assert runner.batch_check_status(jobs) == [
+        JobStatus.QUEUED, JobStatus.RUNNING, JobStatus.QUEUED
+    ]
+
+
+def test_states_fetched_in_single_request(runner, slurmrestd, make_job_dir):
+    jobs = [runner.submit(Command(["echo"], make_job_dir())) for _ in range(5)]
+    slurmrestd.requests.clear()
+    runner.batch_check_status(jobs)
+    assert slurmrestd.requests == [
+        ("GET", "/slurm/v0.0.40/job/1001,1002,1003,1004,1005")
+    ]
+
+
+def test_states_fetched_for_tracked_jobs_only(
+    runner, slurmrestd, make_job_dir
+):
+    commands = [Command(["echo", str(i)], make_job_dir()) for i in range(2)]
+    jobs = runner.batch_submit(commands)
+    other = runner.submit(Command(["echo"], make_job_dir()))
+    slurmrestd.set_state(other.id, "RUNNING")
+    slurmrestd.requests.clear()
+    assert runner.batch_check_status(jobs) == [JobStatus.QUEUED] * 2
+    assert slurmrestd.requests == [("GET", "/slurm/v0.0.40/job/1001")]
+
+
+def test_connections_reused(runner, slurmrestd, make_job_dir):
+    for _ in range(5):
+        runner.submit(Command(["echo"], make_job_dir()))
+    assert slurmrestd.connections == 1
+
+
+def test_finished_job_read_from_sentinel(runner, slurmrestd, make_job_dir):
+    job = runner.submit(Command(["false"], make_job_dir()))
+    slurmrestd.set_state(job.id, "COMPLETED")
+    with open(os.path.join(job.cwd, "finished"), "w") as fp:
+        fp.write("1\n")
+    assert runner.check_status(job) == JobStatus.FAILED
+
+
+def test_cancel(runner, slurmrestd, make_job_dir):
+    job = runner.submit(Command(["echo"], make_job_dir()))
+    runner.cancel(job)
+    assert slurmrestd.jobs[job.id]["job_state"] == ["CANCELLED"]
+    assert runner.check_status(job) == JobStatus.INTERRUPTED
+
+
+def test_invalid_token_rejected(slurmrestd, make_job_dir):
+    runner = SlurmRestRunner(
+        RunnerID("example", "slurm-rest"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        url=slurmrestd.url,
+        token="invalid",
+    )
+    with pytest.raises(SlurmRestError):
+        runner.submit(Command(["echo"], make_job_dir()))
+
+
+def test_unlisted_job_interrupted_after_grace_period(
+    runner, slurmrestd, make_job_dir
+):
+    job = Job("1999", make_job_dir())
+    runner.finished_job_timestamp[job.id] = datetime.now() - timedelta(minutes=2)
+    with mock.patch.object(runner._watcher, "discard") as mock_discard:
+        assert runner.check_status(job) == JobStatus.INTERRUPTED
+    mock_discard.assert_called_once_with(job.cwd)
+    assert job.id not in runner.finished_job_timestamp
+
+
+@pytest.mark.parametrize(
+    "version, expected",
+    [("v0.0.39", False), ("v0.0.40", True), ("v0.0.100", True),
+     ("v1.0", True)],
+)
+def test_time_limit_format_follows_api_version(
+    runner, make_job_dir, version, expected
+):
+    runner.walltime = 90
+    runner._version_info = _version_info(version)
+    time_limit = runner._job_description(make_job_dir())["time_limit"]
+    assert isinstance(time_limit, dict) is expected
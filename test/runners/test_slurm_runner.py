@@ -0,0 +1,210 @@
+import os
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import (
+    Command, Job, ResourceUsage, RunnerID, SlurmRunner
+)
+
+
+@pytest.fixture()
+def squeue(fake_command):
+    return fake_command("squeue")
+
+
+@pytest.fixture()
+def sacct(fake_command):
+    return fake_command("sacct")
+
+
+@pytest.fixture()
+def runner():
+    return SlurmRunner(
+        RunnerID("example", "slurm"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+    )
+
+
+@pytest.fixture()
+def job(job_directory):
+    os.makedirs(job_directory)
+    return Job("1001", job_directory)
+
+
+@pytest.mark.parametrize(
+    "accounting_line, expected_status",
+    [
+        ("1001|COMPLETED|0:0", JobStatus.COMPLETED),
+        ("1001|FAILED|1:0", JobStatus.FAILED),
+        ("1001|FAILED|127:0", JobStatus.ERROR),
+        ("1001|FAILED|137:0", JobStatus.INTERRUPTED),
+        ("1001|CANCELLED by 1000|0:15", JobStatus.INTERRUPTED),
+        ("1001|TIMEOUT|0:0", JobStatus.INTERRUPTED),
+        ("1001|OUT_OF_MEMORY|0:125", JobStatus.ERROR),
+        ("1001|NODE_FAIL|0:0", JobStatus.ERROR),
+        ("1001|RUNNING|0:0", JobStatus.RUNNING),
+    ],
+)
+def test_status_resolved_from_accounting(
+    runner, squeue, sacct, job, accounting_line, expected_status
+):
+    sacct.set_output(accounting_line + "\n")
+    assert runner.check_status(job) == expected_status
+
+
+def test_accounting_queried_for_jobs_missing_from_queue(
+    runner, squeue, sacct, job_directory_factory
+):
+    jobs = [Job("1001", job_directory_factory()),
+            Job("1002", job_directory_factory())]
+    squeue.set_output("1001 R\n")
+    sacct.set_output("1002|COMPLETED|0:0\n")
+    statuses = runner.batch_check_status(jobs)
+    assert statuses == [JobStatus.RUNNING, JobStatus.COMPLETED]
+    assert len(sacct.calls) == 1
+    assert "--jobs=1002" in sacct.calls[0].split()
+
+
+def test_accounting_not_queried_if_all_jobs_queued(runner, squeue, sacct, job):
+    squeue.set_output("1001 PD\n")
+    assert runner.check_status(job) == JobStatus.QUEUED
+    assert sacct.calls == []
+
+
+def test_sentinel_used_if_accounting_fails(runner, squeue, sacct, job):
+    sacct.set_output("", return_code=1)
+    with open(os.path.join(job.cwd, "finished"), "w") as fp:
+        fp.write("1\n")
+    assert runner.check_status(job) == JobStatus.FAILED
+
+
+def test_job_running_if_accounting_fails_and_no_sentinel(
+    runner, squeue, sacct, job
+):
+    sacct.set_output("", return_code=1)
+    assert runner.check_status(job) == JobStatus.RUNNING
+
+
+def test_accounting_not_used_if_disabled(squeue, sacct, job):
+    runner = SlurmRunner(
+        RunnerID("example", "slurm"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        use_accounting="false",
+    )
+    sacct.set_output("1001|COMPLETED|0:0\n")
+    assert runner.check_status(job) == JobStatus.RUNNING
+    assert sacct.calls == []
+
+
+def test_queue_queried_for_tracked_jobs_only(
+    runner, squeue, sacct, job_directory_factory
+):
+    jobs = [Job("1001", job_directory_factory()),
+            Job("1002_3", job_directory_factory())]
+    squeue.set_output("1001 R\n1002_3 PD\n")
+    statuses = runner.batch_check_status(jobs)
+    assert statuses == [JobStatus.RUNNING, JobStatus.QUEUED]
+    assert len(squeue.calls) == 1
+    assert "--jobs=1001,1002_3" in squeue.calls[0].split()
+
+
+def test_queue_query_split_into_chunks(
+    runner, squeue, sacct, job_directory_factory
+):
+    runner._status_cache.chunk_size = 2
+    jobs = [Job(str(1001 + i), job_directory_factory()) for i in range(5)]
+    squeue.set_output("".join("%s R\n" % job.id for job in jobs))
+    assert runner.batch_check_status(jobs) == [JobStatus.RUNNING] * 5
+    assert len(squeue.calls) == 3
+
+
+def test_queue_status_cached(runner, squeue, sacct, job):
+    squeue.set_output("1001 R\n")
+    runner.check_status(job)
+    runner.check_status(job)
+    assert len(squeue.calls) == 1
+
+
+def test_queue_unknown_job_error_ignored(runner, squeue, sacct, job):
+    squeue.set_output(
+        "slurm_load_jobs error: Invalid job id specified\n", return_code=1
+    )
+    sacct.set_output("1001|COMPLETED|0:0\n")
+    assert runner.check_status(job) == JobStatus.COMPLETED
+
+
+def test_queue_error_raised(runner, squeue, sacct, job):
+    squeue.set_output(
+        "slurm_load_jobs error: Unable to contact slurm controller\n",
+        return_code=1
+    )
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.check_status(job)
+
+
+def test_usage_read_from_accounting(runner, sacct, job):
+    sacct.set_output(
+        "1001|2023-06-18T10:00:00|2023-06-18T10:00:30|125|01:02.500|\n"
+        "1001.batch|2023-06-18T10:00:30|2023-06-18T10:00:30|125|01:02.400|2048K\n"
+        "1001.0|2023-06-18T10:00:31|2023-06-18T10:00:31|120|00:00.100|3M\n"
+    )
+    (usage,) = runner.batch_get_usage([job])
+    assert usage == ResourceUsage(
+        queue_time=30, wall_time=125, cpu_time=62.5, max_rss=3072
+    )
+
+
+def test_usage_of_unaccounted_job_is_none(runner, sacct, job):
+    assert runner.batch_get_usage([job]) == [None]
+
+
+def test_usage_none_if_accounting_fails(runner, sacct, job):
+    sacct.set_output("", return_code=1)
+    assert runner.batch_get_usage([job]) == [None]
+
+
+@pytest.mark.parametrize(
+    "walltime, expected",
+    [(600, "--time=0-00:10:00"), ("1-02:00:30", "--time=1-02:01:00")],
+)
+def test_walltime_passed_as_time_limit(fake_command, job, walltime, expected):
+    sbatch = fake_command("sbatch")
+    sbatch.set_output("1001\n")
+    runner = SlurmRunner(
+        RunnerID("example", "slurm"),
+        command="example",
+        args=[],
+        consts={},
+        outputs=[],
+        env={},
+        walltime=walltime,
+    )
+    runner.submit(Command(["true"], job.cwd))
+    assert expected in sbatch.calls[0].split()
+
+
+@pytest.mark.parametrize(
+    "sentinel, expected_status",
+    [(None, JobStatus.INTERRUPTED), ("0\n", JobStatus.COMPLETED)],
+)
+def test_lagging_accounting_falls_back_after_grace_period(
+    runner, squeue, sacct, job, sentinel, expected_status
+):
+    sacct.set_output("1001|RUNNING|0:0\n")
+    if sentinel is not None:
+        with open(os.path.join(job.cwd, "finished"), "w") as fp:
+            fp.write(sentinel)
+    runner.finished_job_timestamp[job.id] = datetime.now() - timedelta(minutes=2)
+    assert runner.check_status(job) == expected_status
+    assert job.id not in runner.finished_job_timestamp
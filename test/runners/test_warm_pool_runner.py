@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+
+import pytest
+
+from slivka import JobStatus
+from slivka.scheduler.runners import Command, Job, RunnerID, WarmPoolRunner
+from slivka.scheduler.runners.warm_pool import _parse_command, _Target
+
+SCRIPT = """\
+import os
+import sys
+import time
+
+with open(os.path.join(os.path.dirname(__file__), "imports.log"), "a") as fp:
+    fp.write("%d\\n" % os.getpid())
+
+
+def main():
+    print(" ".join(sys.argv[1:]))
+    with open("pid", "w") as fp:
+        fp.write(str(os.getpid()))
+    action = sys.argv[1] if len(sys.argv) > 1 else ""
+    if action == "exit":
+        sys.exit(int(sys.argv[2]))
+    if action == "return":
+        return int(sys.argv[2])
+    if action == "raise":
+        raise RuntimeError("boom")
+    if action == "sleep":
+        time.sleep(float(sys.argv[2]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+"""
+
+
+def wait_for_status(runner, job, statuses, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = runner.check_status(job)
+        if status in statuses or time.monotonic() > deadline:
+            return status
+        time.sleep(0.01)
+
+
+def read_file(cwd, name):
+    with open(os.path.join(cwd, name)) as fp:
+        return fp.read()
+
+
+@pytest.fixture()
+def make_job_dir(job_directory_factory):
+    def factory():
+        path = job_directory_factory()
+        os.makedirs(path)
+        return path
+    return factory
+
+
+@pytest.fixture()
+def script(tmp_path):
+    path = tmp_path / "tool.py"
+    path.write_text(SCRIPT)
+    return path
+
+
+@pytest.fixture()
+def create_runner(script):
+    runners = []
+
+    def factory(**kwargs):
+        kwargs.setdefault("entry", "main")
+        runner = WarmPoolRunner(
+            RunnerID("example", "warm"),
+            command=[sys.executable, str(script)],
+            args=[],
+            consts={},
+            outputs=[],
+            env={},
+            **kwargs
+        )
+        runners.append(runner)
+        return runner
+
+    yield factory
+    for runner in runners:
+        runner.close()
+
+
+def submit(runner, cwd, *args):
+    return runner.submit(Command(runner.command + list(args), cwd))
+
+
+@pytest.mark.parametrize(
+    "command, expected",
+    [
+        (["python3", "-u", "tool.py", "-x"], (_Target(script="tool.py"), 3)),
+        (["python", "-m", "pkg.tool"], (_Target(module="pkg.tool"), 3)),
+        (["/opt/bin/tool.py"], (_Target(script="/opt/bin/tool.py"), 1)),
+    ],
+)
+def test_parse_command(command, expected):
+    assert _parse_command(command) == expected
+
+
+def test_parse_command_without_script():
+    with pytest.raises(ValueError):
+        _parse_command(["python3", "-u"])
+
+
+def test_job_output_written_to_job_directory(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    cwd = make_job_dir()
+    job = submit(runner, cwd, "hello", "world")
+    assert wait_for_status(runner, job, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    assert read_file(cwd, "stdout") == "hello world\n"
+    assert read_file(cwd, "finished").strip() == "0"
+    assert os.path.exists(os.path.join(cwd, "started"))
+
+
+@pytest.mark.parametrize(
+    "args, expected_status",
+    [
+        (["exit", "1"], JobStatus.FAILED),
+        (["exit", "127"], JobStatus.ERROR),
+        (["return", "3"], JobStatus.FAILED),
+        (["raise"], JobStatus.FAILED),
+    ],
+)
+def test_job_status(create_runner, make_job_dir, args, expected_status):
+    runner = create_runner(workers=1)
+    job = submit(runner, make_job_dir(), *args)
+    assert wait_for_status(runner, job, [expected_status]) == expected_status
+
+
+def test_exception_traceback_written_to_stderr(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    cwd = make_job_dir()
+    job = submit(runner, cwd, "raise")
+    wait_for_status(runner, job, [JobStatus.FAILED])
+    assert "RuntimeError: boom" in read_file(cwd, "stderr")
+
+
+def test_worker_reused_and_script_imported_once(
+    create_runner, make_job_dir, tmp_path
+):
+    runner = create_runner(workers=1)
+    cwds = [make_job_dir() for _ in range(3)]
+    jobs = [submit(runner, cwd) for cwd in cwds]
+    for job in jobs:
+        assert wait_for_status(runner, job, [JobStatus.COMPLETED]) == \
+            JobStatus.COMPLETED
+    pids = {read_file(cwd, "pid") for cwd in cwds}
+    assert len(pids) == 1
+    assert (tmp_path / "imports.log").read_text().split() == list(pids)
+
+
+def test_worker_recycled_after_max_jobs(create_runner, make_job_dir):
+    runner = create_runner(workers=1, max_jobs_per_worker=2)
+    cwds = [make_job_dir() for _ in range(3)]
+    jobs = [submit(runner, cwd) for cwd in cwds]
+    for job in jobs:
+        wait_for_status(runner, job, [JobStatus.COMPLETED])
+    pids = [read_file(cwd, "pid") for cwd in cwds]
+    assert pids[0] == pids[1] != pids[2]
+
+
+def test_worker_recycled_after_exception(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    cwds = [make_job_dir() for _ in range(2)]
+    jobs = [submit(runner, cwds[0], "raise"), submit(runner, cwds[1])]
+    wait_for_status(runner, jobs[0], [JobStatus.FAILED])
+    wait_for_status(runner, jobs[1], [JobStatus.COMPLETED])
+    assert read_file(cwds[0], "pid") != read_file(cwds[1], "pid")
+
+
+def test_script_without_entry_run_as_main(create_runner, make_job_dir):
+    runner = create_runner(workers=1, entry=None)
+    cwd = make_job_dir()
+    job = submit(runner, cwd, "exit", "4")
+    assert wait_for_status(runner, job, [JobStatus.FAILED]) == JobStatus.FAILED
+    assert read_file(cwd, "finished").strip() == "4"
+
+
+def test_jobs_queued_until_worker_free(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    first = submit(runner, make_job_dir(), "sleep", "0.5")
+    second = submit(runner, make_job_dir())
+    assert wait_for_status(runner, first, [JobStatus.RUNNING]) == \
+        JobStatus.RUNNING
+    assert runner.check_status(second) == JobStatus.QUEUED
+    assert wait_for_status(runner, second, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+
+
+def test_cancel_running_job(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    job = submit(runner, make_job_dir(), "sleep", "30")
+    wait_for_status(runner, job, [JobStatus.RUNNING])
+    runner.cancel(job)
+    assert wait_for_status(runner, job, [JobStatus.INTERRUPTED]) == \
+        JobStatus.INTERRUPTED
+    # the pool recovers from the killed worker
+    other = submit(runner, make_job_dir())
+    assert wait_for_status(runner, other, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+
+
+def test_cancel_queued_job(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    submit(runner, make_job_dir(), "sleep", "0.5")
+    job = submit(runner, make_job_dir())
+    runner.cancel(job)
+    assert runner.check_status(job) == JobStatus.INTERRUPTED
+    assert read_file(job.cwd, "finished").strip() == "-15"
+
+
+def test_usage_measured(create_runner, make_job_dir):
+    runner = create_runner(workers=1)
+    job = submit(runner, make_job_dir(), "sleep", "0.2")
+    wait_for_status(runner, job, [JobStatus.COMPLETED])
+    usage = runner.get_usage(job)
+    assert usage.wall_time >= 0.2
+    assert usage.queue_time >= 0
+    assert usage.max_rss > 0
+
+
+def test_startup_failure_fails_job(create_runner, make_job_dir):
+    runner = create_runner(workers=1, preload=["nonexistent_module_xyz"])
+    cwd = make_job_dir()
+    job = submit(runner, cwd)
+    assert wait_for_status(runner, job, [JobStatus.ERROR]) == JobStatus.ERROR
+    assert "nonexistent_module_xyz" in read_file(cwd, "stderr")
+
+
+def test_queued_job_recovered_after_restart(create_runner, make_job_dir):
+    cwd = make_job_dir()
+    with open(os.path.join(cwd, "args.json"), "w") as fp:
+        fp.write('["recovered"]')
+    runner = create_runner(workers=1)
+    job = Job("deadbeef", cwd)
+    assert wait_for_status(runner, job, [JobStatus.COMPLETED]) == \
+        JobStatus.COMPLETED
+    assert read_file(cwd, "stdout") == "recovered\n"
+
+
+def test_started_job_interrupted_after_restart(create_runner, make_job_dir):
+    cwd = make_job_dir()
+    with open(os.path.join(cwd, "args.json"), "w") as fp:
+        fp.write("[]")
+    open(os.path.join(cwd, "started"), "w").close()
+    runner = create_runner(workers=1)
+    assert runner.check_status(Job("deadbeef", cwd)) == JobStatus.INTERRUPTED
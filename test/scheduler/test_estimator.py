@@ -0,0 +1,134 @@
+import math
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from slivka import JobStatus
+from slivka.db.documents import JobRequest
+from slivka.db.helpers import delete_many, insert_many
+from slivka.scheduler.estimator import RuntimeEstimator, extract_features
+from slivka.scheduler.runners import RunnerID
+
+
+def completed(inputs, wall_time, queue_time=None, service="example"):
+    return JobRequest(
+        service=service,
+        inputs=inputs,
+        status=JobStatus.COMPLETED,
+        usage={"queue_time": queue_time, "wall_time": wall_time},
+    )
+
+
+def test_features_of_numbers_and_files(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"x" * 99)
+    features = extract_features({
+        "count": "9",
+        "file": str(path),
+        "files": [str(path), str(path)],
+        "flag": True,
+        "text": "hello",
+        "missing": None,
+    })
+    assert features == pytest.approx({
+        "count": math.log(10),
+        "file": math.log(100),
+        "files": 2 * math.log(100),
+        "flag": 1.0,
+    })
+
+
+def test_file_size_read_once(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"x" * 99)
+    with mock.patch("os.path.getsize", wraps=os.path.getsize) as getsize:
+        extract_features({"file": str(path)})
+        extract_features({"files": [str(path), str(path)]})
+    assert getsize.call_count == 1
+
+
+def test_no_estimate_without_history():
+    estimator = RuntimeEstimator()
+    assert estimator.estimate_runtime("example", {"size": "10"}) is None
+
+
+def test_runtime_grows_with_input_size():
+    estimator = RuntimeEstimator(ridge=0.01)
+    for size in (10, 100, 1000, 10000, 100000):
+        # run time proportional to the size
+        estimator.observe(completed({"size": str(size)}, size / 10))
+    short = estimator.estimate_runtime("example", {"size": "50"})
+    long = estimator.estimate_runtime("example", {"size": "50000"})
+    assert short == pytest.approx(5, rel=0.5)
+    assert long == pytest.approx(5000, rel=0.5)
+
+
+def test_failed_jobs_not_learned():
+    estimator = RuntimeEstimator(min_samples=1)
+    request = completed({}, 100)
+    request.status = JobStatus.FAILED
+    estimator.observe(request)
+    assert estimator.estimate_runtime("example", {}) is None
+
+
+def completed_at(seconds_ago, queue_time=None):
+    request = completed({}, 1, queue_time)
+    request.completion_time = datetime.now() - timedelta(seconds=seconds_ago)
+    return request
+
+
+def test_queue_wait_from_throughput():
+    estimator = RuntimeEstimator()
+    runner_id = RunnerID("example", "default")
+    # observed together, one job finishing every 10 seconds
+    for seconds_ago in (20, 0, 10):
+        estimator.observe(completed_at(seconds_ago), runner_id)
+    estimator.set_queued(runner_id, 6)
+    assert estimator.estimate_wait(runner_id) == pytest.approx(60, rel=1e-3)
+
+
+def test_old_completions_ignored():
+    estimator = RuntimeEstimator(max_age=3600)
+    runner_id = RunnerID("example", "default")
+    for seconds_ago in (7200, 7000, 60):
+        estimator.observe(completed_at(seconds_ago, queue_time=30), runner_id)
+    estimator.set_queued(runner_id, 6)
+    assert estimator.estimate_wait(runner_id) == 30
+    estimator.observe(completed_at(30), runner_id)
+    assert estimator.estimate_wait(runner_id) == pytest.approx(6 * 30, rel=1e-3)
+
+
+def test_queue_wait_falls_back_to_observed_queue_times():
+    estimator = RuntimeEstimator()
+    runner_id = RunnerID("example", "default")
+    estimator.observe(completed({}, 1, queue_time=30), runner_id)
+    assert estimator.estimate_wait(runner_id) == 30
+    assert estimator.estimate_wait(RunnerID("example", "other")) is None
+
+
+def test_history_loaded_from_database(database):
+    requests = [completed({"size": str(n)}, n) for n in range(1, 8)]
+    insert_many(database, requests)
+    try:
+        estimator = RuntimeEstimator()
+        estimator.load_history(database)
+        assert estimator.estimate_runtime("example", {"size": "4"}) == \
+            pytest.approx(4, rel=0.5)
+    finally:
+        delete_many(database, requests)
+
+
+def test_history_loaded_from_archive(database):
+    requests = [completed({"size": str(n)}, n) for n in range(1, 8)]
+    insert_many(database, requests[:2])
+    JobRequest.archive_collection(database).insert_many(requests[2:])
+    try:
+        estimator = RuntimeEstimator()
+        with mock.patch.object(estimator, "observe") as mock_observe:
+            estimator.load_history(database, limit=5)
+        assert mock_observe.call_count == 5
+    finally:
+        delete_many(database, requests[:2])
+        JobRequest.archive_collection(database).delete_many({})
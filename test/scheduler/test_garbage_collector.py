@@ -0,0 +1,326 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+import yaml
+from bson import ObjectId
+
+from slivka import JobStatus
+from slivka.compat.resources import open_text
+from slivka.conf.loaders import load_settings_0_3
+from slivka.db.documents import JobRequest, UploadedFile
+from slivka.db.helpers import insert_many
+from slivka.scheduler.factory import garbage_collector_from_config
+from slivka.scheduler.garbage_collector import GarbageCollector
+from slivka.utils.path import request_id_to_job_path
+
+NOW = datetime(2024, 3, 1, 12, 0)
+
+SERVICE_CONFIG = """\
+slivka-version: "0.8"
+name: Example
+parameters: {}
+command: example
+args: {}
+outputs: {}
+execution:
+  runners:
+    default:
+      type: ShellRunner
+retention: 1h
+"""
+
+
+@pytest.fixture()
+def jobs_dir(tmp_path):
+    path = tmp_path / "jobs"
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture()
+def uploads_dir(tmp_path):
+    path = tmp_path / "uploads"
+    path.mkdir()
+    return path
+
+
+def create_request(jobs_dir, service="example", status=JobStatus.COMPLETED,
+                   completed=None, inputs=None, timestamp=None):
+    request = JobRequest(
+        _id=ObjectId(),
+        service=service,
+        inputs=inputs or {},
+        timestamp=timestamp or NOW - timedelta(days=30),
+        status=status,
+        completion_time=completed,
+    )
+    path = request_id_to_job_path(jobs_dir, request.b64id)
+    os.makedirs(path)
+    open(os.path.join(path, "stdout"), "w").close()
+    request.job = JobRequest.Job(job_id="1", work_dir=path)
+    return request
+
+
+def create_upload(uploads_dir, created):
+    path = uploads_dir / ("file%d" % created.timestamp())
+    path.write_text("content")
+    oid = ObjectId.from_datetime(created.astimezone())
+    return UploadedFile(_id=oid, path=str(path))
+
+
+def ids(database, cls):
+    return {item["_id"] for item in cls.collection(database).find()}
+
+
+def test_expired_jobs_deleted(database, jobs_dir):
+    expired = create_request(jobs_dir, completed=NOW - timedelta(days=8))
+    recent = create_request(jobs_dir, completed=NOW - timedelta(days=6))
+    running = create_request(jobs_dir, status=JobStatus.RUNNING)
+    insert_many(database, [expired, recent, running])
+    collector = GarbageCollector(database, jobs_dir, retention=7 * 86400)
+    assert collector.collect(NOW).jobs == 1
+    assert ids(database, JobRequest) == {recent.id, running.id}
+    assert not os.path.exists(expired.job.work_dir)
+    assert os.path.exists(recent.job.work_dir)
+
+
+def test_empty_parent_directories_deleted(database, jobs_dir):
+    expired = create_request(jobs_dir, completed=NOW - timedelta(days=8))
+    insert_many(database, [expired])
+    GarbageCollector(database, jobs_dir, retention=86400).collect(NOW)
+    assert os.listdir(jobs_dir) == []
+
+
+def test_directory_outside_jobs_directory_kept(database, jobs_dir, tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    request = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    request.job = JobRequest.Job(job_id="1", work_dir=str(outside))
+    linked = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    shutil.rmtree(linked.job.work_dir)
+    os.symlink(outside, linked.job.work_dir)
+    insert_many(database, [request, linked])
+    collector = GarbageCollector(database, jobs_dir, retention=86400)
+    assert collector.collect(NOW).jobs == 0
+    assert outside.exists()
+    assert ids(database, JobRequest) == {request.id, linked.id}
+
+
+def test_job_kept_if_directory_not_deleted(database, jobs_dir):
+    failing = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    expired = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    insert_many(database, [failing, expired])
+    rmtree = shutil.rmtree
+
+    def fake_rmtree(path):
+        if path == os.path.realpath(failing.job.work_dir):
+            raise PermissionError(path)
+        rmtree(path)
+
+    collector = GarbageCollector(
+        database, jobs_dir, retention=86400, batch_size=1, delay=0
+    )
+    with mock.patch("shutil.rmtree", side_effect=fake_rmtree):
+        assert collector.collect(NOW).jobs == 1
+    assert ids(database, JobRequest) == {failing.id}
+    assert os.path.exists(failing.job.work_dir)
+
+
+def test_rejected_job_expires_after_submission(database, jobs_dir):
+    rejected = create_request(
+        jobs_dir, status=JobStatus.REJECTED,
+        timestamp=NOW - timedelta(days=2)
+    )
+    insert_many(database, [rejected])
+    GarbageCollector(database, jobs_dir, retention=86400).collect(NOW)
+    assert ids(database, JobRequest) == set()
+
+
+def test_service_retention_overrides_default(database, jobs_dir):
+    completed = NOW - timedelta(days=3)
+    short = create_request(jobs_dir, service="short", completed=completed)
+    long = create_request(jobs_dir, service="long", completed=completed)
+    other = create_request(jobs_dir, service="other", completed=completed)
+    insert_many(database, [short, long, other])
+    collector = GarbageCollector(
+        database, jobs_dir, retention=2 * 86400,
+        service_retention={"short": 86400, "long": 7 * 86400}
+    )
+    assert collector.collect(NOW).jobs == 2
+    assert ids(database, JobRequest) == {long.id}
+
+
+def test_jobs_kept_without_retention(database, jobs_dir):
+    request = create_request(jobs_dir, completed=NOW - timedelta(days=300))
+    insert_many(database, [request])
+    collector = GarbageCollector(database, jobs_dir, service_retention={
+        "other": 86400
+    })
+    assert collector.collect(NOW).jobs == 0
+    assert ids(database, JobRequest) == {request.id}
+
+
+def test_jobs_deleted_in_batches(database, jobs_dir):
+    requests = [
+        create_request(jobs_dir, completed=NOW - timedelta(days=2))
+        for _ in range(5)
+    ]
+    insert_many(database, requests)
+    collector = GarbageCollector(
+        database, jobs_dir, retention=86400, batch_size=2, delay=0
+    )
+    assert collector.collect(NOW).jobs == 5
+    assert ids(database, JobRequest) == set()
+
+
+def test_stopped_collector_deletes_nothing(database, jobs_dir):
+    request = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    insert_many(database, [request])
+    collector = GarbageCollector(database, jobs_dir, retention=86400)
+    collector.stop()
+    assert collector.collect(NOW).jobs == 0
+
+
+def test_unused_expired_uploads_deleted(database, jobs_dir, uploads_dir):
+    expired = create_upload(uploads_dir, NOW - timedelta(days=2))
+    recent = create_upload(uploads_dir, NOW - timedelta(hours=1))
+    insert_many(database, [expired, recent])
+    collector = GarbageCollector(database, jobs_dir, uploads_retention=86400)
+    assert collector.collect(NOW).uploads == 1
+    assert ids(database, UploadedFile) == {recent.id}
+    assert not os.path.exists(expired.path)
+    assert os.path.exists(recent.path)
+
+
+def test_uploads_used_by_jobs_kept(database, jobs_dir, uploads_dir):
+    used = create_upload(uploads_dir, NOW - timedelta(days=3))
+    in_array = create_upload(uploads_dir, NOW - timedelta(days=3, seconds=1))
+    request = create_request(
+        jobs_dir, status=JobStatus.RUNNING,
+        inputs={"input": used.path, "files": [in_array.path], "flag": None},
+        timestamp=NOW - timedelta(days=2)
+    )
+    insert_many(database, [used, in_array])
+    insert_many(database, [request])
+    collector = GarbageCollector(database, jobs_dir, uploads_retention=86400)
+    assert collector.collect(NOW).uploads == 0
+    assert os.path.exists(used.path)
+    assert os.path.exists(in_array.path)
+
+
+def test_uploads_of_expired_jobs_deleted(database, jobs_dir, uploads_dir):
+    upload = create_upload(uploads_dir, NOW - timedelta(days=3))
+    request = create_request(
+        jobs_dir, inputs={"input": upload.path},
+        timestamp=NOW - timedelta(days=3),
+        completed=NOW - timedelta(days=2)
+    )
+    insert_many(database, [upload])
+    insert_many(database, [request])
+    collector = GarbageCollector(
+        database, jobs_dir, retention=86400, uploads_retention=86400
+    )
+    assert collector.collect(NOW) == (0, 1, 1)
+    assert not os.path.exists(upload.path)
+
+
+def test_used_uploads_skipped_between_batches(database, jobs_dir, uploads_dir):
+    uploads = [
+        create_upload(uploads_dir, NOW - timedelta(days=3, seconds=i))
+        for i in range(4)
+    ]
+    request = create_request(
+        jobs_dir, status=JobStatus.RUNNING,
+        inputs={"files": [uploads[3].path, uploads[2].path]},
+        timestamp=NOW - timedelta(days=2)
+    )
+    insert_many(database, uploads)
+    insert_many(database, [request])
+    collector = GarbageCollector(
+        database, jobs_dir, uploads_retention=86400, batch_size=2, delay=0
+    )
+    assert collector.collect(NOW).uploads == 2
+    assert ids(database, UploadedFile) == {uploads[2].id, uploads[3].id}
+
+
+def test_finished_jobs_archived(database, jobs_dir):
+    finished = create_request(jobs_dir, completed=NOW - timedelta(hours=2))
+    recent = create_request(jobs_dir, completed=NOW - timedelta(minutes=30))
+    running = create_request(jobs_dir, status=JobStatus.RUNNING)
+    insert_many(database, [finished, recent, running])
+    collector = GarbageCollector(database, jobs_dir, archive_after=3600)
+    assert collector.collect(NOW).archived == 1
+    assert ids(database, JobRequest) == {recent.id, running.id}
+    assert JobRequest.archive_collection(database).find_one() == finished
+    assert os.path.exists(finished.job.work_dir)
+
+
+def test_archived_job_found(database, jobs_dir):
+    request = create_request(jobs_dir, completed=NOW - timedelta(hours=2))
+    insert_many(database, [request])
+    GarbageCollector(database, jobs_dir, archive_after=3600).collect(NOW)
+    assert JobRequest.find_one(database, id=request.b64id) == request
+
+
+def test_interrupted_archival_completed(database, jobs_dir):
+    request = create_request(jobs_dir, completed=NOW - timedelta(hours=2))
+    insert_many(database, [request])
+    # the request was copied to the archive but not deleted
+    JobRequest.archive_collection(database).insert_one(dict(request))
+    collector = GarbageCollector(database, jobs_dir, archive_after=3600)
+    assert collector.collect(NOW).archived == 1
+    assert ids(database, JobRequest) == set()
+    assert JobRequest.archive_collection(database).count_documents({}) == 1
+
+
+def test_expired_archived_jobs_deleted(database, jobs_dir):
+    request = create_request(jobs_dir, completed=NOW - timedelta(days=2))
+    JobRequest.archive_collection(database).insert_one(dict(request))
+    collector = GarbageCollector(database, jobs_dir, retention=86400)
+    assert collector.collect(NOW).jobs == 1
+    assert JobRequest.archive_collection(database).count_documents({}) == 0
+    assert not os.path.exists(request.job.work_dir)
+
+
+def test_uploads_used_by_archived_jobs_kept(database, jobs_dir, uploads_dir):
+    upload = create_upload(uploads_dir, NOW - timedelta(days=3))
+    request = create_request(
+        jobs_dir, inputs={"input": upload.path},
+        timestamp=NOW - timedelta(days=2),
+        completed=NOW - timedelta(days=2)
+    )
+    insert_many(database, [upload])
+    JobRequest.archive_collection(database).insert_one(dict(request))
+    collector = GarbageCollector(database, jobs_dir, uploads_retention=86400)
+    assert collector.collect(NOW).uploads == 0
+    assert os.path.exists(upload.path)
+
+
+def test_collector_created_from_settings(database, tmp_path):
+    with open_text("test", "resources/minimal_project/settings.yaml") as stream:
+        config = yaml.safe_load(stream)
+    config.update({
+        "retention.jobs": "30d",
+        "retention.uploads": "12h",
+        "retention.archive": "1d",
+        "retention.batch-size": 50,
+    })
+    (tmp_path / "example.service.yaml").write_text(SERVICE_CONFIG)
+    settings = load_settings_0_3(config, str(tmp_path))
+    collector = garbage_collector_from_config(database, settings)
+    assert collector.retention == 30 * 86400
+    assert collector.service_retention == {"example": 3600}
+    assert collector.uploads_retention == 12 * 3600
+    assert collector.archive_after == 86400
+    assert collector.batch_size == 50
+    assert collector.delay == 1
+
+
+def test_collector_not_created_without_retention(database, tmp_path):
+    with open_text("test", "resources/minimal_project/settings.yaml") as stream:
+        config = yaml.safe_load(stream)
+    settings = load_settings_0_3(config, str(tmp_path))
+    assert garbage_collector_from_config(database, settings) is None
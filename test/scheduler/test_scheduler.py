@@ -1,14 +1,15 @@
 import os.path
+from datetime import datetime, timedelta
 from unittest import mock
 
 import bson
 import pytest
 
 from slivka import JobStatus
-from slivka.db.documents import JobRequest
+from slivka.db.documents import CancelRequest, JobRequest
 from slivka.db.helpers import delete_many, insert_many, pull_many
 from slivka.scheduler import Runner, Scheduler
-from slivka.scheduler.runners import Job, RunnerID
+from slivka.scheduler.runners import Job, ResourceUsage, RunnerID
 from slivka.scheduler.scheduler import (
     ERROR,
     REJECTED,
@@ -109,6 +110,37 @@ def test_group_requests_with_context_data(job_directory):
     }
 
 
+def test_group_requests_by_estimated_runtime(job_directory):
+    scheduler = Scheduler(job_directory)
+    local = new_runner("example", "local")
+    cluster = new_runner("example", "cluster")
+    scheduler.add_runner(local)
+    scheduler.add_runner(cluster)
+
+    def selector(inputs, context: SelectorContext):
+        if context.runtime is not None and context.runtime < 60:
+            return "local"
+        return "cluster"
+
+    scheduler.add_selector("example", selector)
+    for size in (10, 100, 1000, 10000, 100000):
+        scheduler.estimator.observe(JobRequest(
+            service="example",
+            inputs={"size": str(size)},
+            status=JobStatus.COMPLETED,
+            usage={"wall_time": size / 10},
+        ))
+    requests = [
+        JobRequest(service="example", inputs={"size": "20"}),
+        JobRequest(service="example", inputs={"size": "20000"}),
+    ]
+    grouped = scheduler.group_requests(requests)
+    assert grouped == {
+        local: in_any_order(requests[0]),
+        cluster: in_any_order(requests[1]),
+    }
+
+
 def test_group_requests_if_runner_does_not_exist(job_directory):
     scheduler = Scheduler(job_directory)
     runner1 = new_runner("example", "runner1")
@@ -225,6 +257,50 @@ class TestJobStatusUpdates:
         pull_many(database, requests)
         assert all(req.state == status for req in requests)
 
+    def test_finished_job_usage_stored(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_start,
+        mock_check_status,
+    ):
+        mock_batch_start.side_effect = lambda inputs, cwds: (
+            [Job("%04x" % i, cwd) for i, cwd in enumerate(cwds)]
+        )
+        mock_check_status.return_value = JobStatus.COMPLETED
+        usage = ResourceUsage(queue_time=1.5, wall_time=10.0, max_rss=2048)
+        with mock.patch.object(Runner, "get_usage", return_value=usage):
+            scheduler.main_loop()
+        pull_many(database, requests)
+        assert all(
+            req.usage == {
+                "queue_time": 1.5,
+                "wall_time": 10.0,
+                "cpu_time": None,
+                "max_rss": 2048,
+            }
+            for req in requests
+        )
+
+    def test_usage_failure_does_not_block_completion(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_start,
+        mock_check_status,
+    ):
+        mock_batch_start.side_effect = lambda inputs, cwds: (
+            [Job("%04x" % i, cwd) for i, cwd in enumerate(cwds)]
+        )
+        mock_check_status.return_value = JobStatus.COMPLETED
+        with mock.patch.object(Runner, "get_usage", side_effect=OSError):
+            scheduler.main_loop()
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.COMPLETED for req in requests)
+        assert all(req.usage is None for req in requests)
+
     def test_submit_deferred_job_status_not_updated(
         self, scheduler, requests, database, mock_submit
     ):
@@ -241,3 +317,212 @@ class TestJobStatusUpdates:
         scheduler.main_loop()
         pull_many(database, requests)
         assert all(req.state == JobStatus.ERROR for req in requests)
+
+    def test_jobs_held_until_runner_batch_ready(
+        self, scheduler, requests, database, mock_batch_start
+    ):
+        with mock.patch.object(Runner, "is_batch_ready", return_value=False) \
+                as mock_ready:
+            scheduler.main_loop()
+        mock_ready.assert_called_once_with(5, anything())
+        mock_batch_start.assert_not_called()
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.ACCEPTED for req in requests)
+
+    def test_start_time_set_when_job_running(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_start,
+        mock_check_status,
+    ):
+        mock_batch_start.side_effect = lambda inputs, cwds: (
+            [Job("%04x" % i, cwd) for i, cwd in enumerate(cwds)]
+        )
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        pull_many(database, requests)
+        assert all(req.start_time is not None for req in requests)
+
+
+class TestWalltimeEnforcement:
+    @pytest.fixture()
+    def runner(self):
+        runner = new_runner("example", "example")
+        runner.walltime = 60
+        return runner
+
+    @pytest.fixture()
+    def scheduler(self, job_directory, runner):
+        scheduler = Scheduler(job_directory)
+        scheduler.add_runner(runner)
+        return scheduler
+
+    @pytest.fixture()
+    def requests(self, runner):
+        requests = create_requests(2)
+        for i, request in enumerate(requests):
+            request.runner = runner.name
+            request.job = JobRequest.Job(job_id="%04x" % i, work_dir="/tmp")
+            request.status = JobStatus.RUNNING
+        return requests
+
+    def test_expired_jobs_interrupted(self, scheduler, runner, requests):
+        requests[0].start_time = datetime.now() - timedelta(minutes=2)
+        requests[1].start_time = datetime.now()
+        with mock.patch.object(Runner, "batch_cancel") as mock_cancel:
+            expired = scheduler.enforce_walltime(runner, requests)
+        mock_cancel.assert_called_once_with([("0000", "/tmp")])
+        assert expired == [requests[0]]
+        assert requests[0].status == JobStatus.INTERRUPTED
+        assert "walltime" in requests[0].status_reason
+        assert requests[1].status == JobStatus.RUNNING
+        assert requests[1].status_reason is None
+
+    def test_expired_jobs_released(self, scheduler, runner, requests):
+        requests[0].start_time = datetime.now() - timedelta(minutes=2)
+        requests[1].start_time = datetime.now()
+        with mock.patch.object(Runner, "batch_cancel"), \
+                mock.patch.object(Runner, "release_jobs") as mock_release:
+            scheduler.enforce_walltime(runner, requests)
+        mock_release.assert_called_once_with([("0000", "/tmp")])
+
+    def test_jobs_without_walltime_not_interrupted(
+        self, scheduler, runner, requests
+    ):
+        runner.walltime = None
+        for request in requests:
+            request.start_time = datetime.now() - timedelta(days=1)
+        with mock.patch.object(Runner, "batch_cancel") as mock_cancel:
+            assert scheduler.enforce_walltime(runner, requests) == []
+        mock_cancel.assert_not_called()
+
+    def test_failed_cancel_leaves_jobs_running(
+        self, scheduler, runner, requests
+    ):
+        for request in requests:
+            request.start_time = datetime.now() - timedelta(minutes=2)
+        with mock.patch.object(Runner, "batch_cancel", side_effect=OSError):
+            assert scheduler.enforce_walltime(runner, requests) == []
+        assert all(req.status == JobStatus.RUNNING for req in requests)
+
+
+class TestCancellation:
+    @pytest.fixture()
+    def scheduler(self, job_directory):
+        scheduler = Scheduler(job_directory)
+        scheduler.add_runner(new_runner("example", "first"))
+        scheduler.add_runner(new_runner("example", "second"))
+        return scheduler
+
+    @pytest.fixture()
+    def requests(self, database):
+        requests = create_requests(4)
+        for i, request in enumerate(requests):
+            request.runner = "first" if i < 3 else "second"
+            request.job = JobRequest.Job(job_id="%04x" % i, work_dir="/tmp")
+            request.status = JobStatus.RUNNING
+        insert_many(database, requests)
+        insert_many(database, [CancelRequest(req.id) for req in requests])
+        return requests
+
+    @pytest.fixture()
+    def mock_batch_cancel(self):
+        with mock.patch.object(Runner, "batch_cancel") as mock_method:
+            yield mock_method
+
+    def test_jobs_cancelled_in_batch_per_runner(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_cancel,
+        mock_check_status,
+    ):
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        mock_batch_cancel.assert_has_calls(
+            [
+                mock.call([("0000", "/tmp"), ("0001", "/tmp"), ("0002", "/tmp")]),
+                mock.call([("0003", "/tmp")]),
+            ],
+            any_order=True,
+        )
+        assert mock_batch_cancel.call_count == 2
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.CANCELLING for req in requests)
+        assert CancelRequest.collection(database).count_documents({}) == 0
+
+    def test_cancellation_sent_once(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_cancel,
+        mock_check_status,
+    ):
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        mock_batch_cancel.reset_mock()
+        # repeated cancel request of the job being cancelled
+        insert_many(database, [CancelRequest(requests[0].id)])
+        scheduler.main_loop()
+        mock_batch_cancel.assert_not_called()
+
+    def test_cancelling_jobs_monitored(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_cancel,
+        mock_check_status,
+    ):
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        mock_check_status.return_value = JobStatus.INTERRUPTED
+        scheduler.main_loop()
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.INTERRUPTED for req in requests)
+
+    def test_failed_cancel_does_not_stop_scheduler(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_cancel,
+        mock_check_status,
+    ):
+        mock_batch_cancel.side_effect = OSError
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        assert mock_batch_cancel.call_count == 2
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.RUNNING for req in requests)
+
+    def test_failed_cancel_retried(
+        self,
+        scheduler,
+        requests,
+        database,
+        mock_batch_cancel,
+        mock_check_status,
+    ):
+        failures = [OSError()]
+
+        def batch_cancel(jobs):
+            # the jobs of the second runner fail once
+            if jobs[0].id == "0003" and failures:
+                raise failures.pop()
+
+        mock_batch_cancel.side_effect = batch_cancel
+        mock_check_status.return_value = JobStatus.RUNNING
+        scheduler.main_loop()
+        pull_many(database, requests)
+        assert requests[3].state == JobStatus.RUNNING
+        cancel_requests = CancelRequest.collection(database)
+        assert cancel_requests.count_documents({"job_id": requests[3].id}) == 1
+        scheduler.main_loop()
+        pull_many(database, requests)
+        assert all(req.state == JobStatus.CANCELLING for req in requests)
+        assert cancel_requests.count_documents({}) == 0
@@ -375,6 +375,121 @@ class TestJobViewForExistingJob:
     def test_job_status_is_pending(self, job_info):
         assert job_info["status"] == "PENDING"
 
+    def test_job_usage_is_none(self, job_info):
+        assert job_info["usage"] is None
+
+    def test_job_estimated_completion_time_is_none(self, job_info):
+        assert job_info["estimatedCompletionTime"] is None
+
+    def test_job_status_reason_is_none(self, job_info):
+        assert job_info["statusReason"] is None
+
+
+class TestJobViewForQueuedJobEstimate:
+    @pytest.fixture(scope="class")
+    def job_request(self, database):
+        request = JobRequest(
+            service="fake",
+            inputs={"text-param": "foobar"},
+            timestamp=datetime(2023, 6, 18),
+            status=JobStatus.QUEUED,
+            estimated_completion_time=datetime(2023, 6, 18, 0, 10),
+        )
+        insert_one(database, request)
+        yield request
+        delete_one(database, request)
+
+    @pytest.fixture(scope="class")
+    def job_request_id(self, job_request):
+        return job_request.b64id
+
+    def test_job_estimated_completion_time(self, job_info):
+        assert job_info["estimatedCompletionTime"] == "2023-06-18T00:10:00"
+
+
+class TestJobViewForFinishedJobUsage:
+    @pytest.fixture(scope="class")
+    def job_request(self, database):
+        request = JobRequest(
+            service="fake",
+            inputs={"text-param": "foobar"},
+            timestamp=datetime(2023, 6, 18),
+            completion_time=datetime(2023, 6, 18, 0, 5),
+            status=JobStatus.COMPLETED,
+            usage={
+                "queue_time": 12.5,
+                "wall_time": 287.5,
+                "cpu_time": 1150.25,
+                "max_rss": 204800,
+            },
+        )
+        insert_one(database, request)
+        yield request
+        delete_one(database, request)
+
+    @pytest.fixture(scope="class")
+    def job_request_id(self, job_request):
+        return job_request.b64id
+
+    def test_job_usage(self, job_info):
+        assert job_info["usage"] == {
+            "queueTime": 12.5,
+            "wallTime": 287.5,
+            "cpuTime": 1150.25,
+            "maxRss": 204800,
+        }
+
+
+class TestJobViewForInterruptedJobReason:
+    @pytest.fixture(scope="class")
+    def job_request(self, database):
+        request = JobRequest(
+            service="fake",
+            inputs={"text-param": "foobar"},
+            timestamp=datetime(2023, 6, 18),
+            completion_time=datetime(2023, 6, 18, 1, 0),
+            status=JobStatus.INTERRUPTED,
+            status_reason="Exceeded the walltime of 3600 seconds.",
+        )
+        insert_one(database, request)
+        yield request
+        delete_one(database, request)
+
+    @pytest.fixture(scope="class")
+    def job_request_id(self, job_request):
+        return job_request.b64id
+
+    def test_job_status_reason(self, job_info):
+        assert job_info["statusReason"] == \
+            "Exceeded the walltime of 3600 seconds."
+
+
+class TestJobViewForArchivedJob:
+    @pytest.fixture(scope="class")
+    def job_request(self, database):
+        request = JobRequest(
+            _id=ObjectId(),
+            service="fake",
+            inputs={"text-param": "foobar"},
+            timestamp=datetime(2023, 6, 18),
+            completion_time=datetime(2023, 6, 18, 0, 5),
+            status=JobStatus.COMPLETED,
+        )
+        archive = JobRequest.archive_collection(database)
+        archive.insert_one(request)
+        yield request
+        archive.delete_one({"_id": request.id})
+
+    @pytest.fixture(scope="class")
+    def job_request_id(self, job_request):
+        return job_request.b64id
+
+    def test_status_code(self, job_view_response):
+        assert job_view_response.status_code == 200
+
+    def test_job_status(self, job_info):
+        assert job_info["status"] == "COMPLETED"
+
 
 class TestJobViewForNonExistingJob:
     @pytest.fixture(scope="class", params=["AADSHA1yHug3LAWY", "invalid"])